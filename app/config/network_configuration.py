@@ -1,5 +1,6 @@
 import logging
-from os import environ
+import tempfile
+from os import environ, path
 
 log = logging.getLogger(__name__)
 
@@ -95,3 +96,97 @@ def network_external_validators_configmap():
     if external_validators_configmap is None:
         return "external-validators"
     return external_validators_configmap
+
+
+def ws_pool_capacity():
+    return int(environ.get('WS_POOL_CAPACITY', '64'))
+
+
+def ws_pool_idle_timeout():
+    # seconds after which an unused connection is closed
+    return int(environ.get('WS_POOL_IDLE_TIMEOUT', '600'))
+
+
+def ws_pool_keepalive_interval():
+    # seconds between two keepalive pings of the pooled connections (0 to disable)
+    return int(environ.get('WS_POOL_KEEPALIVE_INTERVAL', '30'))
+
+
+def metadata_cache_dir():
+    # Directory shared by the workers to cache runtime metadata (empty to disable)
+    return environ.get('METADATA_CACHE_DIR', path.join(tempfile.gettempdir(), 'testnet-manager', 'metadata'))
+
+
+def derived_keys_cache_size():
+    # Maximum number of derived keypairs (and public keys) kept in memory
+    return int(environ.get('DERIVED_KEYS_CACHE_SIZE', '10000'))
+
+
+def derived_keys_snapshot_path():
+    # File where the derived public keys are persisted (encrypted with the root seed) across restarts, unset to disable
+    return environ.get('DERIVED_KEYS_SNAPSHOT')
+
+
+def kubernetes_informers_enabled():
+    # Serve pods, StatefulSets and ConfigMap lookups from watched in-memory copies instead of listing them each time
+    return environ.get('KUBERNETES_INFORMERS', 'true').lower() == 'true'
+
+
+def storage_cache_size():
+    # Maximum number of storage values (read at a given block hash) kept in memory
+    return int(environ.get('STORAGE_CACHE_SIZE', '4096'))
+
+
+def fleet_scan_concurrency():
+    # Maximum number of nodes queried at the same time for their live status
+    return int(environ.get('FLEET_SCAN_CONCURRENCY', '32'))
+
+
+def fleet_scan_timeout():
+    # Seconds after which a node not answering its live status is reported as not ready
+    return float(environ.get('FLEET_SCAN_TIMEOUT', '2'))
+
+
+def registration_concurrency():
+    # Number of validators set up at the same time by each stage of the registration (rotate keys, set keys)
+    return int(environ.get('REGISTRATION_CONCURRENCY', '16'))
+
+
+def registration_node_timeout():
+    # Seconds allowed to each stage of the registration of a validator node
+    return float(environ.get('REGISTRATION_NODE_TIMEOUT', '120'))
+
+
+def balance_monitor_min_funds():
+    # Managed accounts with less funds (in tokens) are topped up by the balance monitor task
+    return float(environ.get('BALANCE_MONITOR_MIN_FUNDS', '0.5'))
+
+
+def balance_monitor_top_up_amount():
+    # Amount (in tokens) transferred to each account topped up by the balance monitor task
+    return int(environ.get('BALANCE_MONITOR_TOP_UP_AMOUNT', '1'))
+
+
+def runtime_store_dir():
+    # Directory where the uploaded runtimes are stored by code hash, to submit them again without uploading them
+    return environ.get('RUNTIME_STORE_DIR', path.join(tempfile.gettempdir(), 'testnet-manager', 'runtimes'))
+
+
+def parachain_upgrade_authorization_timeout():
+    # Seconds to wait for the parachain to process the AuthorizeUpgrade XCM sent from the relay-chain
+    return float(environ.get('PARACHAIN_UPGRADE_AUTHORIZATION_TIMEOUT', '60'))
+
+
+def parachain_upgrade_enactment_timeout():
+    # Seconds to wait for the applied parachain runtime to be enacted
+    return float(environ.get('PARACHAIN_UPGRADE_ENACTMENT_TIMEOUT', '600'))
+
+
+def teleport_arrival_timeout():
+    # Seconds to wait for funds teleported from the relay-chain to arrive on the parachain accounts
+    return float(environ.get('TELEPORT_ARRIVAL_TIMEOUT', '120'))
+
+
+def extrinsic_inclusion_timeout():
+    # Seconds to wait for the inclusion of a submitted extrinsic
+    return float(environ.get('EXTRINSIC_INCLUSION_TIMEOUT', '120'))
@@ -1,7 +1,21 @@
-# Dictionary to store SubstrateInterface Objects
-# { network_name: SubstrateInterface Object }
+from functools import partial
+
+from app.config.network_configuration import ws_pool_capacity, ws_pool_idle_timeout, ws_pool_keepalive_interval, \
+    metadata_cache_dir, registration_concurrency
+from app.lib.connection_pool import SubstrateConnectionPool, PooledSubstrateInterface
+
+# Pool of SubstrateInterface Objects
+# { url: SubstrateInterface Object }
 # Why? the first query takes ~1 second because it pulls metadata from the network,
 # the following queries are much faster, by reusing the connection we can speed up the process.
-# todo: if we face a problem with the connection pool add a cron to clean it once an hour
-# Note: because we use gunicorn each worker will have it own pool
-network_connection_pool = {}
+# The pool is bounded (LRU), idle connections are closed and live ones are kept alive by a background thread.
+# Connections checked out for an exclusive use (eg. by the registration workers) are bounded by the registration
+# concurrency once checked in.
+# Note: because we use gunicorn each worker will have it own pool, but the runtime metadata is cached on disk
+# (see metadata_cache.py) so a new worker or a new node of a known runtime doesn't pull it again.
+network_connection_pool = SubstrateConnectionPool(capacity=ws_pool_capacity(),
+                                                  idle_timeout=ws_pool_idle_timeout(),
+                                                  keepalive_interval=ws_pool_keepalive_interval(),
+                                                  max_dedicated_clients=registration_concurrency(),
+                                                  client_factory=partial(PooledSubstrateInterface,
+                                                                         metadata_cache_dir=metadata_cache_dir()))
@@ -1,7 +1,8 @@
 import logging
 
 from substrateinterface import Keypair, KeypairType
-from app.lib.substrate import substrate_batchall_call, substrate_call, substrate_rpc_request, get_chain_properties
+from app.lib.substrate import substrate_batchall_call, substrate_call, substrate_rpc_request, get_chain_properties, \
+    map_future, BatchReceipt, query_storage_multi
 
 log = logging.getLogger('balance_utils')
 
@@ -21,7 +22,17 @@ def get_funds(substrate_client, address):
         return 0
 
 
-def transfer_funds(substrate_client, from_account_keypair, target_account_address_list, transfer_amount, add_token_decimals=True):
+# Accounts of a failed batch of calls (one per account): only the ones of the failed chunks if it was split
+def failed_accounts(target_account_address_list, receipt):
+    if isinstance(receipt, BatchReceipt):
+        return list(map(lambda index: target_account_address_list[index], receipt.failed_indexes()))
+    return target_account_address_list
+
+
+# pipelined: submit without waiting for the previous extrinsics of from_account_keypair, returns a
+# concurrent.futures.Future of the result (see substrate_call)
+def transfer_funds(substrate_client, from_account_keypair, target_account_address_list, transfer_amount, add_token_decimals=True,
+                   pipelined=False):
     chain_properties = get_chain_properties(substrate_client)
     log.info(
         f"Transferring funds: {transfer_amount} {chain_properties.get('tokenSymbol','UNIT')} from {from_account_keypair} to Account={target_account_address_list}")
@@ -38,16 +49,22 @@ def transfer_funds(substrate_client, from_account_keypair, target_account_addres
             'dest': target_account_address,
             'value': transfer_amount * 10 ** token_decimals
         }))
-    receipt = substrate_batchall_call(substrate_client, from_account_keypair, batch_call)
-    if receipt and receipt.is_success:
-        return True
-    else:
-        log.error("Balance Transfer to Accounts={} failed. Error: {}".format(
-            target_account_address_list, getattr(receipt, 'error_message', None)))
-        return None
+    def check_transfer(receipt):
+        if receipt and receipt.is_success:
+            return True
+        else:
+            log.error("Balance Transfer to Accounts={} failed. Error: {}".format(
+                failed_accounts(target_account_address_list, receipt), getattr(receipt, 'error_message', None)))
+            return None
+    if pipelined:
+        return map_future(substrate_batchall_call(substrate_client, from_account_keypair, batch_call, pipelined=True),
+                          check_transfer)
+    return check_transfer(substrate_batchall_call(substrate_client, from_account_keypair, batch_call))
 
 
-def teleport_funds(substrate_client, from_account_keypair, para_id, target_account_address_list, transfer_amount):
+# pipelined: see transfer_funds
+def teleport_funds(substrate_client, from_account_keypair, para_id, target_account_address_list, transfer_amount,
+                   pipelined=False):
     chain_properties = get_chain_properties(substrate_client)
     log.info(
         f"Teleporting funds: {transfer_amount} {chain_properties.get('tokenSymbol','UNIT')} from {from_account_keypair} to Para #{para_id} Account={target_account_address_list}")
@@ -101,25 +118,69 @@ def teleport_funds(substrate_client, from_account_keypair, para_id, target_accou
             'weight_limit': 'Unlimited',
             }
         ))
-    receipt = substrate_batchall_call(substrate_client, from_account_keypair, batch_call)
-    if receipt and receipt.is_success:
-        return True
-    else:
-        log.error("Teleport to Accounts={} failed. Error: {}".format(
-            target_account_address_list, getattr(receipt, 'error_message', None)))
+    def check_teleport(receipt):
+        if receipt and receipt.is_success:
+            return True
+        else:
+            log.error("Teleport to Accounts={} failed. Error: {}".format(
+                failed_accounts(target_account_address_list, receipt), getattr(receipt, 'error_message', None)))
+            return None
+    if pipelined:
+        return map_future(substrate_batchall_call(substrate_client, from_account_keypair, batch_call, pipelined=True),
+                          check_teleport)
+    return check_teleport(substrate_batchall_call(substrate_client, from_account_keypair, batch_call))
+
+
+# Free balance of each address read with a single request: {address: funds}, None on error
+def get_funds_multi(substrate_client, addresses):
+    try:
+        accounts = query_storage_multi(substrate_client, 'System', 'Account', list(map(lambda address: [address], addresses)))
+    except Exception as e:
+        log.error("Failed to query the accounts of {}, Error: {}".format(addresses, e))
         return None
+    return {address: int(account['data']['free']) if account else 0 for address, account in zip(addresses, accounts)}
 
 
-def fund_accounts(substrate_client, addresses, funding_account_seed):
-    funding_account_keypair = Keypair.create_from_seed(funding_account_seed)
+# Top up the addresses having less than min_funds (in tokens) on the chain of balance_client with a single batch:
+# transfers on the funding chain (balance_client defaults to funding_client) or, when para_id is set, teleports from
+# the funding chain (relay-chain) to the parachain (balance_client is required). Returns the addresses topped up.
+def top_up_accounts(funding_client, funding_account_keypair, addresses, min_funds=0.5, top_up_amount=1, para_id=None,
+                    balance_client=None):
+    if funding_client is None:
+        log.error('Unable to top up accounts: no client to send the funds')
+        return []
+    if para_id is not None and balance_client is None:
+        # the relay-chain balances of the accounts are not their balances on the parachain
+        log.error('Unable to top up accounts on parachain #{}: no parachain client to query their funds'.format(para_id))
+        return []
+    balance_client = balance_client or funding_client
+    addresses = list(dict.fromkeys(addresses))
+    if not addresses:
+        return []
+    token_decimals = get_chain_properties(balance_client).get('tokenDecimals', 12)
+    funds = get_funds_multi(balance_client, addresses)
+    if funds is None:
+        return []
     target_account_address_list = []
-    token_decimals = get_chain_properties(substrate_client).get('tokenDecimals', 12)
     for address in addresses:
-        address_funds = get_funds(substrate_client, address)
-        log.info('address={} (funds={})'.format(address, address_funds))
-        if address_funds < 0.5 * 10 ** token_decimals:  # < 0.5 UNIT
+        address_funds = funds[address]
+        log.debug('address={} (funds={})'.format(address, address_funds))
+        if address_funds < min_funds * 10 ** token_decimals:
             log.info(
-                'address={} is not properly funded (funds={}), schedule transferring funds from sudo account'.format(
-                    address, address_funds))
+                'address={} is not properly funded (funds={}), schedule transferring funds from {}'.format(
+                    address, address_funds, funding_account_keypair.ss58_address))
             target_account_address_list.append(address)
-    transfer_funds(substrate_client, funding_account_keypair, target_account_address_list, 1)
+    if not target_account_address_list:
+        return []
+    if para_id is None:
+        result = transfer_funds(funding_client, funding_account_keypair, target_account_address_list, top_up_amount)
+    else:
+        result = teleport_funds(funding_client, funding_account_keypair, para_id, target_account_address_list,
+                                top_up_amount)
+    return target_account_address_list if result else []
+
+
+def fund_accounts(substrate_client, addresses, funding_account_seed):
+    funding_account_keypair = Keypair.create_from_seed(funding_account_seed)
+    # < 0.5 UNIT
+    top_up_accounts(substrate_client, funding_account_keypair, addresses, 0.5, 1)
@@ -1,30 +1,16 @@
+import asyncio
 import logging
 
-from substrateinterface import Keypair
-
-from app.lib.collator_account import get_moon_keypair_from_uri
-from app.lib.collator_moonbeam import get_moon_node_collator_uri, register_moon_collator
-from app.config.network_configuration import derivation_root_seed
+from app.lib.collator_account import get_derived_collator_account, get_derived_moon_collator_account
+from app.lib.collator_moonbeam import register_moon_collator
 from app.lib.collator_tick import register_tick_collator
-from app.lib.collator_mint import register_mint_collator, deregister_mint_collator
+from app.lib.collator_mint import register_mint_collator, deregister_mint_collator, register_mint_collators
 from app.lib.kubernetes_client import list_collator_pods
 from app.lib.substrate import substrate_sudo_relay_xcm_call, get_node_client, get_query_weight
 
 log = logging.getLogger('collator_manager')
 
 
-def get_derived_collator_account(node_name, ss58_format):
-    key_seed = derivation_root_seed()
-    keypair = Keypair.create_from_uri(key_seed + "//collator//" + node_name, ss58_format=int(ss58_format))
-    return keypair.ss58_address
-
-
-def get_derived_moon_collator_account(node_name):
-    key_seed = derivation_root_seed()
-    keypair = get_moon_keypair_from_uri(get_moon_node_collator_uri(key_seed, node_name))
-    return keypair.ss58_address
-
-
 def get_moon_collator_status(node_account, selected_candidates, candidate_pool):
     log.debug(f'Getting Moon collator status for: node_account={node_account}, selected_candidates={selected_candidates}, candidates={candidate_pool}')
 
@@ -65,6 +51,14 @@ async def collator_register(chain, node_name, ss58_format):
         return None
 
 
+# register several collators, mint-based collators are registered together (see register_mint_collators)
+async def collators_register(chain, node_names, ss58_format):
+    if chain.endswith("mint") or chain.endswith("mine"):
+        log.info('Detected that collators are mint-based {}'.format(chain))
+        return await asyncio.to_thread(register_mint_collators, node_names, ss58_format)
+    return await asyncio.gather(*map(lambda node_name: collator_register(chain, node_name, ss58_format), node_names))
+
+
 async def collator_deregister(chain, node_name, ss58_format):
     if chain.startswith("moon"):
         log.info('Detected that collators are moon-based {}'.format(chain))
@@ -1,66 +1,105 @@
+import asyncio
 import logging
-import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from substrateinterface import Keypair
 
 from app.config.network_configuration import derivation_root_seed, get_relay_chain_ss58_format, \
-    network_sudo_seed
-from app.lib.balance_utils import transfer_funds, teleport_funds
+    network_sudo_seed, registration_concurrency, teleport_arrival_timeout
+from app.lib.balance_utils import transfer_funds, teleport_funds, get_funds_multi
 from app.lib.collator_account import get_derived_collator_keypair, get_derived_collator_seed, get_derived_collator_session_keys
+from app.lib.derived_keys import get_derived_keypair
 from app.lib.node_utils import inject_key, node_keystore_has_key, check_has_session_keys
 from app.lib.session_keys import set_node_session_key
-from app.lib.stash_accounts import get_account_funds
 from app.lib.substrate import get_node_client, substrate_sudo_relay_xcm_call, get_relay_chain_client, \
     get_chain_properties
-from app.lib.substrate import substrate_call, get_query_weight
+from app.lib.substrate import substrate_call, get_query_weight, wait_for_futures
+from app.lib.substrate_async import async_wait_for_funds
 
 log = logging.getLogger('collator_mint')
 
+# Bound the number of collators setting their session keys at the same time
+collator_keys_executor = ThreadPoolExecutor(max_workers=registration_concurrency(), thread_name_prefix='collator-keys')
+
 
 def register_mint_collator(node_name, ss58_format, rotate_key=False):
+    return register_mint_collators([node_name], ss58_format, rotate_key)[0]
+
+
+def set_mint_collator_session_keys(node_name):
     try:
-        # 1. Generating stash account keypair
         node_client = get_node_client(node_name)
-        keypair_rich = Keypair.create_from_uri(derivation_root_seed(), ss58_format=int(ss58_format))
         collator_seed = get_derived_collator_seed(node_name)
-        keypair = get_derived_collator_keypair(node_name, ss58_format)
+        inject_key(node_client, collator_seed)
+        session_key = node_client.rpc_request(method="author_rotateKeys", params=[])['result']
+        if set_node_session_key(node_client.url, collator_seed, session_key):
+            return True
+        log.error("Unable to rotate session key for node: {}".format(getattr(node_client, 'url', 'NO_URL')))
+    except Exception as e:
+        log.error("Unable to set session keys of collator {}. Error: {}".format(node_name, e))
+    return False
+
+
+# Register the collators of a mint-based chain together, with a few extrinsics:
+#  1. fund all the collator accounts with a single batch
+#  2. set the session keys of the collators concurrently (each collator signs its own extrinsic)
+#  3. increase the desired candidate count with a single XCM from the relay-chain
+#  4. submit all the register_as_candidate extrinsics at the same time
+# rotate_key: also rotate the session keys of the collators which are already candidates
+# Returns the address of each collator (None if its registration failed)
+def register_mint_collators(node_names, ss58_format, rotate_key=False):
+    collator_addresses = list(map(lambda node_name: get_derived_collator_keypair(node_name, ss58_format).ss58_address,
+                                  node_names))
+    registered = {}
+    try:
+        node_client = get_node_client(node_names[0])
         candidates = node_client.query('CollatorSelection', 'Candidates').value
+        candidate_addresses = set(map(lambda candidate: candidate['who'].lower(), candidates))
+        nodes_to_register = []
+        candidate_nodes = []
+        for node_name, collator_address in zip(node_names, collator_addresses):
+            if collator_address.lower() in candidate_addresses:
+                log.info("Collator is already in candidate list ({}, {})".format(collator_address, node_name))
+                candidate_nodes.append(node_name)
+            else:
+                nodes_to_register.append(node_name)
+        if rotate_key and candidate_nodes:
+            keys_set = collator_keys_executor.map(set_mint_collator_session_keys, candidate_nodes)
+            registered.update(zip(candidate_nodes, keys_set))
+        else:
+            registered.update(dict.fromkeys(candidate_nodes, True))
+        if not nodes_to_register:
+            return registered_addresses(node_names, collator_addresses, registered)
+        addresses_to_register = [collator_addresses[node_names.index(node_name)] for node_name in nodes_to_register]
 
-        if not any(d['who'].lower() == keypair.ss58_address.lower() for d in candidates) or rotate_key:
-            # 2. Check enough funds
-            candidacy_bond = node_client.query('CollatorSelection', 'CandidacyBond', params=[]).value
-            account_info = node_client.query('System', 'Account', params=[keypair.ss58_address]).value
-            chain_properties = get_chain_properties(node_client)
-            token_decimals = chain_properties.get('tokenDecimals', 9)
-            log.info("Check that {}({}) have more than {}".format(
-                keypair.ss58_address, account_info['data']['free'], candidacy_bond))
-            if account_info['data']['free'] < candidacy_bond + 0.1*10**token_decimals:
-                print("Funding {}".format(keypair.ss58_address))
-                # candidacyBond + 1 tx fee
-                result = transfer_funds(node_client, keypair_rich, [keypair.ss58_address], candidacy_bond + 1*10**token_decimals, False)
-                if result == None:
-                    # exit, failed to fund account
-                    log.error("Unable fund account: {}, node: {}".format(
-                        keypair.ss58_address, getattr(node_client, 'url', 'NO_URL')))
-                    return None
-
-
-            # # 2. inject key
-            inject_key(node_client, collator_seed)
-
-            # 3. Generating and setting session keys
-            session_key = node_client.rpc_request(method="author_rotateKeys", params=[])['result']
-            result = set_node_session_key(node_client.url, collator_seed, session_key)
-            if not result:
-                # exit, failed to rotate key
-                log.error("Unable to rotate session key for node: {}".format(getattr(node_client, 'url', 'NO_URL')))
-                return None
+        # 1. Fund the collator accounts: candidacyBond + 1 tx fee
+        candidacy_bond = node_client.query('CollatorSelection', 'CandidacyBond', params=[]).value
+        token_decimals = get_chain_properties(node_client).get('tokenDecimals', 9)
+        funds = get_funds_multi(node_client, addresses_to_register)
+        if funds is None:
+            raise Exception('Unable to read the funds of the collator accounts')
+        addresses_to_fund = list(filter(lambda address: funds[address] < candidacy_bond + 0.1 * 10 ** token_decimals,
+                                        addresses_to_register))
+        if addresses_to_fund:
+            log.info("Funding {}".format(addresses_to_fund))
+            keypair_rich = get_derived_keypair(derivation_root_seed(), '', ss58_format)
+            if not transfer_funds(node_client, keypair_rich, addresses_to_fund,
+                                  candidacy_bond + 1 * 10 ** token_decimals, False):
+                raise Exception('Unable to fund accounts: {}'.format(addresses_to_fund))
 
-            # 4. Increase the desired candidate count
-            desired_candidates = node_client.query('CollatorSelection', 'DesiredCandidates')
-            new_desired_candidates = len(node_client.query('CollatorSelection', 'Candidates').value) + 1
-            log.info("Increase the desired candidate count from {} to {}".format(desired_candidates, new_desired_candidates))
+        # 2. Generate and set the session keys
+        keys_set = collator_keys_executor.map(set_mint_collator_session_keys, nodes_to_register)
+        nodes_to_register = [node_name for node_name, is_set in zip(nodes_to_register, keys_set) if is_set]
+        if not nodes_to_register:
+            raise Exception('Unable to set the session keys of the collators')
+
+        # 3. Increase the desired candidate count
+        desired_candidates = node_client.query('CollatorSelection', 'DesiredCandidates').value
+        new_desired_candidates = len(candidates) + len(nodes_to_register)
+        if new_desired_candidates > desired_candidates:
+            log.info("Increase the desired candidate count from {} to {}".format(desired_candidates,
+                                                                                 new_desired_candidates))
             call = node_client.compose_call(
                 call_module='CollatorSelection',
                 call_function='set_desired_candidates',
@@ -68,7 +107,6 @@ def register_mint_collator(node_name, ss58_format, rotate_key=False):
                     'max': new_desired_candidates
                 }
             )
-
             encoded_call = call.encode()
             weight = get_query_weight(node_client, call)
             para_id = node_client.query('ParachainInfo', 'ParachainId', params=[]).value
@@ -76,61 +114,42 @@ def register_mint_collator(node_name, ss58_format, rotate_key=False):
             if receipt and receipt.is_success:
                 log.info("✅ Success: desired candidate increased to {}".format(new_desired_candidates))
             else:
-                log.error("Failed to run xcm call, network: {}, para_id {}, message: {}, err: ".format(
+                raise Exception("Failed to run xcm call, para_id {}, message: {}, err: {}".format(
                     para_id, encoded_call, getattr(receipt, 'error_message', None)))
-                return None
 
-            # 5. Register as Collator candidate
-            call = node_client.compose_call(
-                call_module='CollatorSelection',
-                call_function='register_as_candidate',
-            )
-            receipt = substrate_call(node_client, keypair, call)
+        # 4. Register as Collator candidates, the extrinsics of the collators (different accounts) are pipelined
+        call = node_client.compose_call(
+            call_module='CollatorSelection',
+            call_function='register_as_candidate',
+        )
+        receipts = wait_for_futures(list(map(
+            lambda node_name: substrate_call(node_client, get_derived_collator_keypair(node_name, ss58_format), call,
+                                             pipelined=True), nodes_to_register)))
+        for node_name, receipt in zip(nodes_to_register, receipts):
             if receipt and receipt.is_success:
-                return keypair.ss58_address
+                registered[node_name] = True
             else:
                 log.error("Unable to register as candidate node: {}, Error: {}".format(
-                    getattr(node_client, 'url', 'NO_URL'), getattr(receipt, 'error_message', None)))
-                return None
-        else:
-            log.info("Collator is already in candidate list ({}, {})".format(keypair.ss58_address, getattr(node_client, 'url', 'NO_URL')))
-            return keypair.ss58_address
-
+                    node_name, getattr(receipt, 'error_message', None)))
     except Exception as e:
-        log.error("Unable to register_mint_collator. Error: {}, stacktrace:\n".format(e, traceback.print_exc()))
-        return None
+        log.error("Unable to register_mint_collators. Error: {}".format(e))
+    return registered_addresses(node_names, collator_addresses, registered)
+
 
+def registered_addresses(node_names, collator_addresses, registered):
+    return [collator_address if registered.get(node_name) else None
+            for node_name, collator_address in zip(node_names, collator_addresses)]
 
-def collator_set_keys(node_name, para_id, ss58_format):
+
+def collator_set_aura_key(node_name):
     try:
-        # 1. Get collator account keypair
-        collator_keypair = get_derived_collator_keypair(node_name, ss58_format)
-        collator_account_address = collator_keypair.ss58_address
         aura_public_key = get_derived_collator_session_keys(node_name)['aura']
-        # 2. Check funds
-        log.info("Check that {} has enough funds".format(collator_account_address))
         node_client = get_node_client(node_name)
-        collator_account_funds = get_account_funds(node_client.url, collator_account_address)
-        # 3. If insufficient, add funds with teleport
-        token_decimals = get_chain_properties(node_client).get('tokenDecimals', 12)
-        if collator_account_funds < 0.5 * 10 ** token_decimals:
-            relay_chain_client = get_relay_chain_client()
-            sudo_keypair = Keypair.create_from_seed(network_sudo_seed())
-            log.info(f"Funding {collator_account_address}[ss58format={ss58_format}](funds={collator_account_funds}) via Teleport from relay-chain")
-            # Get corresponding collator account address on the relay-chain (with the relay-chain ss58 format)
-            relay_chain_collator_account = get_derived_collator_keypair(node_name, get_relay_chain_ss58_format()).ss58_address
-            teleport_result = teleport_funds(relay_chain_client, sudo_keypair, para_id, [relay_chain_collator_account], 1)
-            if not teleport_result:
-                log.error("Unable fund account: {}, node: {}".format(
-                    collator_account_address, getattr(relay_chain_client, 'url', 'NO_URL')))
-                return None
-            log.info("Waiting 1 minute for teleport to complete")
-            time.sleep(60)
-        # 4. Check node has aura key
+        # Check node has aura key
         if not node_keystore_has_key(node_client, 'aura', aura_public_key):
             log.error(f'Node ({node_name}) doesn\'t have the required aura key in its keystore')
             return None
-        # 5. Setting aura key on chain via "set session key" if not already set
+        # Setting aura key on chain via "set session key" if not already set
         if check_has_session_keys(node_client, {'aura': aura_public_key}):
             collator_seed_phrase = get_derived_collator_seed(node_name)
             set_session_key_result = set_node_session_key(node_client.url, collator_seed_phrase, aura_public_key)
@@ -138,15 +157,63 @@ def collator_set_keys(node_name, para_id, ss58_format):
                 log.error(f"Unable to set session key for node: {node_client.url}, session_key={aura_public_key}")
                 return None
         log.info(f"✅ Success: Set session key for node: {node_name}, session_key={aura_public_key}")
+        return True
     except Exception as e:
-        log.error("Unable to collator_set_keys. Error: {}, stacktrace:\n".format(e, traceback.print_exc()))
+        log.error("Unable to collator_set_aura_key. Error: {}, stacktrace:\n".format(e, traceback.print_exc()))
         return None
 
 
+# Set the aura keys of collators of a parachain on chain. The collator accounts without enough funds are funded with
+# a single teleport batch from the relay-chain, and their keys are set as soon as the funds arrive on the parachain.
+# nodes: [(node_name, ss58_format)], returns the names of the nodes for which the keys are set
+async def collators_set_keys(para_id, nodes):
+    try:
+        node_client = await asyncio.to_thread(get_node_client, nodes[0][0])
+        collator_addresses = {node_name: get_derived_collator_keypair(node_name, ss58_format).ss58_address
+                              for node_name, ss58_format in nodes}
+        # 1. Check funds
+        token_decimals = (await asyncio.to_thread(get_chain_properties, node_client)).get('tokenDecimals', 12)
+        min_funds = 0.5 * 10 ** token_decimals
+        funds = await asyncio.to_thread(get_funds_multi, node_client, list(collator_addresses.values()))
+        if funds is None:
+            return []
+        node_names = list(collator_addresses)
+        nodes_to_fund = list(filter(lambda node_name: funds[collator_addresses[node_name]] < min_funds, node_names))
+        # 2. If insufficient, add funds with teleport
+        if nodes_to_fund:
+            relay_chain_client = await asyncio.to_thread(get_relay_chain_client)
+            sudo_keypair = Keypair.create_from_seed(network_sudo_seed())
+            log.info(f"Funding collators {nodes_to_fund} via Teleport from relay-chain")
+            # Get corresponding collator account addresses on the relay-chain (with the relay-chain ss58 format)
+            relay_chain_collator_accounts = list(map(
+                lambda node_name: get_derived_collator_keypair(node_name, get_relay_chain_ss58_format()).ss58_address,
+                nodes_to_fund))
+            teleport_result = await asyncio.to_thread(teleport_funds, relay_chain_client, sudo_keypair, para_id,
+                                                      relay_chain_collator_accounts, 1)
+            funded_addresses = set()
+            if teleport_result:
+                log.info("Waiting for teleport to complete")
+                funded_addresses = await async_wait_for_funds(
+                    node_client, list(map(lambda node_name: collator_addresses[node_name], nodes_to_fund)),
+                    min_funds, teleport_arrival_timeout())
+            for node_name in nodes_to_fund:
+                if collator_addresses[node_name] not in funded_addresses:
+                    log.error("Unable fund account: {}, node: {}".format(collator_addresses[node_name], node_name))
+                    node_names.remove(node_name)
+        # 3. Set the aura keys
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*map(
+            lambda node_name: loop.run_in_executor(collator_keys_executor, collator_set_aura_key, node_name),
+            node_names))
+        return [node_name for node_name, result in zip(node_names, results) if result]
+    except Exception as e:
+        log.error("Unable to collators_set_keys. Error: {}, stacktrace:\n".format(e, traceback.print_exc()))
+        return []
+
+
 def deregister_mint_collator(node_name, ss58_format):
     node_client = get_node_client(node_name)
-    collator_seed = get_derived_collator_seed(node_name)
-    keypair = Keypair.create_from_uri(collator_seed, ss58_format=int(ss58_format))
+    keypair = get_derived_collator_keypair(node_name, ss58_format)
     try:
         candidates = node_client.query('CollatorSelection', 'Candidates').value
         if any(d['who'].lower() == keypair.ss58_address.lower() for d in candidates):
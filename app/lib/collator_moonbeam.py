@@ -2,7 +2,7 @@ import logging
 
 from substrateinterface import Keypair, KeypairType
 
-from app.lib.collator_account import get_moon_root_uri, get_moon_node_collator_uri
+from app.lib.collator_account import get_moon_root_uri, get_derived_moon_collator_keypair
 from app.lib.substrate import substrate_call
 from app.lib.balance_utils import transfer_funds
 from app.lib.substrate import get_node_client
@@ -17,8 +17,7 @@ def register_moon_collator(node_name, rotate_key=False):
         node_client = get_node_client(node_name)
         collator_root_seed = derivation_root_seed()
         rich_key_uri = get_moon_root_uri(collator_root_seed)
-        collator_key_uri = get_moon_node_collator_uri(collator_root_seed, node_name)
-        keypair = Keypair.create_from_uri(collator_key_uri, crypto_type=KeypairType.ECDSA)
+        keypair = get_derived_moon_collator_keypair(node_name)
         keypair_rich = Keypair.create_from_uri(rich_key_uri, crypto_type=KeypairType.ECDSA)
         node_client.init_runtime()
         node_client.runtime_config.update_type_registry({
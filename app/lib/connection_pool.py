@@ -0,0 +1,318 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from substrateinterface import SubstrateInterface
+from substrateinterface.exceptions import SubstrateRequestException
+from websocket import create_connection, WebSocketConnectionClosedException, WebSocketTimeoutException
+
+from app.lib.metadata_cache import MetadataFileCache
+
+log = logging.getLogger(__name__)
+
+# seconds to wait for an unreachable node, established connections have no timeout (eg. waiting for inclusion)
+WS_CONNECT_TIMEOUT = 5
+# seconds to wait for the responses of a rpc batch before sending its requests one by one
+RPC_BATCH_TIMEOUT = 30
+
+
+# SubstrateInterface guarded by a per-URL lock: a websocket request/response exchange (including subscriptions
+# such as wait_for_inclusion) is never interleaved with another thread using the same socket.
+class PooledSubstrateInterface(SubstrateInterface):
+
+    def __init__(self, *args, metadata_cache_dir=None, **kwargs):
+        self.lock = threading.RLock()
+        self.last_used = time.monotonic()
+        super().__init__(*args, **kwargs)
+        if metadata_cache_dir:
+            self.cache_region = MetadataFileCache(metadata_cache_dir, self)
+
+    def connect_websocket(self):
+        if self.url and (self.url[0:6] == 'wss://' or self.url[0:5] == 'ws://'):
+            self.debug_message("Connecting to {} ...".format(self.url))
+            self.websocket = create_connection(self.url, timeout=WS_CONNECT_TIMEOUT, **self.ws_options)
+            self.websocket.settimeout(None)
+
+    def rpc_request(self, method, params, result_handler=None):
+        with self.lock:
+            self.last_used = time.monotonic()
+            return super().rpc_request(method, params, result_handler=result_handler)
+
+    # Send a JSON-RPC batch (list of {'method', 'params'}) in a single frame, returns the responses in request order.
+    # Falls back to one request at a time when the node rejects the batch (too large, batches disabled...) or doesn't
+    # answer it in time.
+    def rpc_batch_request(self, requests):
+        with self.lock:
+            self.last_used = time.monotonic()
+            payload = []
+            for request in requests:
+                payload.append({'jsonrpc': '2.0', 'method': request['method'], 'params': request.get('params', []),
+                                'id': self.request_id})
+                self.request_id += 1
+            try:
+                responses = self._send_rpc_batch(payload)
+            except Exception as e:
+                log.warning('Failed to send rpc batch on {}, sending the requests one by one, Error: {}'.format(
+                    self.url, e))
+                return self._rpc_requests(requests)
+
+            responses_by_id = {response.get('id'): response for response in responses}
+            return list(map(lambda request: responses_by_id.get(request['id'], {}), payload))
+
+    def _send_rpc_batch(self, payload):
+        request_ids = set(map(lambda request: request['id'], payload))
+        if not self.websocket:
+            response = self.session.request('POST', self.url, data=json.dumps(payload), headers=self.default_headers)
+            responses = self._rpc_batch_responses(response.json(), request_ids)
+            if responses is None:
+                raise SubstrateRequestException('Unexpected response to the rpc batch')
+            return responses
+
+        try:
+            self.websocket.send(json.dumps(payload))
+        except WebSocketConnectionClosedException:
+            self.connect_websocket()
+            self.websocket.send(json.dumps(payload))
+        deadline = time.monotonic() + RPC_BATCH_TIMEOUT
+        try:
+            while True:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    raise WebSocketTimeoutException('no response to the rpc batch')
+                self.websocket.settimeout(timeout)
+                responses = self._rpc_batch_responses(json.loads(self.websocket.recv()), request_ids)
+                if responses is not None:
+                    return responses
+        except WebSocketTimeoutException:
+            # the late response would be read by the next request of the client
+            self.connect_websocket()
+            raise
+        finally:
+            if self.websocket:
+                self.websocket.settimeout(None)
+
+    # Responses of the batch, None for a message which is not for it (eg. late notification of a finished subscription:
+    # the requests of the client are serialised by its lock so no other request is waiting for it)
+    def _rpc_batch_responses(self, message, request_ids):
+        if isinstance(message, list) and any(response.get('id') in request_ids for response in message):
+            return message
+        if isinstance(message, dict) and message.get('id') is None and 'error' in message:
+            # the whole batch was rejected
+            raise SubstrateRequestException(message['error'])
+        log.debug('Dropping rpc message received while waiting for a batch on {}: {}'.format(self.url, message))
+        return None
+
+    def _rpc_requests(self, requests):
+        responses = []
+        for request in requests:
+            try:
+                responses.append(self.rpc_request(request['method'], request.get('params', [])))
+            except SubstrateRequestException as e:
+                responses.append({'error': e.args[0] if e.args else str(e)})
+        return responses
+
+    def ping(self):
+        with self.lock:
+            if self.websocket:
+                self.websocket.ping()
+
+
+# LRU pool of substrate clients keyed by url.
+# - lookups don't hit the network, broken sockets are fixed by the keepalive loop (or by the SubstrateInterface
+#   auto_reconnect on the next send)
+# - least recently used clients are closed when the pool is full, idle ones are closed by the keepalive loop
+# - clients can also be checked out for the exclusive use of a thread (see checkout), up to max_dedicated_clients
+#   of them are kept per url once checked in, idle ones are closed by the keepalive loop
+class SubstrateConnectionPool:
+
+    def __init__(self, capacity=64, idle_timeout=600, keepalive_interval=30, client_factory=PooledSubstrateInterface,
+                 max_dedicated_clients=8):
+        self.capacity = capacity
+        self.max_dedicated_clients = max_dedicated_clients
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.client_factory = client_factory
+        self.clients = OrderedDict()
+        self.lock = threading.RLock()
+        self.url_locks = {}
+        # checked in clients for exclusive use: {url: [client]}
+        self.dedicated_clients = {}
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'reconnects': 0, 'errors': 0}
+        self._keepalive_thread = None
+        self._stop = threading.Event()
+
+    def __contains__(self, url):
+        return url in self.clients
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __repr__(self):
+        return 'SubstrateConnectionPool(size={}, capacity={}, urls={}, stats={})'.format(
+            len(self.clients), self.capacity, list(self.clients.keys()), self.stats)
+
+    def _url_lock(self, url):
+        with self.lock:
+            return self.url_locks.setdefault(url, threading.Lock())
+
+    def get(self, url):
+        self.start_keepalive()
+        with self.lock:
+            client = self.clients.get(url)
+            if client is not None:
+                self.clients.move_to_end(url)
+                client.last_used = time.monotonic()
+                self.stats['hits'] += 1
+                return client
+        # Only one thread connects to a given url, the others wait and reuse its client
+        with self._url_lock(url):
+            with self.lock:
+                client = self.clients.get(url)
+                if client is not None:
+                    self.stats['hits'] += 1
+                    return client
+                self.stats['misses'] += 1
+            client = self.client_factory(url=url)
+            with self.lock:
+                self.clients[url] = client
+                self._evict_overflow()
+            return client
+
+    # Client for the exclusive use of the caller until it is checked in: the pooled client of a url serialises the
+    # calls (including the inclusion subscriptions), threads waiting for inclusions concurrently need their own one
+    def checkout(self, url):
+        self.start_keepalive()
+        with self.lock:
+            idle_clients = self.dedicated_clients.get(url)
+            if idle_clients:
+                self.stats['hits'] += 1
+                return idle_clients.pop()
+            self.stats['misses'] += 1
+        return self.client_factory(url=url)
+
+    def checkin(self, url, client):
+        client.last_used = time.monotonic()
+        with self.lock:
+            idle_clients = self.dedicated_clients.setdefault(url, [])
+            if len(idle_clients) < self.max_dedicated_clients:
+                idle_clients.append(client)
+                return
+        self._close(url, client)
+
+    # The client is closed once its in-flight call (if any) returns, a thread holding the evicted client reconnects on
+    # its next call (SubstrateInterface auto_reconnect)
+    def evict(self, url):
+        with self.lock:
+            client = self.clients.pop(url, None)
+            if client is None:
+                return
+            # the url lock is kept: a thread may be about to acquire it, a new lock would let two threads connect
+            self.stats['evictions'] += 1
+        log.debug('Evicting substrate client for url: {}'.format(url))
+        client_lock = getattr(client, 'lock', None)
+        if client_lock is None or client_lock.acquire(blocking=False):
+            try:
+                self._close(url, client)
+            finally:
+                if client_lock is not None:
+                    client_lock.release()
+        else:
+            threading.Thread(target=self._close_when_idle, args=(url, client), name='ws-pool-evict',
+                             daemon=True).start()
+
+    def _close_when_idle(self, url, client):
+        with client.lock:
+            self._close(url, client)
+
+    def _close(self, url, client):
+        try:
+            client.close()
+        except Exception as e:
+            log.debug('Failed to close substrate client, url: {}, Error: {}'.format(url, e))
+
+    def clear(self):
+        for url in list(self.clients.keys()):
+            self.evict(url)
+        with self.lock:
+            dedicated_clients, self.dedicated_clients = self.dedicated_clients, {}
+        for url, idle_clients in dedicated_clients.items():
+            for client in idle_clients:
+                self._close(url, client)
+
+    def _close_idle_dedicated_clients(self, now):
+        idle_clients = []
+        with self.lock:
+            for url, clients in list(self.dedicated_clients.items()):
+                idle_clients.extend((url, client) for client in clients if now - client.last_used > self.idle_timeout)
+                clients[:] = [client for client in clients if now - client.last_used <= self.idle_timeout]
+                if not clients:
+                    del self.dedicated_clients[url]
+            self.stats['evictions'] += len(idle_clients)
+        for url, client in idle_clients:
+            self._close(url, client)
+
+    def _evict_overflow(self):
+        # Skip clients in the middle of a call, they'll be evicted on a later insert or by the keepalive loop
+        for url in list(self.clients.keys()):
+            if len(self.clients) <= self.capacity:
+                break
+            client = self.clients[url]
+            client_lock = getattr(client, 'lock', None)
+            if client_lock is None or client_lock.acquire(blocking=False):
+                try:
+                    self.evict(url)
+                finally:
+                    if client_lock is not None:
+                        client_lock.release()
+
+    def keepalive(self):
+        now = time.monotonic()
+        self._close_idle_dedicated_clients(now)
+        with self.lock:
+            clients = list(self.clients.items())
+        for url, client in clients:
+            client_lock = getattr(client, 'lock', None)
+            # busy clients are alive by definition
+            if client_lock is None or not client_lock.acquire(blocking=False):
+                continue
+            try:
+                if now - client.last_used > self.idle_timeout:
+                    self.evict(url)
+                    continue
+                if not client.websocket:
+                    continue
+                try:
+                    client.ping()
+                except Exception as e:
+                    log.info('Fixing broken WebSocket connection {}, Msg: {}'.format(url, e))
+                    try:
+                        client.connect_websocket()
+                        self.stats['reconnects'] += 1
+                    except Exception as e:
+                        log.error('Failed to connect to websocket, url: {}, Error: {}'.format(url, e))
+                        self.stats['errors'] += 1
+                        self.evict(url)
+            finally:
+                client_lock.release()
+
+    def start_keepalive(self):
+        if self._keepalive_thread is not None or not self.keepalive_interval:
+            return
+        with self.lock:
+            if self._keepalive_thread is not None:
+                return
+            self._keepalive_thread = threading.Thread(target=self._keepalive_loop, name='ws-pool-keepalive',
+                                                      daemon=True)
+            self._keepalive_thread.start()
+
+    def stop_keepalive(self):
+        self._stop.set()
+
+    def _keepalive_loop(self):
+        while not self._stop.wait(self.keepalive_interval):
+            try:
+                self.keepalive()
+            except Exception as e:
+                log.error('Substrate connection pool keepalive failed, Error: {}'.format(e))
@@ -1,13 +1,20 @@
 # Define tasks to be run on a CRON schedule
+import asyncio
 import logging
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from substrateinterface import Keypair
 
-from app.lib.kubernetes_client import list_stateful_sets, list_validator_stateful_sets
-from app.config.network_configuration import get_network, network_tasks_cron_schedule
+from app.lib.balance_utils import top_up_accounts
+from app.lib.kubernetes_client import list_stateful_sets, list_validator_stateful_sets, list_substrate_node_pods
+from app.config.network_configuration import get_network, network_tasks_cron_schedule, network_sudo_seed, \
+    relay_chain_consensus, balance_monitor_min_funds, balance_monitor_top_up_amount
 from app.lib.network_utils import rotate_nodes_session_keys, register_statefulset_validators, list_parachains, \
-    onboard_parachain_by_id
+    onboard_parachain_by_id, get_validator_account_from_pod, prewarm_validator_accounts, \
+    list_managed_collator_accounts
+from app.lib.parachain_manager import get_parachain_node_client
+from app.lib.staking_utils import count_validator_nominators, get_validator_nominator_address
 from app.lib.substrate import get_relay_chain_client
 
 log = logging.getLogger(__name__)
@@ -35,6 +42,10 @@ async def load_cron_tasks():
         scheduler.add_job(onboard_inactive_parachains,
                           name='onboard_inactive_parachains',
                           trigger=tasks_cron_trigger)
+        top_up_managed_accounts = top_up_network_managed_accounts()
+        scheduler.add_job(top_up_managed_accounts,
+                          name='top_up_managed_accounts',
+                          trigger=tasks_cron_trigger)
 
 
 async def exec_cron_task(job_id):
@@ -109,3 +120,59 @@ def onboard_network_inactive_parachains():
                 log.info(F'Parachain #{para_id} already onboarded')
         log.info('Finished onboarding inactive parachains')
     return onboard_inactive_parachains
+
+
+# Keep the accounts managed by the testnet-manager funded:
+#  * Relay-chain: validator stash accounts and, in PoS, the nominators of each validator (created with
+#    /validators/staking_nominators) are topped up with one transfer batch from the sudo account
+#  * Parachains: collator accounts are topped up with one teleport batch from the relay-chain sudo account per parachain
+# The balances of each chain are read with a single request, the nominator counts are kept between runs.
+def top_up_network_managed_accounts():
+    # {validator_name: nominator count}
+    nominator_counts = {}
+
+    # Relay-chain accounts to keep funded, the key derivations are CPU bound
+    def list_relay_chain_accounts(relay_chain_client):
+        validator_pods = list_substrate_node_pods('authority')
+        prewarm_validator_accounts(validator_pods)
+        relay_chain_accounts = list(map(get_validator_account_from_pod, validator_pods))
+        if relay_chain_consensus() == "pos":
+            validator_names = list(map(lambda pod: pod.metadata.name, validator_pods))
+            nominator_counts.update(count_validator_nominators(relay_chain_client, validator_names, nominator_counts))
+            for validator_name in validator_names:
+                for nominator_index in range(nominator_counts.get(validator_name, 0)):
+                    relay_chain_accounts.append(get_validator_nominator_address(validator_name, nominator_index))
+        return relay_chain_accounts
+
+    async def top_up_managed_accounts():
+        log.info(f'Topping up managed accounts for network={network}')
+        # the queries, key derivations and batch submissions are blocking, they run in worker threads to keep the
+        # event loop free
+        relay_chain_client = await asyncio.to_thread(get_relay_chain_client)
+        if not relay_chain_client:
+            log.error('Unable to connect to the relay-chain, skipping the top up of managed accounts')
+            return
+        sudo_keypair = Keypair.create_from_seed(network_sudo_seed())
+        min_funds = balance_monitor_min_funds()
+        top_up_amount = balance_monitor_top_up_amount()
+
+        relay_chain_accounts = await asyncio.to_thread(list_relay_chain_accounts, relay_chain_client)
+        topped_up = await asyncio.to_thread(top_up_accounts, relay_chain_client, sudo_keypair, relay_chain_accounts,
+                                            min_funds, top_up_amount)
+        log.info(f'Topped up {len(topped_up)} of {len(relay_chain_accounts)} relay-chain accounts')
+
+        managed_collator_accounts = await asyncio.to_thread(list_managed_collator_accounts)
+        for para_id, collator_accounts in managed_collator_accounts.items():
+            try:
+                parachain_client = await asyncio.to_thread(get_parachain_node_client, para_id)
+                if not parachain_client:
+                    log.error(f'Unable to connect to a collator of parachain #{para_id}, skipping its top up')
+                    continue
+                topped_up = await asyncio.to_thread(top_up_accounts, relay_chain_client, sudo_keypair,
+                                                    collator_accounts, min_funds, top_up_amount, para_id=int(para_id),
+                                                    balance_client=parachain_client)
+                log.info(f'Topped up {len(topped_up)} of {len(collator_accounts)} collator accounts of parachain #{para_id}')
+            except Exception as e:
+                log.error(f'Failed to top up the collator accounts of parachain #{para_id}, Error: {e}')
+        log.info('Finished topping up managed accounts')
+    return top_up_managed_accounts
@@ -0,0 +1,163 @@
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import blake2b
+
+from nacl.secret import SecretBox
+from substrateinterface import Keypair, KeypairType
+
+from app.config.network_configuration import derived_keys_cache_size, derived_keys_snapshot_path
+
+log = logging.getLogger(__name__)
+
+# Below this number of missing keys, pre-warming is done in-process (starting worker processes costs more)
+PREWARM_MIN_BATCH = 32
+
+# sr25519 and BIP44 ECDSA derivations are CPU-heavy and the same node keys are derived on every request, so they are
+# memoized. Entries are keyed by (root seed fingerprint, derivation path, ss58 format, crypto type), the derivation
+# path being the part of the URI after the root seed (eg. '//validator-0//stash'), so the root seed itself is never
+# used as a key.
+# - derived_keypairs: full keypairs (with private keys), in memory only
+# - derived_public_keys: {key: (public key hex, ss58 address)}, optionally persisted as an encrypted snapshot
+derived_keypairs = OrderedDict()
+derived_public_keys = OrderedDict()
+derived_keys_lock = threading.Lock()
+snapshot_state = {'loaded': False, 'dirty': False}
+prewarm_executor = None
+
+
+def seed_fingerprint(root_seed):
+    return blake2b(root_seed.encode(), digest_size=16, person=b'tm-keys-fprint').hexdigest()
+
+
+def derived_key_id(root_seed, derivation_path, ss58_format, crypto_type):
+    return seed_fingerprint(root_seed), derivation_path, int(ss58_format), crypto_type
+
+
+def lru_get(cache, key):
+    with derived_keys_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+
+def lru_set(cache, key, value):
+    with derived_keys_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > derived_keys_cache_size():
+            cache.popitem(last=False)
+
+
+def get_derived_keypair(root_seed, derivation_path, ss58_format=42, crypto_type=KeypairType.SR25519):
+    key = derived_key_id(root_seed, derivation_path, ss58_format, crypto_type)
+    keypair = lru_get(derived_keypairs, key)
+    if keypair is None:
+        keypair = Keypair.create_from_uri(root_seed + derivation_path, ss58_format=int(ss58_format),
+                                          crypto_type=crypto_type)
+        lru_set(derived_keypairs, key, keypair)
+        remember_public_key(key, keypair)
+    return keypair
+
+
+# Returns (public key hex, ss58 address)
+def get_derived_public_key(root_seed, derivation_path, ss58_format=42, crypto_type=KeypairType.SR25519):
+    load_derived_keys_snapshot(root_seed)
+    key = derived_key_id(root_seed, derivation_path, ss58_format, crypto_type)
+    public_key = lru_get(derived_public_keys, key)
+    if public_key is None:
+        keypair = get_derived_keypair(root_seed, derivation_path, ss58_format, crypto_type)
+        public_key = ('0x' + keypair.public_key.hex(), keypair.ss58_address)
+    return public_key
+
+
+def get_derived_address(root_seed, derivation_path, ss58_format=42, crypto_type=KeypairType.SR25519):
+    return get_derived_public_key(root_seed, derivation_path, ss58_format, crypto_type)[1]
+
+
+def remember_public_key(key, keypair):
+    lru_set(derived_public_keys, key, ('0x' + keypair.public_key.hex(), keypair.ss58_address))
+    snapshot_state['dirty'] = True
+
+
+def derive_public_key(uri, ss58_format, crypto_type):
+    keypair = Keypair.create_from_uri(uri, ss58_format=ss58_format, crypto_type=crypto_type)
+    return '0x' + keypair.public_key.hex(), keypair.ss58_address
+
+
+# Derive in bulk the public keys which aren't cached yet (eg. when a StatefulSet scaled up).
+# derivations: list of (derivation_path, ss58_format, crypto_type)
+def prewarm_derived_keys(root_seed, derivations):
+    global prewarm_executor
+    load_derived_keys_snapshot(root_seed)
+    missing = []
+    for derivation_path, ss58_format, crypto_type in set(derivations):
+        key = derived_key_id(root_seed, derivation_path, ss58_format, crypto_type)
+        if key not in derived_public_keys:
+            missing.append((key, root_seed + derivation_path, int(ss58_format), crypto_type))
+    if not missing:
+        return 0
+
+    if len(missing) < PREWARM_MIN_BATCH:
+        public_keys = map(lambda item: derive_public_key(*item[1:]), missing)
+    else:
+        log.info(f'Pre-warming {len(missing)} derived keys')
+        if prewarm_executor is None:
+            # spawn: the web workers run threads (connection pool, asyncio transport) which shouldn't be forked
+            prewarm_executor = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(prewarm_executor.shutdown, cancel_futures=True)
+        public_keys = prewarm_executor.map(derive_public_key, *zip(*map(lambda item: item[1:], missing)),
+                                           chunksize=16)
+    for (key, _, _, _), public_key in zip(missing, public_keys):
+        lru_set(derived_public_keys, key, public_key)
+    snapshot_state['dirty'] = True
+    save_derived_keys_snapshot(root_seed)
+    return len(missing)
+
+
+# The snapshot only contains public keys and addresses but is encrypted with a key derived from the root seed: it
+# discloses neither which accounts belong to the network nor the derivation paths.
+def snapshot_secret_box(root_seed):
+    return SecretBox(blake2b(root_seed.encode(), digest_size=SecretBox.KEY_SIZE, person=b'tm-keys-snapshot').digest())
+
+
+def load_derived_keys_snapshot(root_seed):
+    snapshot_path = derived_keys_snapshot_path()
+    if snapshot_state['loaded'] or not snapshot_path or not root_seed:
+        return
+    snapshot_state['loaded'] = True
+    atexit.register(save_derived_keys_snapshot, root_seed)
+    try:
+        with open(snapshot_path, 'rb') as f:
+            entries = json.loads(snapshot_secret_box(root_seed).decrypt(f.read()))
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        log.warning(f'Unable to load derived keys snapshot {snapshot_path}, Error: {e}')
+        return
+    for key, public_key in entries:
+        lru_set(derived_public_keys, tuple(key), tuple(public_key))
+    log.info(f'Loaded {len(entries)} derived keys from {snapshot_path}')
+
+
+def save_derived_keys_snapshot(root_seed):
+    snapshot_path = derived_keys_snapshot_path()
+    if not snapshot_path or not root_seed or not snapshot_state['dirty']:
+        return
+    fingerprint = seed_fingerprint(root_seed)
+    with derived_keys_lock:
+        entries = [[key, public_key] for key, public_key in derived_public_keys.items() if key[0] == fingerprint]
+    try:
+        tmp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(snapshot_secret_box(root_seed).encrypt(json.dumps(entries).encode()))
+        os.replace(tmp_path, snapshot_path)
+        snapshot_state['dirty'] = False
+    except Exception as e:
+        log.warning(f'Unable to save derived keys snapshot {snapshot_path}, Error: {e}')
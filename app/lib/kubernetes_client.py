@@ -1,12 +1,76 @@
+import logging
+import threading
+
 from kubernetes import client as kubernetes_client
 
-from app.config.network_configuration import get_namespace, network_external_validators_configmap
+from app.config.network_configuration import get_namespace, network_external_validators_configmap, \
+    kubernetes_informers_enabled
+from app.lib.kubernetes_informer import Informer, object_label
+
+log = logging.getLogger(__name__)
 
 namespace = get_namespace()
 
+# Seconds to wait for the first list of an informer, the API is called directly until it is synced
+INFORMER_SYNC_TIMEOUT = 10
+
+informers = {}
+informers_lock = threading.Lock()
+
+
+# Returns the synced informer named `name` (created and started on first use), or None when informers are disabled
+# or not synced yet
+def get_informer(name, create_informer):
+    if not kubernetes_informers_enabled():
+        return None
+    sync_timeout = 0
+    with informers_lock:
+        informer = informers.get(name)
+        if informer is None:
+            informer = informers[name] = create_informer()
+            sync_timeout = INFORMER_SYNC_TIMEOUT
+    if informer.wait_for_sync(sync_timeout):
+        return informer
+    log.warning(f'Informer {name} not synced, calling the Kubernetes API')
+    return None
+
+
+def pod_owner(pod):
+    return pod.metadata.owner_references[0].name if pod.metadata.owner_references else None
+
+
+def stateful_set_template_label(label):
+    return lambda sts: sts['spec']['template']['metadata']['labels'].get(label)
+
+
+# Substrate node pods indexed by role, paraId, owner StatefulSet and chain
+def get_node_pod_informer():
+    return get_informer('pods', lambda: Informer(
+        'pods', kubernetes_client.CoreV1Api().list_namespaced_pod,
+        indexers={'role': object_label('role'), 'paraId': object_label('paraId'), 'owner': pod_owner,
+                  'chain': object_label('chain')},
+        namespace=namespace, label_selector='app.kubernetes.io/name=node'))
+
+
+# StatefulSets indexed by pod template role and paraId
+def get_stateful_set_informer():
+    return get_informer('statefulsets', lambda: Informer(
+        'statefulsets', kubernetes_client.CustomObjectsApi().list_namespaced_custom_object,
+        indexers={'role': stateful_set_template_label('role'), 'paraId': stateful_set_template_label('paraId')},
+        group='apps', version='v1', plural='statefulsets', namespace=namespace))
+
+
+def get_external_validators_configmap_informer():
+    return get_informer('configmaps', lambda: Informer(
+        'configmaps', kubernetes_client.CoreV1Api().list_namespaced_config_map,
+        namespace=get_namespace(), field_selector=f'metadata.name={network_external_validators_configmap()}'))
+
 
 def get_pod(pod_name):
-    pod = kubernetes_client.CoreV1Api().read_namespaced_pod(namespace=namespace, name=pod_name)
+    informer = get_node_pod_informer()
+    pod = informer.get(pod_name) if informer else None
+    if pod is None:
+        pod = kubernetes_client.CoreV1Api().read_namespaced_pod(namespace=namespace, name=pod_name)
     return pod
 
 
@@ -108,12 +172,18 @@ def get_affinity_details(affinity):
 
 
 def list_stateful_sets():
+    informer = get_stateful_set_informer()
+    if informer:
+        return informer.list()
     return kubernetes_client.CustomObjectsApi().list_namespaced_custom_object(group="apps", version="v1",
                                                                               plural="statefulsets",
                                                                               namespace=namespace)['items']
 
 
 def list_validator_stateful_sets(role='authority'):
+    informer = get_stateful_set_informer()
+    if informer:
+        return list(map(lambda sts: sts['metadata']['name'], informer.list('role', role)))
     stateful_sets = list_stateful_sets()
     validator_stateful_sets = list(
         filter(lambda sts: sts['spec']['template']['metadata']['labels'].get('role') == role, stateful_sets))
@@ -121,6 +191,11 @@ def list_validator_stateful_sets(role='authority'):
 
 
 def list_parachain_collator_stateful_sets(para_id: str):
+    informer = get_stateful_set_informer()
+    if informer:
+        collator_stateful_sets = filter(lambda sts: sts['spec']['template']['metadata']['labels'].get('role') == 'collator',
+                                        informer.list('paraId', para_id))
+        return list(map(lambda sts: sts['metadata']['name'], collator_stateful_sets))
     stateful_sets = kubernetes_client.CustomObjectsApi().list_namespaced_custom_object(group="apps", version="v1", plural="statefulsets", namespace=namespace)
 
     collator_stateful_sets = list(
@@ -131,6 +206,9 @@ def list_parachain_collator_stateful_sets(para_id: str):
 
 
 def list_substrate_node_pods(role_label=''):
+    informer = get_node_pod_informer()
+    if informer:
+        return informer.list('role', role_label) if role_label else informer.list()
     pods = kubernetes_client.CoreV1Api().list_namespaced_pod(namespace=namespace).items
     # Keep only pods which are substrate nodes
     pods = list(filter(lambda pod: pod.metadata.labels.get('app.kubernetes.io/name') == "node", pods))
@@ -141,6 +219,10 @@ def list_substrate_node_pods(role_label=''):
 
 
 def list_validator_pods(stateful_set_name):
+    informer = get_node_pod_informer()
+    if informer and stateful_set_name:
+        return list(filter(lambda pod: pod.metadata.labels.get('role') == 'authority',
+                           informer.list('owner', stateful_set_name)))
     validator_pods = list_substrate_node_pods('authority')
     if stateful_set_name:
         validator_pods = list(filter(lambda pod: pod.metadata.owner_references[0].name == stateful_set_name, validator_pods))
@@ -148,6 +230,14 @@ def list_validator_pods(stateful_set_name):
 
 
 def list_collator_pods(para_id: str = None, stateful_set_name: str = None):
+    informer = get_node_pod_informer()
+    if informer and (stateful_set_name or para_id):
+        if stateful_set_name:
+            collator_pods = informer.list('owner', stateful_set_name)
+        else:
+            collator_pods = informer.list('paraId', para_id)
+        return list(filter(lambda pod: pod.metadata.labels.get('role') == 'collator' and
+                                       (not para_id or pod.metadata.labels.get('paraId') == para_id), collator_pods))
     collator_pods = list_substrate_node_pods('collator')
     if stateful_set_name:
         collator_pods = list(filter(lambda pod: pod.metadata.owner_references[0].name == stateful_set_name, collator_pods))
@@ -157,6 +247,10 @@ def list_collator_pods(para_id: str = None, stateful_set_name: str = None):
 
 
 def get_external_validators_from_configmap():
+    informer = get_external_validators_configmap_informer()
+    if informer:
+        external_validators = informer.get(network_external_validators_configmap())
+        return external_validators.data if external_validators and external_validators.data is not None else {}
     try:
         external_validators = kubernetes_client.CoreV1Api().read_namespaced_config_map(
             name=network_external_validators_configmap(),
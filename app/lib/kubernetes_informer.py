@@ -0,0 +1,148 @@
+import logging
+import threading
+
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+log = logging.getLogger(__name__)
+
+# Server side timeout of a watch request, the watch is then resumed from the last seen resourceVersion
+WATCH_TIMEOUT = 300
+# Seconds to wait before listing again after an API error
+ERROR_BACKOFF = 5
+
+
+# Works with both typed (eg. V1Pod) and untyped (dict returned by the CustomObjectsApi) objects
+def object_metadata(obj):
+    if isinstance(obj, dict):
+        metadata = obj['metadata']
+        return metadata['name'], metadata.get('resourceVersion'), metadata.get('labels') or {}
+    return obj.metadata.name, obj.metadata.resource_version, obj.metadata.labels or {}
+
+
+def list_resource_version(result):
+    if isinstance(result, dict):
+        return result['metadata']['resourceVersion'], result['items']
+    return result.metadata.resource_version, result.items
+
+
+def object_label(label):
+    return lambda obj: object_metadata(obj)[2].get(label)
+
+
+# Keeps an in-memory copy of a namespaced resource list, maintained with the list + watch pattern:
+# - the resource is listed once and watched from the list resourceVersion, every event updates the store
+# - when the watch expires (410 Gone) or fails, the resource is listed again and the store replaced at once
+# indexers: {index_name: function(obj) -> index value (None to skip the object)}, used by list(index_name, value)
+class Informer:
+
+    def __init__(self, name, list_function, indexers=None, **list_kwargs):
+        self.name = name
+        self.list_function = list_function
+        self.list_kwargs = list_kwargs
+        self.indexers = indexers or {}
+        self.store = {}
+        self.indexes = {index_name: {} for index_name in self.indexers}
+        self.resource_version = None
+        self.lock = threading.RLock()
+        self.synced = threading.Event()
+        self._thread = None
+        self._watch = None
+        self._stop = threading.Event()
+
+    def __repr__(self):
+        return 'Informer(name={}, size={}, resource_version={}, synced={})'.format(
+            self.name, len(self.store), self.resource_version, self.synced.is_set())
+
+    def start(self):
+        with self.lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name=f'informer-{self.name}', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._watch:
+            self._watch.stop()
+
+    def wait_for_sync(self, timeout=None):
+        self.start()
+        return self.synced.wait(timeout)
+
+    def get(self, name):
+        with self.lock:
+            return self.store.get(name)
+
+    def list(self, index_name=None, value=None):
+        with self.lock:
+            if index_name is None:
+                names = self.store.keys()
+            else:
+                names = self.indexes[index_name].get(value, ())
+            return list(map(lambda name: self.store[name], sorted(names)))
+
+    def relist(self):
+        resource_version, items = list_resource_version(self.list_function(**self.list_kwargs))
+        with self.lock:
+            self.store = {}
+            self.indexes = {index_name: {} for index_name in self.indexers}
+            for obj in items:
+                self._put(obj)
+            self.resource_version = resource_version
+        self.synced.set()
+        log.debug('Listed {} {}, resource_version={}'.format(len(items), self.name, resource_version))
+
+    def handle_event(self, event):
+        event_type = event['type']
+        obj = event['object']
+        with self.lock:
+            if event_type in ('ADDED', 'MODIFIED'):
+                self._put(obj)
+            elif event_type == 'DELETED':
+                self._delete(object_metadata(obj)[0])
+            # BOOKMARK events only move the resourceVersion forward
+            resource_version = event['raw_object'].get('metadata', {}).get('resourceVersion')
+            if resource_version:
+                self.resource_version = resource_version
+
+    def _put(self, obj):
+        name = object_metadata(obj)[0]
+        self._delete(name)
+        self.store[name] = obj
+        for index_name, indexer in self.indexers.items():
+            value = indexer(obj)
+            if value is not None:
+                self.indexes[index_name].setdefault(value, set()).add(name)
+
+    def _delete(self, name):
+        obj = self.store.pop(name, None)
+        if obj is None:
+            return
+        for index_name, indexer in self.indexers.items():
+            names = self.indexes[index_name].get(indexer(obj))
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    self.indexes[index_name].pop(indexer(obj))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.resource_version is None:
+                    self.relist()
+                self._watch = watch.Watch()
+                for event in self._watch.stream(self.list_function, resource_version=self.resource_version,
+                                                timeout_seconds=WATCH_TIMEOUT, allow_watch_bookmarks=True,
+                                                **self.list_kwargs):
+                    self.handle_event(event)
+            except ApiException as e:
+                if e.status != 410:
+                    log.error('Failed to watch {}, Error: {}'.format(self.name, e))
+                    self._stop.wait(ERROR_BACKOFF)
+                # resourceVersion too old (or unknown after an error): list again
+                self.resource_version = None
+            except Exception as e:
+                log.error('Failed to watch {}, Error: {}'.format(self.name, e))
+                self.resource_version = None
+                self._stop.wait(ERROR_BACKOFF)
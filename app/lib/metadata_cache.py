@@ -0,0 +1,78 @@
+import logging
+import mmap
+import os
+import tempfile
+import threading
+
+from scalecodec.base import ScaleBytes
+
+log = logging.getLogger(__name__)
+
+# Decoded metadata already loaded by this process, shared by all the clients connected to the same runtime
+# { (genesis_hash, 'METADATA_<spec_version>'): metadata }
+loaded_metadata = {}
+loaded_metadata_lock = threading.Lock()
+LOADED_METADATA_MAX_SIZE = 16
+
+
+# Runtime metadata cache keyed by (genesis hash, spec version), used as the SubstrateInterface `cache_region`
+# (which gets/sets the decoded metadata as 'METADATA_<spec_version>').
+# - in memory, the decoded metadata (including the V14+ portable type registry) is shared by every client of the process
+# - on disk, the SCALE encoded metadata is shared by all processes (gunicorn workers, scheduler) and memory-mapped,
+#   a new process decodes it without downloading it from the node
+# A runtime is immutable so entries never need to be invalidated.
+class MetadataFileCache:
+
+    def __init__(self, directory, substrate_client):
+        self.directory = directory
+        self.substrate_client = substrate_client
+        self._genesis_hash = None
+
+    @property
+    def genesis_hash(self):
+        if self._genesis_hash is None:
+            self._genesis_hash = self.substrate_client.rpc_request('chain_getBlockHash', [0])['result']
+        return self._genesis_hash
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{self.genesis_hash}-{key}.scale')
+
+    def get(self, key):
+        cache_key = (self.genesis_hash, key)
+        if cache_key in loaded_metadata:
+            return loaded_metadata[cache_key]
+        try:
+            with open(self.path(key), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                metadata = self.substrate_client.runtime_config.create_scale_object(
+                    'MetadataVersioned', data=ScaleBytes(bytearray(mm)))
+            metadata.decode()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning('Unable to load cached metadata {}, Error: {}'.format(self.path(key), e))
+            return None
+        log.debug('Loaded metadata {} of chain {} from {}'.format(key, self.genesis_hash, self.directory))
+        self.remember(cache_key, metadata)
+        return metadata
+
+    def set(self, key, metadata):
+        self.remember((self.genesis_hash, key), metadata)
+        tmp_path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temporary file first so other processes never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(metadata.data.data)
+            os.replace(tmp_path, self.path(key))
+        except Exception as e:
+            log.warning('Unable to store metadata {} in {}, Error: {}'.format(key, self.directory, e))
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def remember(cache_key, metadata):
+        with loaded_metadata_lock:
+            if len(loaded_metadata) >= LOADED_METADATA_MAX_SIZE:
+                loaded_metadata.pop(next(iter(loaded_metadata)))
+            loaded_metadata[cache_key] = metadata
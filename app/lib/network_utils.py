@@ -1,32 +1,37 @@
 import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+from substrateinterface import KeypairType
+
 from app.config.network_configuration import get_relay_chain_rpc_url, network_sudo_seed, derivation_root_seed, \
-    node_http_endpoint, get_network, relay_chain_consensus, node_ws_endpoint
+    node_http_endpoint, get_network, relay_chain_consensus, node_ws_endpoint, fleet_scan_concurrency, \
+    fleet_scan_timeout, registration_concurrency, registration_node_timeout
 from app.lib.balance_utils import fund_accounts
 from app.lib.collator_account import get_derived_moon_collator_account, get_derived_collator_account, \
-    get_derived_collator_session_keys
+    get_derived_collator_session_keys, get_collator_derivation_path, get_moon_node_collator_derivation_path
 from app.lib.collator_manager import get_collator_status, \
-    collator_register, collator_deregister, get_moon_collator_status, \
+    collators_register, collator_deregister, get_moon_collator_status, \
     add_collator_selection_invulnerable, remove_collator_selection_invulnerable, \
     get_collator_selection_invulnerables, set_collator_selection_invulnerables
-from app.lib.collator_mint import collator_set_keys
+from app.lib.collator_mint import collators_set_keys
 from app.lib.kubernetes_client import list_validator_pods, get_external_validators_from_configmap, \
     list_collator_pods, get_pod, list_substrate_node_pods
 from app.lib.node_utils import is_node_ready, \
     get_last_runtime_upgrade, has_pod_node_role_label, \
-    check_has_session_keys
+    check_has_session_keys, check_readiness_from_health_status, get_node_live_status
 from app.lib.parachain_manager import get_parachain_id, get_all_parachain_lifecycles, \
-    initialize_parachain, cleanup_parachain, get_chain_wasm, get_parachain_head, get_parathreads_ids, \
+    initialize_parachain, cleanup_parachain, get_cached_chain_wasm, get_parachain_head, get_parathreads_ids, \
     get_parachains_ids, get_all_parachain_leases_count, get_all_parachain_current_code_hashes, \
     get_permanent_slot_lease_period_length, get_all_parachain_heads, get_parachain_node_client
 from app.lib.session_keys import rotate_node_session_keys, set_node_session_key, get_queued_keys
+from app.lib.derived_keys import prewarm_derived_keys
 from app.lib.stash_accounts import get_derived_node_stash_account_address, get_node_stash_account_mnemonic, \
-    get_account_funds
-from app.lib.substrate import get_relay_chain_client, get_node_client, substrate_rpc_request
-from app.lib.validator_manager import get_validator_set, get_validators_pending_addition, \
-    get_validators_pending_deletion, \
+    get_account_funds, get_node_stash_derivation_path
+from app.lib.substrate import get_relay_chain_client, get_node_client, substrate_rpc_batch_request, \
+    get_pinned_block_hash, dedicated_substrate_client, query_storage
+from app.lib.validator_manager import get_validator_set_snapshot, ValidatorSetSnapshot, \
     deregister_validators, register_validators, setup_pos_validator, staking_chill, get_account_session_keys, \
     get_derived_validator_session_keys
 
@@ -34,6 +39,14 @@ log = logging.getLogger(__name__)
 
 relay_chain_network_name = get_network()
 
+# Bounds the number of nodes queried at the same time by the fleet scan
+fleet_scan_executor = ThreadPoolExecutor(max_workers=fleet_scan_concurrency(), thread_name_prefix='fleet-scan')
+# Bound the number of validators going through each stage of the registration at the same time
+rotate_keys_executor = ThreadPoolExecutor(max_workers=registration_concurrency(), thread_name_prefix='rotate-keys')
+set_keys_executor = ThreadPoolExecutor(max_workers=registration_concurrency(), thread_name_prefix='set-keys')
+# Para ids being onboarded (sudo_schedule_para_initialize not included yet), see onboard_parachain_by_id
+onboarding_para_ids = set()
+
 
 def get_validator_account_from_pod(pod):
     node_name = pod.metadata.name
@@ -60,39 +73,62 @@ def get_collator_account_from_pod(pod):
             return get_derived_collator_account(node_name, ss58_format)
 
 
-def get_validator_status(node_stash_account_address, validator_set, validators_to_add, validators_to_retire):
-    if node_stash_account_address in validators_to_add:
-        validator_status = 'pending_addition'
-    elif node_stash_account_address in validators_to_retire:
-        validator_status = 'pending_deletion'
-    else:
-        validator_status = node_stash_account_address in validator_set
-    return validator_status
+# Accounts of the collator pods to keep funded (except moon* chains, which use Ethereum accounts): {para_id: [address]}
+def list_managed_collator_accounts():
+    collator_pods = list(filter(lambda pod: pod.metadata.labels.get('paraId') and
+                                            not pod.metadata.labels.get('chain', '').startswith('moon'),
+                                list_substrate_node_pods('collator')))
+    prewarm_collator_accounts(collator_pods)
+    collator_accounts = {}
+    for pod in collator_pods:
+        collator_accounts.setdefault(pod.metadata.labels['paraId'], []).append(get_collator_account_from_pod(pod))
+    return collator_accounts
+
+
+# Derive in one go the accounts of the pods which are not cached yet (eg. after a StatefulSet scale up)
+def prewarm_validator_accounts(pods):
+    derivations = []
+    for pod in pods:
+        if not pod.metadata.labels.get('validatorAccount', None):
+            derivations.append((get_node_stash_derivation_path(pod.metadata.name), 42, KeypairType.SR25519))
+    prewarm_derived_keys(derivation_root_seed(), derivations)
+
+
+def prewarm_collator_accounts(pods):
+    derivations = []
+    for pod in pods:
+        if pod.metadata.labels.get('collatorAccount', None):
+            continue
+        node_name = pod.metadata.name
+        if pod.metadata.labels['chain'].startswith("moon"):
+            derivations.append((get_moon_node_collator_derivation_path(node_name), 42, KeypairType.ECDSA))
+        else:
+            derivations.append((get_collator_derivation_path(node_name), pod.metadata.labels.get('ss58Format', '42'),
+                                KeypairType.SR25519))
+    prewarm_derived_keys(derivation_root_seed(), derivations)
 
 
-def list_validators(stateful_set_name=''):
+def list_validators(stateful_set_name='', at=None):
     ws_endpoint = get_relay_chain_rpc_url()
     external_validators = get_external_validators_from_configmap()
     validator_pods = list_validator_pods(stateful_set_name)
-    validator_set = get_validator_set(ws_endpoint)
-    validators_to_add = get_validators_pending_addition(ws_endpoint)
-    validators_to_retire = get_validators_pending_deletion(ws_endpoint)
+    # listed without their validator status when the validator set can't be read
+    validator_set_snapshot = get_validator_set_snapshot(ws_endpoint, at) or ValidatorSetSnapshot()
     validators = []
 
     # Add missing validators to the list (only when not filtering on a statefulset)
     if not stateful_set_name:
         for node_name, node_address in external_validators.items():
-            is_validator = get_validator_status(node_address, validator_set, validators_to_add,
-                                                        validators_to_retire)
+            is_validator = validator_set_snapshot.status(node_address)
             if is_validator:
                 validators.append({'name': node_name, 'location': 'external', 'address': node_address,
                                    # 'funds': node_stash_account_funds,
                                    'is_validator': is_validator, 'status': '?', 'version': '?'})
 
+    prewarm_validator_accounts(validator_pods)
     for pod in validator_pods:
         node_stash_account_address = get_validator_account_from_pod(pod)
-        is_validator = get_validator_status(node_stash_account_address, validator_set, validators_to_add,
-                                                    validators_to_retire)
+        is_validator = validator_set_snapshot.status(node_stash_account_address)
         validators.append({'name': pod.metadata.name, 'location': 'in_cluster',
                            'address': node_stash_account_address,
                            # 'funds': node_stash_account_funds,
@@ -103,15 +139,14 @@ def list_validators(stateful_set_name=''):
     # Add missing validators to the list (only when not filtering on a statefulset)
     if not stateful_set_name:
         # Find validator addresses which are neither in configmap nor Kubernetes pod
-        known_validators_addresses = []
+        known_validators_addresses = set()
         for validator in validators:
             if validator['is_validator']:
-                known_validators_addresses.append(validator['address'])
+                known_validators_addresses.add(validator['address'])
         i = 0
-        for validator_address in validator_set:
+        for validator_address in validator_set_snapshot.validators:
             if not validator_address in known_validators_addresses:
-                is_validator = get_validator_status(validator_address, validator_set, validators_to_add,
-                                                            validators_to_retire)
+                is_validator = validator_set_snapshot.status(validator_address)
                 validators.append(
                     {'name': 'unknown-validator-' + str(i), 'location': 'unknown',
                      'address': validator_address,
@@ -151,38 +186,27 @@ def get_node_info_from_pod(pod):
 
 
 def get_node_info_from_rpc(node_name):
-    http_endpoint = node_http_endpoint(node_name)
-    node_ready = is_node_ready(http_endpoint)
-    if node_ready:
-        node_client = get_node_client(node_name)
-        node_peer_id = substrate_rpc_request(node_client, 'system_localPeerId')
-        node_sync_state = substrate_rpc_request(node_client, 'system_syncState')
-        node_system_health = substrate_rpc_request(node_client, 'system_health')
-        node_system_local_listen_addresses = substrate_rpc_request(node_client, 'system_localListenAddresses')
-        node_system_peers = substrate_rpc_request(node_client, 'system_peers')
-        node_system_properties = substrate_rpc_request(node_client, 'system_properties')
-        node_system_roles = substrate_rpc_request(node_client, 'system_nodeRoles')
-        node_version = substrate_rpc_request(node_client, 'system_version')
-    else:
-        node_peer_id = '?'
-        node_sync_state = '?'
-        node_system_health = '?'
-        node_system_local_listen_addresses = '?'
-        node_system_peers = '?'
-        node_system_properties = '?'
-        node_system_roles = '?'
-        node_version = '?'
-    return {
-        'health': node_system_health,
-        'localListenAddresses': node_system_local_listen_addresses,
-        'nodeRoles': node_system_roles,
-        'peerId': node_peer_id,
-        'peers': node_system_peers,
-        'properties': node_system_properties,
-        'ready': node_ready,
-        'syncState': node_sync_state,
-        'version': node_version,
-    }
+    node_client = get_node_client(node_name)
+    node_rpc_info = {}
+    if node_client:
+        # Single JSON-RPC batch, the node readiness is computed from system_health
+        node_rpc_info = substrate_rpc_batch_request(node_client, {
+            'health': 'system_health',
+            'localListenAddresses': 'system_localListenAddresses',
+            'nodeRoles': 'system_nodeRoles',
+            'peerId': 'system_localPeerId',
+            'peers': 'system_peers',
+            'properties': 'system_properties',
+            'syncState': 'system_syncState',
+            'version': 'system_version',
+        })
+    node_ready = bool(node_rpc_info.get('health')) and \
+        check_readiness_from_health_status(node_ws_endpoint(node_name), node_rpc_info['health'])
+    if not node_ready:
+        node_rpc_info = dict.fromkeys(['health', 'localListenAddresses', 'nodeRoles', 'peerId', 'peers', 'properties',
+                                       'syncState', 'version'], '?')
+    node_rpc_info['ready'] = node_ready
+    return node_rpc_info
 
 
 def list_substrate_nodes(stateful_set_name):
@@ -199,19 +223,28 @@ def list_substrate_nodes(stateful_set_name):
     return nodes
 
 
+# Add the live status (readiness, sync state, version) of the nodes, the nodes are queried concurrently
+async def list_substrate_nodes_live(stateful_set_name):
+    nodes = list_substrate_nodes(stateful_set_name)
+    loop = asyncio.get_running_loop()
+    live_statuses = await asyncio.gather(*map(
+        lambda node: loop.run_in_executor(fleet_scan_executor, get_node_live_status, node_http_endpoint(node['name']),
+                                          fleet_scan_timeout()), nodes))
+    for node, live_status in zip(nodes, live_statuses):
+        node.update(live_status)
+    return nodes
+
+
 def get_substrate_node(node_name):
     pod = get_pod(node_name)
     node_info = get_node_info_from_pod(pod)
     node_info.update(get_node_info_from_rpc(node_info.get("name")))
     if node_info.get("role") == "authority":
         ws_endpoint = get_relay_chain_rpc_url()
-        validator_set = get_validator_set(ws_endpoint)
-        validators_to_add = get_validators_pending_addition(ws_endpoint)
-        validators_to_retire = get_validators_pending_deletion(ws_endpoint)
+        validator_set_snapshot = get_validator_set_snapshot(ws_endpoint) or ValidatorSetSnapshot()
         node_info['validator_account'] = get_validator_account_from_pod(pod)
         node_info['validator_account_funds'] = get_account_funds(ws_endpoint, node_info['validator_account'])
-        node_info['validator_status'] = get_validator_status(node_info['validator_account'], validator_set, validators_to_add,
-                                                            validators_to_retire)
+        node_info['validator_status'] = validator_set_snapshot.status(node_info['validator_account'])
         node_info['on_chain_session_keys'] = get_account_session_keys(ws_endpoint, node_info['validator_account'])
         if node_info['on_chain_session_keys']:
             node_info['session_keys'] = node_info['on_chain_session_keys']
@@ -249,113 +282,161 @@ def get_substrate_node(node_name):
     return node_info
 
 
-# Setup validator node (rotate + submit session key): returns stash address/empty string depending on success
-async def setup_validators_session_keys(node_name):
-    log.info("Setting up validator session key for {}".format(node_name))
+# Stage 1 of the validator setup: returns the new session keys of the node
+def rotate_validator_session_keys(node_name):
+    node_endpoint = node_http_endpoint(node_name)
+    if not is_node_ready(node_endpoint):
+        raise Exception('{} is not ready'.format(node_name))
+    log.info("Rotating session key on {}".format(node_name))
+    node_session_key = rotate_node_session_keys(node_endpoint)
+    if not node_session_key:
+        raise Exception('failed to rotate the session keys of {}'.format(node_name))
+    return node_session_key
+
+
+# Stage 2 of the validator setup: set the session keys with the node stash account, or on PoS networks when
+# registering the node, bond + set the session keys + validate. Each worker waits for the inclusion on its own
+# connection so the nodes are included in the same blocks instead of one after the other.
+def set_validator_session_keys(node_name, node_session_key, register=False):
     ws_endpoint = get_relay_chain_rpc_url()
-    validators_root_seed = derivation_root_seed()
+    stash_account_mnemonic = get_node_stash_account_mnemonic(derivation_root_seed(), node_name)
+    with dedicated_substrate_client(ws_endpoint) as substrate_client:
+        if not substrate_client:
+            raise Exception('unable to connect to {}'.format(ws_endpoint))
+        if register and relay_chain_consensus() == "pos":
+            log.info('Registering PoS Validator: {}'.format(node_name))
+            if not setup_pos_validator(ws_endpoint, stash_account_mnemonic, node_session_key,
+                                       substrate_client=substrate_client):
+                raise Exception('failed to bond and validate with {}'.format(node_name))
+        else:
+            log.info("Setting session key for {} ({})".format(node_name, node_session_key))
+            if not set_node_session_key(ws_endpoint, stash_account_mnemonic, node_session_key,
+                                        substrate_client=substrate_client):
+                raise Exception('failed to set the session keys of {}'.format(node_name))
 
-    # Rotate session keys
-    node_endpoint = node_http_endpoint(node_name)
-    node_ready = is_node_ready(node_endpoint)
-    stash_account_address = get_derived_node_stash_account_address(validators_root_seed, node_name)
-    if not node_ready:
-        log.warning('{} is not ready, aborting rotate key operation'.format(node_name))
-        return ''
-    else:
-        log.info("Rotating session key on {} ({}) session key".format(node_name, stash_account_address))
-        node_session_key = rotate_node_session_keys(node_endpoint)
-        # If rotate_key result from node is not empty, set session key and mark account to be registered
-        if node_session_key:
-            log.info("Setting session key for {} ({})".format(stash_account_address, node_session_key))
-            node_stash_account_mnemonic = get_node_stash_account_mnemonic(validators_root_seed, node_name)
-            session_key_set_status = set_node_session_key(ws_endpoint, node_stash_account_mnemonic, node_session_key)
-            # Don't add the account to the validator set if the setKey operation failed
-            if session_key_set_status:
-                log.info('Successfully set session keys'.format(stash_account_address))
-                return stash_account_address
-            else:
-                log.warning(
-                    'failed to set session keys, removing {} from addresses to be added to the validators set'.format(
-                        stash_account_address))
-                return ''
 
+# Run function(*args) on the executor of a registration stage, raises asyncio.TimeoutError after
+# registration_node_timeout() seconds
+async def run_registration_stage(executor, function, *args):
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(loop.run_in_executor(executor, function, *args), registration_node_timeout())
 
-def is_validator_address_already_registered(address, validator_set, validators_to_add, validators_to_retire):
-    is_node_in_validator_set = address in validator_set
-    is_node_in_validators_to_add = address in validators_to_add
-    is_node_in_validators_to_retire = address in validators_to_retire
-    return is_node_in_validator_set or is_node_in_validators_to_add or is_node_in_validators_to_retire
+
+# Setup validator node (rotate + submit session key, bond + validate when registering a PoS validator), returns the
+# result of the node: {'node', 'address', 'status': 'keys_set', 'failed' or 'unknown', 'stage': last stage reached,
+# 'error'}. A node timing out once its extrinsic is submitted is 'unknown': the extrinsic may still be included.
+async def setup_validators_session_keys(node_name, register=False):
+    log.info("Setting up validator session key for {}".format(node_name))
+    result = {'node': node_name, 'address': get_derived_node_stash_account_address(derivation_root_seed(), node_name),
+              'status': 'failed', 'stage': 'rotate_keys', 'error': None}
+    try:
+        node_session_key = await run_registration_stage(rotate_keys_executor, rotate_validator_session_keys,
+                                                        node_name)
+        result['stage'] = 'set_keys'
+        await run_registration_stage(set_keys_executor, set_validator_session_keys, node_name, node_session_key,
+                                     register)
+        result['status'] = 'keys_set'
+    except asyncio.TimeoutError:
+        result['error'] = 'timed out after {}s'.format(registration_node_timeout())
+        if result['stage'] == 'set_keys':
+            result['status'] = 'unknown'
+    except Exception as e:
+        result['error'] = str(e)
+    if result['error']:
+        log.warning('Failed to set up {} ({}) at stage {}: {}'.format(node_name, result['address'], result['stage'],
+                                                                      result['error']))
+    return result
 
 
 def register_validator_addresses(validator_addresses_to_register):
     log.info(f'registering the following validators addresses: {validator_addresses_to_register}')
     ws_endpoint = get_relay_chain_rpc_url()
     sudo_seed = network_sudo_seed()
-    register_validators(ws_endpoint, sudo_seed, validator_addresses_to_register)
+    return register_validators(ws_endpoint, sudo_seed, validator_addresses_to_register)
 
 
+# Staged registration: the nodes are set up concurrently (rotate keys -> set keys or bond + validate, each stage
+# bounded by its own worker pool) then the PoA validators which have their keys set are registered in one sudo call.
+# Returns {node: result} (see setup_validators_session_keys), status is 'registered', 'already_registered', 'failed'
+# or 'unknown'
 async def register_validator_pods(pods):
     log.info(f'registering validators pods')
 
     ws_endpoint = get_relay_chain_rpc_url()
     substrate_client = get_relay_chain_client()
     sudo_seed = network_sudo_seed()
-    validator_set = get_validator_set(ws_endpoint)
-    validators_to_add = get_validators_pending_addition(ws_endpoint)
-    validators_to_retire = get_validators_pending_deletion(ws_endpoint)
+    validator_set_snapshot = get_validator_set_snapshot(ws_endpoint)
     node_stash_accounts = []
     nodes_to_register = []
-    consensus = relay_chain_consensus()
-    validators_root_seed = derivation_root_seed()
-
+    results = {}
+
+    prewarm_validator_accounts(pods)
+    if validator_set_snapshot is None:
+        # registering the validators already in the set would bond or register them twice
+        log.error('Unable to read the validator set, aborting the registration of the validators pods')
+        for pod in pods:
+            results[pod.metadata.name] = {'node': pod.metadata.name, 'address': get_validator_account_from_pod(pod),
+                                          'status': 'failed', 'stage': 'validator_set',
+                                          'error': 'unable to read the validator set'}
+        return results
     for pod in pods:
         node = pod.metadata.name
         log.info(f'starting to register validator: {node}')
         validator_stash_account = get_validator_account_from_pod(pod)
-        if not is_validator_address_already_registered(validator_stash_account, validator_set, validators_to_add,
-                                                       validators_to_retire):
+        if not validator_set_snapshot.is_registered(validator_stash_account):
             node_stash_accounts.append(validator_stash_account)
             nodes_to_register.append(node)
+        else:
+            results[node] = {'node': node, 'address': validator_stash_account, 'status': 'already_registered',
+                             'stage': None, 'error': None}
 
     log.info(f'funding the following stash accounts: {node_stash_accounts}')
     fund_accounts(substrate_client, node_stash_accounts, sudo_seed)
-    if consensus == "poa":
-        validator_session_keys_tasks = []
-        log.info(f'setting up session keys for the following nodes: {nodes_to_register}')
-        for node_to_register in nodes_to_register:
-            validator_session_keys_tasks.append(setup_validators_session_keys(node_to_register))
-        accounts_to_register = await asyncio.gather(*validator_session_keys_tasks)
-        # remove empty strings from list (ie. don't register nodes which failed to generate session keys)
-        accounts_to_register = list(filter(None, accounts_to_register))
-
+    log.info(f'setting up session keys for the following nodes: {nodes_to_register}')
+    node_results = await asyncio.gather(*map(lambda node: setup_validators_session_keys(node, register=True),
+                                             nodes_to_register))
+    # don't register nodes which failed to set their session keys
+    nodes_with_keys = list(filter(lambda node_result: node_result['status'] == 'keys_set', node_results))
+
+    if nodes_with_keys and relay_chain_consensus() == "poa":
+        accounts_to_register = list(map(lambda node_result: node_result['address'], nodes_with_keys))
         log.info(f'adding {len(accounts_to_register)} addresses to the validator set: {accounts_to_register}')
-        register_validator_addresses(accounts_to_register)
+        status, error = 'registered', None
+        try:
+            receipt = await run_registration_stage(set_keys_executor, register_validator_addresses,
+                                                   accounts_to_register)
+            if not (receipt and receipt.is_success):
+                status, error = 'failed', 'register_validators call failed'
+        except asyncio.TimeoutError:
+            # the sudo call may still be included
+            status, error = 'unknown', 'timed out after {}s'.format(registration_node_timeout())
+        for node_result in nodes_with_keys:
+            node_result.update(stage='register', status=status, error=error)
     else:
-        for node in nodes_to_register:
-            validator_stash_mnemonic = get_node_stash_account_mnemonic(validators_root_seed, node)
-
-            log.info(f'Rotate node session keys for {node}')
-            node_session_key = rotate_node_session_keys(node_http_endpoint(node))
+        # PoS: bonded and validating, the validator will be elected in a next era
+        for node_result in nodes_with_keys:
+            node_result['status'] = 'registered'
 
-            log.info(f'Registering PoS Validator: {node}')
-            status = setup_pos_validator(ws_endpoint, validator_stash_mnemonic, node_session_key)
-            if status:
-                log.info(f'Successfully set up PoS Validator: {node}')
-            else:
-                log.error(f'Fail to set up PoS Validator: {node}')
+    for node_result in node_results:
+        results[node_result['node']] = node_result
+    registered_nodes = list(filter(lambda node: results[node]['status'] == 'registered', results))
+    failed_nodes = list(filter(lambda node: results[node]['status'] == 'failed', results))
+    unknown_nodes = list(filter(lambda node: results[node]['status'] == 'unknown', results))
+    log.info(f'registered {len(registered_nodes)} validators: {registered_nodes}, failed: {failed_nodes}, '
+             f'unknown: {unknown_nodes}')
+    return results
 
 
 async def register_statefulset_validators(stateful_set_name):
     log.info(f'registering validators from stateful set: {stateful_set_name}')
     validator_pods = list_validator_pods(stateful_set_name)
-    await register_validator_pods(validator_pods)
+    return await register_validator_pods(validator_pods)
 
 
 async def register_validator_nodes(nodes):
     log.info(f'registering the following validators nodes: {nodes} on {relay_chain_network_name}')
     pods_to_register = list(map(lambda pod_name: get_pod(pod_name), nodes))
-    await register_validator_pods(pods_to_register)
+    return await register_validator_pods(pods_to_register)
 
 
 async def deregister_validator_addresses(validator_addresses_to_deregister):
@@ -369,9 +450,10 @@ async def deregister_validator_addresses(validator_addresses_to_deregister):
 async def deregister_validator_pods(pods):
     log.info(f'deregistering validators pods on {relay_chain_network_name}')
     ws_endpoint = get_relay_chain_rpc_url()
-    validator_set = get_validator_set(ws_endpoint)
-    validators_to_add = get_validators_pending_addition(ws_endpoint)
-    validators_to_retire = get_validators_pending_deletion(ws_endpoint)
+    validator_set_snapshot = get_validator_set_snapshot(ws_endpoint)
+    if validator_set_snapshot is None:
+        log.error('Unable to read the validator set, aborting the deregistration of the validators pods')
+        return
     consensus = relay_chain_consensus()
 
     accounts_to_deregister = []
@@ -379,12 +461,9 @@ async def deregister_validator_pods(pods):
     for pod in pods:
         node = pod.metadata.name
         validator_account = get_validator_account_from_pod(pod)
-        validator_account_registration_status = is_validator_address_already_registered(validator_account, validator_set, validators_to_add,
-                                                validators_to_retire)
+        validator_account_registration_status = validator_set_snapshot.is_registered(validator_account)
         log.debug(f'validator_stash_account={validator_account}')
-        log.debug(f'validator_set={validator_set}')
-        log.debug(f'validators_to_add={validators_to_add}')
-        log.debug(f'validators_to_retire={validators_to_retire}')
+        log.debug(f'validator_set_snapshot={validator_set_snapshot}')
         if validator_account_registration_status:
             log.debug(f'adding {node} (validatorAccount={validator_account}) to the nodes to deregister')
             accounts_to_deregister.append(validator_account)
@@ -427,6 +506,7 @@ async def rotate_nodes_session_keys(stateful_set_name):
         # rotate keys of nodes which don't have their validator account set in labels
         if 'validatorAccount' not in pod.metadata.labels:
             nodes_to_rotate_session_keys.append(node_name)
+            node_stash_accounts.append(get_validator_account_from_pod(pod))
 
     log.info('making sure the following stash account are properly funded: {}'.format(node_stash_accounts))
     fund_accounts(substrate_client, node_stash_accounts, sudo_seed)
@@ -435,9 +515,9 @@ async def rotate_nodes_session_keys(stateful_set_name):
     for node in nodes_to_rotate_session_keys:
         validator_session_keys_tasks.append(setup_validators_session_keys(node))
 
-    session_keys_to_rotate = await asyncio.gather(*validator_session_keys_tasks)
-    # remove empty strings from list
-    session_keys_to_rotate = list(filter(None, session_keys_to_rotate))
+    node_results = await asyncio.gather(*validator_session_keys_tasks)
+    session_keys_to_rotate = list(map(lambda node_result: node_result['address'],
+                                      filter(lambda node_result: node_result['status'] == 'keys_set', node_results)))
     log.info(
         '{} session keys have been rotated and set: {}'.format(len(session_keys_to_rotate), session_keys_to_rotate))
 
@@ -447,8 +527,10 @@ def get_session_queued_keys():
 
 
 # Parachains
-def list_parachains():
+def list_parachains(at=None):
     substrate_client = get_relay_chain_client()
+    # all the on-chain reads are done at the same block
+    at = at or get_pinned_block_hash(substrate_client)
 
     # retrieve the list of parachains for which we have collators in the cluster
     collator_pods = list_collator_pods()
@@ -462,14 +544,14 @@ def list_parachains():
         parachains[para_id] = {'name': chain, 'location': 'in_cluster'}
 
     # retrieve parachain and parathread IDs
-    parathread_ids = get_parathreads_ids(substrate_client)
-    parachain_ids = get_parachains_ids(substrate_client)
+    parathread_ids = get_parathreads_ids(substrate_client, at)
+    parachain_ids = get_parachains_ids(substrate_client, at)
     para_ids = parathread_ids + parachain_ids
     # retrieve on-chain para infos
-    parachain_lifecycles = get_all_parachain_lifecycles(substrate_client)
-    parachain_leases_count = get_all_parachain_leases_count(substrate_client)
-    parachain_current_code_hashes = get_all_parachain_current_code_hashes(substrate_client)
-    parachain_heads = get_all_parachain_heads(substrate_client)
+    parachain_lifecycles = get_all_parachain_lifecycles(substrate_client, at)
+    parachain_leases_count = get_all_parachain_leases_count(substrate_client, at)
+    parachain_current_code_hashes = get_all_parachain_current_code_hashes(substrate_client, at)
+    parachain_heads = get_all_parachain_heads(substrate_client, at)
     for para_id in para_ids:
         if para_id in parachains and 'name' in parachains[para_id]:
             para_name = parachains[para_id]['name']
@@ -489,6 +571,18 @@ def list_parachains():
 
 
 async def onboard_parachain_by_id(para_id: str, force_queue_action: bool, parathread: bool):
+    # skip the parachains already being onboarded by a previous cron run or API call
+    if int(para_id) in onboarding_para_ids:
+        log.info(f'Parachain #{para_id} onboarding already in progress')
+        return
+    onboarding_para_ids.add(int(para_id))
+    try:
+        await asyncio.to_thread(onboard_parachain, para_id, force_queue_action, parathread)
+    finally:
+        onboarding_para_ids.discard(int(para_id))
+
+
+def onboard_parachain(para_id, force_queue_action, parathread):
     log.info(f'starting to onboard parachain #{para_id}')
     relay_chain_client = get_relay_chain_client()
     sudo_seed = network_sudo_seed()
@@ -498,7 +592,7 @@ async def onboard_parachain_by_id(para_id: str, force_queue_action: bool, parath
         node_para_id = get_parachain_id(parachain_pods[0])
         if node_para_id == para_id:
             state = get_parachain_head(para_node_client)
-            wasm = get_chain_wasm(para_node_client)
+            wasm = get_cached_chain_wasm(para_node_client)
             if state and wasm:
                 permanent_slot_lease_period_length = 0 if parathread else get_permanent_slot_lease_period_length(relay_chain_client)
                 log.info('Scheduling parachain #{}, state:{}, wasm: {}...{}, lease: {}'.format(
@@ -526,7 +620,8 @@ async def offboard_parachain_by_id(para_id: str, force_queue_action: bool):
 
 
 # Collators
-def list_parachain_collators(para_id: str, stateful_set_name: str = ''):
+# at: parachain block hash at which to read the collator set (default: best block)
+def list_parachain_collators(para_id: str, stateful_set_name: str = '', at: str = None):
     collator_pods = list_collator_pods(para_id, stateful_set_name)
     # Read the first collator pod chain metadata for this para_id to retrieve the chain name
     if collator_pods:
@@ -541,25 +636,26 @@ def list_parachain_collators(para_id: str, stateful_set_name: str = ''):
     collator_selection_invulnerables = []
     collator_selection_candidates = []
     collator_selection_desired_candidates = None
-    runtime = get_last_runtime_upgrade(parachain_node_client)
+    runtime = get_last_runtime_upgrade(parachain_node_client, at)
     try:
         # Get parachain staking pallet state for "moon*" chains
         if chain_name.startswith("moon"):
-            parachain_staking_selected_candidates = parachain_node_client.query('ParachainStaking',
-                                                                                'SelectedCandidates', params=[]).value
-            parachain_staking_candidate_pool = parachain_node_client.query('ParachainStaking', 'CandidatePool',
-                                                                            params=[]).value
+            parachain_staking_selected_candidates = query_storage(parachain_node_client, 'ParachainStaking',
+                                                                  'SelectedCandidates', at=at)
+            parachain_staking_candidate_pool = query_storage(parachain_node_client, 'ParachainStaking',
+                                                             'CandidatePool', at=at)
 
         # Get collatorSelection pallet state if the pallet is present
-        collator_selection_invulnerables = parachain_node_client.query('CollatorSelection', 'Invulnerables',
-                                                                        params=[]).value
-        collator_selection_candidates = parachain_node_client.query('CollatorSelection', 'Candidates', params=[]).value
-        collator_selection_desired_candidates = parachain_node_client.query('CollatorSelection', 'DesiredCandidates',
-                                                                            params=[]).value
+        collator_selection_invulnerables = query_storage(parachain_node_client, 'CollatorSelection', 'Invulnerables',
+                                                         at=at)
+        collator_selection_candidates = query_storage(parachain_node_client, 'CollatorSelection', 'Candidates', at=at)
+        collator_selection_desired_candidates = query_storage(parachain_node_client, 'CollatorSelection',
+                                                              'DesiredCandidates', at=at)
     except Exception as err:
         log.info(f'Unable to get collator set: {err}')
 
     collators = []
+    prewarm_collator_accounts(collator_pods)
     for pod in collator_pods:
         node_name = pod.metadata.name
         collator_account = get_collator_account_from_pod(pod)
@@ -617,10 +713,7 @@ def list_parachain_collators(para_id: str, stateful_set_name: str = ''):
 
 
 async def register_collator_nodes(chain, nodes, ss58_format):
-    collators_register_tasks = []
-    for node_name in nodes:
-        collators_register_tasks.append(collator_register(chain, node_name, ss58_format))
-    accounts_to_register = await asyncio.gather(*collators_register_tasks)
+    accounts_to_register = await collators_register(chain, nodes, ss58_format)
     log.info('adding {} addresses to the collators set: {}'.format(len(accounts_to_register), accounts_to_register))
     return accounts_to_register
 
@@ -699,11 +792,22 @@ async def remove_invulnerable_collator(para_id, node, address):
 
 
 async def set_collator_nodes_keys_on_chain(para_id, nodes=[], statefulset=''):
-    if statefulset:
-        statefulset_nodes = map(lambda node: node.node_name, list_substrate_nodes(statefulset))
-        nodes.extend(statefulset_nodes)
-    for node_name in nodes:
-        ss58_format = get_substrate_node(node_name).get("ss58_format")
-        collator_set_keys(node_name, para_id, ss58_format)
+    def get_collator_pods():
+        collator_pods = list(map(get_pod, nodes or []))
+        if statefulset:
+            collator_pods.extend(list_collator_pods(stateful_set_name=statefulset))
+        return collator_pods
+    try:
+        collator_pods = await asyncio.to_thread(get_collator_pods)
+    except Exception as e:
+        log.error(f'Unable to list the collators of parachain #{para_id}; nodes={nodes}, statefulset={statefulset}, '
+                  f'Error: {e}')
+        return []
+    if not collator_pods:
+        return []
+    # the ss58 format is a label of the pods, the nodes don't need to be queried
+    nodes_ss58_format = list(map(lambda pod: (pod.metadata.name, pod.metadata.labels.get('ss58Format', '42')),
+                                 collator_pods))
+    return await collators_set_keys(para_id, nodes_ss58_format)
 
 
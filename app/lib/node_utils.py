@@ -3,6 +3,7 @@ import logging
 
 from app.config.constants import KEY_TYPE_SHORT_NAMES
 from app.config.network_configuration import network_healthy_min_peer_count
+from app.lib.substrate import substrate_rpc_batch_request
 from substrateinterface import Keypair
 
 log = logging.getLogger('node_utils')
@@ -16,6 +17,32 @@ def get_node_health(node_http_endpoint):
         return False
 
 
+# Readiness, sync state and version of a node in a single JSON-RPC batch over HTTP.
+# Returns {'ready': bool, 'peers', 'is_syncing', 'best_block', 'highest_block', 'version'} ('?' when unknown)
+def get_node_live_status(node_http_endpoint, timeout=2):
+    live_status = {'ready': False, 'peers': '?', 'is_syncing': '?', 'best_block': '?', 'highest_block': '?',
+                   'version': '?'}
+    try:
+        batch = [{'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': []}
+                 for request_id, method in enumerate(['system_health', 'system_syncState', 'system_version'])]
+        response = requests.post(node_http_endpoint, json=batch, timeout=timeout)
+        results = {result['id']: result.get('result') for result in response.json()}
+    except Exception as err:
+        log.error("Failed to get live status of {}; Error: {}".format(node_http_endpoint, err))
+        return live_status
+    health, sync_state, version = results.get(0), results.get(1), results.get(2)
+    if health:
+        live_status['ready'] = check_readiness_from_health_status(node_http_endpoint, health)
+        live_status['peers'] = health['peers']
+        live_status['is_syncing'] = health['isSyncing']
+    if sync_state:
+        live_status['best_block'] = sync_state['currentBlock']
+        live_status['highest_block'] = sync_state.get('highestBlock') or sync_state['currentBlock']
+    if version:
+        live_status['version'] = version
+    return live_status
+
+
 def has_pod_node_role_label(pod):
     return (pod.metadata.labels.get('role') == 'full'
             or pod.metadata.labels.get('role') == 'authority'
@@ -40,6 +67,11 @@ def check_readiness_from_health(node_http_endpoint, health):
         health_status = health.json()['result']
     else:
         health_status = health.json()
+    return check_readiness_from_health_status(node_http_endpoint, health_status)
+
+
+# health_status is the system_health result: {"isSyncing": bool, "peers": int, "shouldHavePeers": bool}
+def check_readiness_from_health_status(node_http_endpoint, health_status):
     healthy_min_peer_count = network_healthy_min_peer_count()
 
     status = not health_status['isSyncing'] and health_status['peers'] >= healthy_min_peer_count
@@ -84,9 +116,9 @@ def get_node_sync_state(node_client):
 
 
 # returns {'spec_version': 9230, 'spec_name': 'rococo'}
-def get_last_runtime_upgrade(node_client):
+def get_last_runtime_upgrade(node_client, at=None):
     try:
-        return node_client.query("System", "LastRuntimeUpgrade").value['spec_version']
+        return node_client.query("System", "LastRuntimeUpgrade", block_hash=at).value['spec_version']
     except Exception as err:
         log.error("Failed to call System.LastRuntimeUpgrade on {}; Error: {}".format(getattr(node_client, 'url', 'NO_URL'), err))
         return None
@@ -103,10 +135,12 @@ def node_keystore_has_key(node_client, public_key_type, public_key_value):
 
 
 def check_has_session_keys(node_client, session_keys=None):
-    has_session_keys = {}
+    # Check all the keys with a single JSON-RPC batch
+    has_key_requests = {}
     for key_type, key_value in session_keys.items():
-        has_session_keys[key_type] = node_keystore_has_key(node_client, key_type, key_value)
-    return has_session_keys
+        log.debug(f'Check that node has [keyType={KEY_TYPE_SHORT_NAMES[key_type]},publicKey={key_value}]')
+        has_key_requests[key_type] = ('author_hasKey', [key_value, KEY_TYPE_SHORT_NAMES[key_type]])
+    return substrate_rpc_batch_request(node_client, has_key_requests)
 
 
 def inject_key(node_client, key_uri, key_type='aura'):
@@ -0,0 +1,62 @@
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# {(url, ss58_address): NonceManager}
+nonce_managers = {}
+nonce_managers_lock = threading.Lock()
+
+
+# Next nonce of a signer, tracked locally so that extrinsics of the signer can be signed and submitted back to back
+# without waiting for the inclusion of the previous one. The local nonce is reconciled with system_accountNextIndex
+# (which, unlike the AccountNonceApi used by create_signed_extrinsic, counts the extrinsics in the transaction pool)
+# so extrinsics submitted by other means don't get a nonce twice.
+class NonceManager:
+
+    def __init__(self, address):
+        self.address = address
+        self.nonce = None
+        # {nonce: callback aborting the submission}, extrinsics submitted and not yet included
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return 'NonceManager(address={}, nonce={})'.format(self.address, self.nonce)
+
+    def next_nonce(self, substrate_client):
+        with self.lock:
+            chain_nonce = substrate_client.rpc_request('system_accountNextIndex', [self.address])['result']
+            nonce = chain_nonce if self.nonce is None else max(self.nonce, chain_nonce)
+            self.nonce = nonce + 1
+            return nonce
+
+    # The extrinsic signed with `nonce` was not accepted by the node: give the nonce back if it is the last one
+    # handed out, otherwise resync with the chain on the next call. The in-flight extrinsics with a later nonce can't be
+    # included anymore (they stay in the transaction pool as 'future'), they are aborted.
+    def release(self, nonce):
+        with self.lock:
+            if self.nonce == nonce + 1:
+                self.nonce = nonce
+            else:
+                log.warning('Nonce {} of {} released out of order, resyncing with the chain'.format(nonce, self.address))
+                self.nonce = None
+            aborts = [abort for in_flight_nonce, abort in self.in_flight.items() if in_flight_nonce > nonce]
+        for abort in aborts:
+            abort()
+
+    def track(self, nonce, abort):
+        with self.lock:
+            self.in_flight[nonce] = abort
+
+    def untrack(self, nonce):
+        with self.lock:
+            self.in_flight.pop(nonce, None)
+
+
+def get_nonce_manager(url, address):
+    with nonce_managers_lock:
+        nonce_manager = nonce_managers.get((url, address))
+        if nonce_manager is None:
+            nonce_manager = nonce_managers[(url, address)] = NonceManager(address)
+        return nonce_manager
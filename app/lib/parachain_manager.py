@@ -1,17 +1,26 @@
 import logging
+import threading
+from collections import OrderedDict
 from math import floor
 
 from substrateinterface.exceptions import StorageFunctionNotFound
 
+from app.config.network_configuration import network_sudo_seed
 from app.lib.substrate import substrate_batchall_call, get_node_client, \
-    substrate_sudo_relay_xcm_call, substrate_call, get_query_weight
+    substrate_sudo_relay_xcm_call, get_query_weight, query_storage, query_storage_map, get_constant, \
+    get_relay_chain_client, compose_xcm_transact_call, BatchReceipt
 from substrateinterface import Keypair
 from app.lib.kubernetes_client import list_collator_pods
 from substrateinterface.utils.hasher import blake2_256
-import time
 
 log = logging.getLogger('collator_manager')
 
+CHAIN_WASM_STORE_SIZE = 16
+
+# Wasm of the parachains, content addressed: {code_hash: wasm}
+chain_wasm_store = OrderedDict()
+chain_wasm_store_lock = threading.Lock()
+
 
 def get_parachain_node_client(para_id):
     parachain_pods = list_collator_pods(para_id)
@@ -19,15 +28,14 @@ def get_parachain_node_client(para_id):
 
 
 # returns current parachains list
-def get_parachains_ids(substrate_client):
-    parachains = substrate_client.query('Paras', 'Parachains', params=[])
-    parachain_ids = parachains.value
+def get_parachains_ids(substrate_client, at=None):
+    parachain_ids = query_storage(substrate_client, 'Paras', 'Parachains', at=at)
     return parachain_ids
 
 
 # returns current parathread list (including UpgradingParathread, DowngradingParathread, etc.)
-def get_parathreads_ids(substrate_client):
-    paras_lifecycles = get_all_parachain_lifecycles(substrate_client)
+def get_parathreads_ids(substrate_client, at=None):
+    paras_lifecycles = get_all_parachain_lifecycles(substrate_client, at)
     parathread_ids = list(para_id for (para_id, lifecycle) in paras_lifecycles.items() if lifecycle != 'Parachain')
     return parathread_ids
 
@@ -40,12 +48,11 @@ def get_parachain_leases_count(substrate_client, para_id):
 
 
 # returns leases count of all paras
-def get_all_parachain_leases_count(substrate_client):
-    leases = substrate_client.query_map('Slots', 'Leases')
+def get_all_parachain_leases_count(substrate_client, at=None):
+    leases = query_storage_map(substrate_client, 'Slots', 'Leases', at=at)
     result = {}
-    for para_lifecycle in leases:
-        para_id = para_lifecycle[0].value
-        result[para_id] = len(para_lifecycle[1].value)
+    for para_id, para_leases in leases:
+        result[para_id] = len(para_leases)
     return result
 
 
@@ -56,35 +63,24 @@ def get_parachain_lifecycles(substrate_client, para_id):
 
 
 # returns lifecycles of all paras
-def get_all_parachain_lifecycles(substrate_client):
-    paras_lifecycles = substrate_client.query_map('Paras', 'ParaLifecycles')
+def get_all_parachain_lifecycles(substrate_client, at=None):
+    paras_lifecycles = query_storage_map(substrate_client, 'Paras', 'ParaLifecycles', at=at)
     result = {}
-    for para_lifecycle in paras_lifecycles:
+    for para_id, para_lifecycle in paras_lifecycles:
         # If all parachins are off-boarded, ParaLifecycles will return list of None objets without 'value' attribute.
-        if getattr(para_lifecycle[0], "value", None):
-            para_id = para_lifecycle[0].value
-            result[para_id] = para_lifecycle[1].value
+        if para_id:
+            result[para_id] = para_lifecycle
     return result
 
 
 # returns current code hashes of all paras
-def get_all_parachain_current_code_hashes(substrate_client):
-    paras_current_code_hashes = substrate_client.query_map('Paras', 'CurrentCodeHash')
-    result = {}
-    for para_code_hash in paras_current_code_hashes:
-        para_id = para_code_hash[0].value
-        result[para_id] = para_code_hash[1].value
-    return result
+def get_all_parachain_current_code_hashes(substrate_client, at=None):
+    return dict(query_storage_map(substrate_client, 'Paras', 'CurrentCodeHash', at=at))
 
 
 # returns current code hashes of all paras
-def get_all_parachain_heads(substrate_client):
-    paras_heads = substrate_client.query_map('Paras', 'Heads')
-    result = {}
-    for paras_head in paras_heads:
-        para_id = paras_head[0].value
-        result[para_id] = paras_head[1].value
-    return result
+def get_all_parachain_heads(substrate_client, at=None):
+    return dict(query_storage_map(substrate_client, 'Paras', 'Heads', at=at))
 
 
 def get_parachain_id(pod):
@@ -104,13 +100,45 @@ def get_parachain_id(pod):
         return None
 
 
-def get_chain_wasm(node_client):
+def get_chain_wasm(node_client, at=None):
     # query for Substrate.Code see: https://github.com/polkascan/py-substrate-interface/issues/190
-    block_hash = node_client.get_chain_head()
+    block_hash = at or node_client.get_chain_head()
     parachain_wasm = node_client.get_storage_by_key(block_hash, "0x3a636f6465")
     return parachain_wasm
 
 
+# the node hashes the storage value with the chain hasher (blake2_256), so the hash of :code is the code hash and the
+# wasm doesn't need to be downloaded
+def get_chain_code_hash(node_client, at=None):
+    try:
+        code_hash = node_client.rpc_request(method="state_getStorageHash", params=["0x3a636f6465", at] if at else
+                                            ["0x3a636f6465"])['result']
+        if code_hash:
+            return code_hash
+    except Exception as e:
+        log.warning('Unable to get code hash with state_getStorageHash: {}'.format(e))
+    wasm = get_chain_wasm(node_client, at)
+    return f'0x{blake2_256(bytearray.fromhex(wasm[2:])).hex()}' if wasm else None
+
+
+# Only download the wasm when its code hash is not in the store (e.g. onboarding retried at each cron run)
+def get_cached_chain_wasm(node_client, at=None):
+    code_hash = get_chain_code_hash(node_client, at)
+    with chain_wasm_store_lock:
+        if code_hash in chain_wasm_store:
+            chain_wasm_store.move_to_end(code_hash)
+            return chain_wasm_store[code_hash]
+    wasm = get_chain_wasm(node_client, at)
+    if wasm:
+        # the code may have changed since code_hash was read
+        code_hash = f'0x{blake2_256(bytearray.fromhex(wasm[2:])).hex()}'
+        with chain_wasm_store_lock:
+            chain_wasm_store[code_hash] = wasm
+            while len(chain_wasm_store) > CHAIN_WASM_STORE_SIZE:
+                chain_wasm_store.popitem(last=False)
+    return wasm
+
+
 def convert_header(plain_header, substrate):
     raw_header = '0x'
     raw_header += plain_header['parentHash'].replace('0x', '')
@@ -123,22 +151,22 @@ def convert_header(plain_header, substrate):
     return raw_header
 
 
-def get_parachain_head(node_client):
-    block_header = node_client.rpc_request(method="chain_getHeader", params=[])
+def get_parachain_head(node_client, at=None):
+    block_header = node_client.rpc_request(method="chain_getHeader", params=[at] if at else [])
     return convert_header(block_header['result'], node_client)
 
 
 # get the lease period duration (in number of blocks)
 def get_lease_period_duration(substrate_client):
-    return substrate_client.get_constant("Slots", "LeasePeriod").value
+    return get_constant(substrate_client, "Slots", "LeasePeriod")
 
 
 def get_temporary_slot_lease_period_length(substrate_client):
-    return substrate_client.get_constant("AssignedSlots", "TemporarySlotLeasePeriodLength").value
+    return get_constant(substrate_client, "AssignedSlots", "TemporarySlotLeasePeriodLength")
 
 
 def get_permanent_slot_lease_period_length(substrate_client):
-    return substrate_client.get_constant("AssignedSlots", "PermanentSlotLeasePeriodLength").value
+    return get_constant(substrate_client, "AssignedSlots", "PermanentSlotLeasePeriodLength")
 
 
 def initialize_parachain(substrate_client, sudo_seed, para_id, state, wasm, lease_period_count=0, force_queue_action=True, is_parachain=True):
@@ -204,15 +232,9 @@ def cleanup_parachain(substrate_client, sudo_seed, para_id, force_queue_action=T
     return substrate_batchall_call(substrate_client, keypair, batch_call, True, True)
 
 
-def parachain_runtime_upgrade(runtime_name, para_id, runtime_wasm, check_version=True):
-    log.info(f'Upgrading para-chain #{para_id} runtime to {runtime_name}')
-    # Doc: https://github.com/paritytech/cumulus/issues/764
-    para_client = get_parachain_node_client(para_id)
-    code = '0x' + runtime_wasm.hex()
-    code_hash = f'0x{blake2_256(runtime_wasm).hex()}'
-
-    log.info('Code hash: {}'.format(code_hash))
-    # Construct System.authorizeUpgrade(hash) call on the parachain and grab the encoded call
+# Construct System.authorizeUpgrade(hash) call on the parachain, sent from the relay-chain with a XCM Transact
+# Doc: https://github.com/paritytech/cumulus/issues/764
+def compose_authorize_upgrade_call(para_client, code_hash, check_version=True):
     call_function_metadata = para_client.get_metadata_call_function("System", "authorize_upgrade")
     if len(call_function_metadata['fields']) == 2:
         call_params = {
@@ -221,56 +243,57 @@ def parachain_runtime_upgrade(runtime_name, para_id, runtime_wasm, check_version
         }
     else:
         call_params = {'code_hash': code_hash}
-    authorize_upgrade = para_client.compose_call(
+    return para_client.compose_call(
         call_module='System',
         call_function='authorize_upgrade',
         call_params=call_params
     )
+
+
+def send_authorize_upgrade(para_id, para_client, code_hash, check_version=True):
+    authorize_upgrade = compose_authorize_upgrade_call(para_client, code_hash, check_version)
     weight = get_query_weight(para_client, authorize_upgrade)
-    receipt = substrate_sudo_relay_xcm_call(para_id, authorize_upgrade.encode(), weight)
-    if receipt and receipt.is_success:
-        log.info('Successfully sent System.authorizeUpgrade(hash) on Relaychain')
-        log.info('https://polkadot.js.org/apps/#/explorer/query/{}'.format(receipt.block_hash))
-    else:
-        err = "Unable to send System.authorizeUpgrade(hash) on Relaychain. Error: {}".format(
-            getattr(receipt, 'error_message', None))
-        log.error(err)
-        return False, err
-
-    # After XCM dispatch (as pointed out by Document Runtime Upgrade Process #764
-    # we need to wait for both the Relay Chain block as well as the Parachain block that will process the XCM),
-    # submit the compact.compressed.wasm file using the unsigned transaction parachainSystem.enactAuthorizedUpgrade.
-    # Anyone can submit this extrinsic. Trouble Shooting: 1010: Invalid Transaction: Transaction call is not
-    # expected. means the XCM was not yet processed on the parachain side so it does not recognize the blob. A
-    # collator restart will reset the transaction banning as a workaround.
-    log.info('Waiting 30s for parachain to receive AuthorizedUpgrade XCM')
-    for i in range(30):
-        time.sleep(2)
-        authorized_upgrade = para_client.query('System', 'AuthorizedUpgrade')
-        if authorized_upgrade.value:
-            break
-        if i == 29:
-            err = "Timeout, parachain did not received AuthorizedUpgrade message"
-            log.error(err)
-            return False, err
-
-    # After dispatch, submit the compact.compressed.wasm file using the unsigned transaction
-    # system.applyAuthorizedUpgrade. Anyone can submit this extrinsic.
-    apply_upgrade = para_client.compose_call(
+    return substrate_sudo_relay_xcm_call(para_id, authorize_upgrade.encode(), weight)
+
+
+# Send the authorize_upgrade XCM of several parachains in a single (chunked) sudo batch from the relay-chain.
+# upgrades: [(para_id, para_client, code_hash)], returns the error of each upgrade (None if the XCM was sent)
+def send_authorize_upgrades(upgrades, check_version=True):
+    relay_client = get_relay_chain_client()
+    keypair = Keypair.create_from_seed(network_sudo_seed())
+    batch_call = []
+    for para_id, para_client, code_hash in upgrades:
+        authorize_upgrade = compose_authorize_upgrade_call(para_client, code_hash, check_version)
+        weight = get_query_weight(para_client, authorize_upgrade)
+        batch_call.append(compose_xcm_transact_call(relay_client, para_id, authorize_upgrade.encode(), weight))
+    receipt = substrate_batchall_call(relay_client, keypair, batch_call, True, True)
+    batch_receipt = receipt if isinstance(receipt, BatchReceipt) else BatchReceipt([list(range(len(batch_call)))],
+                                                                                   [receipt])
+    errors = []
+    for index in range(len(batch_call)):
+        chunk = batch_receipt.chunk_of(index)
+        chunk_receipt = batch_receipt.receipts[chunk]
+        if not (chunk_receipt and chunk_receipt.is_success):
+            errors.append(str(getattr(chunk_receipt, 'error_message', None)))
+            continue
+        # Utility.batch stops at the first failed call
+        interrupted = [event.value['attributes'] for event in chunk_receipt.triggered_events
+                       if event.value['event_id'] == 'BatchInterrupted']
+        if interrupted and batch_receipt.chunks[chunk].index(index) >= interrupted[0]['index']:
+            errors.append(str(interrupted[0]['error']))
+        else:
+            errors.append(None)
+    return errors
+
+
+# After dispatch, submit the compact.compressed.wasm file using the unsigned transaction
+# system.applyAuthorizedUpgrade. Anyone can submit this extrinsic.
+# runtime_wasm: bytes, SCALE encoded as is (no hex copy of the runtime)
+def compose_apply_authorized_upgrade_call(para_client, runtime_wasm):
+    return para_client.compose_call(
         call_module='System',
         call_function='apply_authorized_upgrade',
         call_params={
-            'code': code
+            'code': runtime_wasm
         }
     )
-    receipt = substrate_call(para_client, None, apply_upgrade)
-    if receipt and receipt.is_success:
-        msg = f'Successfully sent system.applyAuthorizedUpgrade on Parachain #{para_id} for {runtime_name} \n' \
-              f'Check results here: https://polkadot.js.org/apps/#/explorer/query/{receipt.block_hash}'
-        log.info(msg)
-        return True, msg
-    else:
-        err = f'Unable to sent system.applyAuthorizedUpgrade on Parachain #{para_id} for {runtime_name} \n' \
-              f'Error: {getattr(receipt, "error_message", None)}'
-        log.error(err)
-        return False, err
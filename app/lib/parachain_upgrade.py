@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import time
+import uuid
+
+from substrateinterface.utils.hasher import blake2_256
+
+from app.config.network_configuration import parachain_upgrade_authorization_timeout, \
+    parachain_upgrade_enactment_timeout
+from app.lib.parachain_manager import get_parachain_node_client, send_authorize_upgrade, \
+    compose_apply_authorized_upgrade_call, send_authorize_upgrades
+from app.lib.substrate_async import get_async_rpc_client, async_submit_extrinsic
+
+log = logging.getLogger(__name__)
+
+PARACHAIN_UPGRADE_JOBS_MAX_SIZE = 100
+CODE_STORAGE_KEY = '0x3a636f6465'
+
+# Parachain runtime upgrades run in the background by the event loop: {job_id: job}
+# A job goes through the states: authorizing -> waiting_authorization -> applying -> enacting -> done (or failed)
+parachain_upgrade_jobs = {}
+# The event loop only keeps weak references to the tasks
+parachain_upgrade_tasks = set()
+
+
+def get_parachain_upgrade_jobs(para_id=None):
+    return list(filter(lambda job: para_id is None or job['para_id'] == int(para_id),
+                       parachain_upgrade_jobs.values()))
+
+
+def get_parachain_upgrade_job(job_id):
+    return parachain_upgrade_jobs.get(job_id)
+
+
+def is_parachain_upgrade_running(para_id):
+    return any(map(lambda job: job['state'] not in ['done', 'failed'], get_parachain_upgrade_jobs(para_id)))
+
+
+def set_job_state(job, state, **job_info):
+    job.update(job_info)
+    job['state'] = state
+    job['updated'] = time.time()
+    if state == 'failed':
+        log.error(f'Parachain #{job["para_id"]} runtime upgrade to {job["runtime"]} failed: {job["error"]}')
+    else:
+        log.info(f'Parachain #{job["para_id"]} runtime upgrade to {job["runtime"]}: {state}')
+
+
+def create_parachain_upgrade_job(runtime_name, para_id, runtime_wasm, code_hash=None):
+    job = {
+        'id': uuid.uuid4().hex,
+        'para_id': int(para_id),
+        'runtime': runtime_name,
+        'code_hash': (code_hash or f'0x{blake2_256(runtime_wasm).hex()}').lower(),
+        'state': 'authorizing',
+        'error': None,
+        'previous_spec_version': None,
+        'spec_version': None,
+        'block_hash': None,
+        'started': time.time(),
+        'updated': time.time()
+    }
+    # forget the oldest finished jobs
+    finished_job_ids = [job_id for job_id, finished_job in parachain_upgrade_jobs.items()
+                        if finished_job['state'] in ['done', 'failed']]
+    for job_id in finished_job_ids[:max(0, len(parachain_upgrade_jobs) + 1 - PARACHAIN_UPGRADE_JOBS_MAX_SIZE)]:
+        parachain_upgrade_jobs.pop(job_id)
+    parachain_upgrade_jobs[job['id']] = job
+    log.info(f'Upgrading para-chain #{para_id} runtime to {runtime_name}, code hash: {job["code_hash"]}, '
+             f'job: {job["id"]}')
+    return job
+
+
+def run_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    parachain_upgrade_tasks.add(task)
+    task.add_done_callback(parachain_upgrade_tasks.discard)
+
+
+# Start the upgrade of a parachain runtime in the background (must be called from the event loop), returns the job
+# or None if an upgrade of the parachain is already running.
+# runtime_wasm: bytes, SCALE encoded as is (no hex copy of the runtime)
+# code_hash: blake2_256 of runtime_wasm if already known (e.g. computed while uploading it)
+def start_parachain_runtime_upgrade(runtime_name, para_id, runtime_wasm, check_version=True, code_hash=None):
+    if is_parachain_upgrade_running(para_id):
+        log.error(f'A runtime upgrade of parachain #{para_id} is already running')
+        return None
+    job = create_parachain_upgrade_job(runtime_name, para_id, runtime_wasm, code_hash)
+    run_in_background(run_parachain_runtime_upgrade(job, runtime_wasm, check_version))
+    return job
+
+
+# Upgrade several parachains at the same time: the authorize_upgrade XCM are sent in a single relay-chain batch,
+# then each parachain is upgraded as soon as it is authorized. Returns the jobs (one per parachain) or None if an
+# upgrade of one of the parachains is already running.
+# upgrades: [(runtime_name, para_id, runtime_wasm, code_hash)]
+def start_parachain_runtime_rollout(upgrades, check_version=True):
+    running_para_ids = [para_id for _, para_id, _, _ in upgrades if is_parachain_upgrade_running(para_id)]
+    if running_para_ids:
+        log.error(f'Runtime upgrades of parachains {running_para_ids} are already running')
+        return None
+    jobs = list(map(lambda upgrade: create_parachain_upgrade_job(*upgrade), upgrades))
+    runtime_wasms = list(map(lambda upgrade: upgrade[2], upgrades))
+    run_in_background(run_parachain_runtime_rollout(jobs, runtime_wasms, check_version))
+    return jobs
+
+
+def get_receipt_error(receipt):
+    if receipt and receipt.is_success:
+        return None
+    return str(getattr(receipt, 'error_message', None))
+
+
+async def connect_parachain(job):
+    para_client = await asyncio.to_thread(get_parachain_node_client, job['para_id'])
+    rpc_client = await get_async_rpc_client(para_client.url)
+    runtime_version = await rpc_client.request('state_getRuntimeVersion')
+    job['previous_spec_version'] = runtime_version['specVersion']
+    return para_client, rpc_client
+
+
+async def run_parachain_runtime_upgrade(job, runtime_wasm, check_version=True):
+    try:
+        para_client, rpc_client = await connect_parachain(job)
+        # Send System.authorizeUpgrade(hash) to the parachain with a XCM from the relay-chain
+        error = await asyncio.to_thread(
+            lambda: get_receipt_error(send_authorize_upgrade(job['para_id'], para_client, job['code_hash'],
+                                                             check_version)))
+    except Exception as err:
+        error = str(err)
+    if error:
+        set_job_state(job, 'failed', error=f'Unable to send System.authorizeUpgrade(hash) on Relaychain: {error}')
+        return
+    await apply_parachain_runtime_upgrade(job, para_client, rpc_client, runtime_wasm)
+
+
+async def run_parachain_runtime_rollout(jobs, runtime_wasms, check_version=True):
+    connections = await asyncio.gather(*map(connect_parachain, jobs), return_exceptions=True)
+    upgrades = []
+    for job, runtime_wasm, connection in zip(jobs, runtime_wasms, connections):
+        if isinstance(connection, Exception):
+            set_job_state(job, 'failed', error=str(connection))
+        else:
+            upgrades.append((job, runtime_wasm) + connection)
+    if not upgrades:
+        return
+    try:
+        errors = await asyncio.to_thread(
+            send_authorize_upgrades,
+            [(job['para_id'], para_client, job['code_hash']) for job, _, para_client, _ in upgrades],
+            check_version)
+    except Exception as err:
+        errors = [str(err)] * len(upgrades)
+    authorized_upgrades = []
+    for (job, runtime_wasm, para_client, rpc_client), error in zip(upgrades, errors):
+        if error:
+            set_job_state(job, 'failed', error=f'Unable to send System.authorizeUpgrade(hash) on Relaychain: {error}')
+        else:
+            authorized_upgrades.append(apply_parachain_runtime_upgrade(job, para_client, rpc_client, runtime_wasm))
+    await asyncio.gather(*authorized_upgrades)
+
+
+async def apply_parachain_runtime_upgrade(job, para_client, rpc_client, runtime_wasm):
+    try:
+        # We need to wait for both the Relay Chain block and the Parachain block that will process the XCM.
+        # Trouble Shooting: 1010: Invalid Transaction: Transaction call is not expected. means the XCM was not yet
+        # processed on the parachain side so it does not recognize the blob. A collator restart will reset the
+        # transaction banning as a workaround.
+        set_job_state(job, 'waiting_authorization')
+        storage_key = await asyncio.to_thread(para_client.create_storage_key, 'System', 'AuthorizedUpgrade')
+        try:
+            await asyncio.wait_for(wait_for_authorized_upgrade(rpc_client, storage_key.to_hex(), job['code_hash']),
+                                   parachain_upgrade_authorization_timeout())
+        except asyncio.TimeoutError:
+            set_job_state(job, 'failed', error='Timeout, parachain did not receive the AuthorizedUpgrade message')
+            return
+
+        set_job_state(job, 'applying')
+        extrinsic = await asyncio.to_thread(
+            lambda: para_client.create_unsigned_extrinsic(
+                call=compose_apply_authorized_upgrade_call(para_client, runtime_wasm)))
+        receipt = await async_submit_extrinsic(para_client, extrinsic)
+        error = await asyncio.to_thread(get_receipt_error, receipt)
+        if error:
+            set_job_state(job, 'failed', error=f'Unable to send system.applyAuthorizedUpgrade: {error}')
+            return
+
+        set_job_state(job, 'enacting', block_hash=receipt.block_hash)
+        try:
+            spec_version = await asyncio.wait_for(wait_for_code_hash(rpc_client, job['code_hash']),
+                                                  parachain_upgrade_enactment_timeout())
+        except asyncio.TimeoutError:
+            set_job_state(job, 'failed', error='Timeout, the new runtime was not enacted')
+            return
+        set_job_state(job, 'done', spec_version=spec_version)
+    except Exception as err:
+        set_job_state(job, 'failed', error=str(err))
+
+
+# Wait for the parachain to store the upgrade authorized by the XCM, returns the block hash
+async def wait_for_authorized_upgrade(rpc_client, storage_key, code_hash):
+    subscription_id, change_sets = await rpc_client.subscribe('state_subscribeStorage', [[storage_key]])
+    try:
+        while True:
+            change_set = await change_sets.get()
+            if isinstance(change_set, Exception):
+                raise change_set
+            # the value is either the code hash or {code_hash, check_version}
+            for key, value in change_set['changes']:
+                if value and code_hash[2:] in value:
+                    return change_set['block']
+    finally:
+        await rpc_client.unsubscribe('state_unsubscribeStorage', subscription_id)
+
+
+# Wait for a new block using the runtime code, returns the spec version of the runtime
+async def wait_for_code_hash(rpc_client, code_hash):
+    subscription_id, heads = await rpc_client.subscribe('chain_subscribeNewHeads')
+    try:
+        while True:
+            head = await heads.get()
+            if isinstance(head, Exception):
+                raise head
+            if await rpc_client.request('state_getStorageHash', [CODE_STORAGE_KEY]) == code_hash:
+                runtime_version = await rpc_client.request('state_getRuntimeVersion')
+                return runtime_version['specVersion']
+    finally:
+        await rpc_client.unsubscribe('chain_unsubscribeNewHeads', subscription_id)
@@ -0,0 +1,49 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+from app.config.network_configuration import runtime_store_dir
+
+log = logging.getLogger(__name__)
+
+RUNTIME_UPLOAD_CHUNK_SIZE = 1024 * 1024
+CODE_HASH_PATTERN = re.compile('0x[0-9a-f]{64}')
+
+
+# Uploaded runtimes stored on disk by code hash (blake2_256 of the wasm), so that an upgrade can be submitted again
+# (e.g. after a failed apply_authorized_upgrade) without uploading the runtime again.
+def get_runtime_path(code_hash):
+    if not CODE_HASH_PATTERN.fullmatch(code_hash):
+        raise ValueError(f'Invalid code hash: {code_hash}')
+    return os.path.join(runtime_store_dir(), f'{code_hash}.wasm')
+
+
+# Stream the uploaded runtime to the store, hashing it on the fly, returns its code hash
+async def store_runtime(runtime_file):
+    directory = runtime_store_dir()
+    os.makedirs(directory, exist_ok=True)
+    code_hash = hashlib.blake2b(digest_size=32)
+    # Write to a temporary file first so a partial upload is never read
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while chunk := await runtime_file.read(RUNTIME_UPLOAD_CHUNK_SIZE):
+                code_hash.update(chunk)
+                f.write(chunk)
+        code_hash = f'0x{code_hash.hexdigest()}'
+        os.replace(tmp_path, get_runtime_path(code_hash))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    log.info(f'Stored runtime {runtime_file.filename} with code hash {code_hash}')
+    return code_hash
+
+
+def read_runtime(code_hash):
+    try:
+        with open(get_runtime_path(code_hash), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
@@ -1,19 +1,20 @@
+import asyncio
+
 from scalecodec.exceptions import RemainingScaleBytesNotEmptyException
 from substrateinterface import Keypair
-from substrateinterface.utils.hasher import blake2_256
 
 from app.config.network_configuration import network_sudo_seed
 from app.lib.network_utils import log
-from app.lib.parachain_manager import get_chain_wasm, get_parachain_head, get_parachain_node_client
+from app.lib.parachain_manager import get_chain_code_hash, get_parachain_head, get_parachain_node_client
 from app.lib.substrate import get_relay_chain_client, substrate_sudo_call, substrate_wrap_with_weight, \
-    substrate_wrap_with_scheduler
+    substrate_wrap_with_scheduler, query_storage, map_future
+from app.lib.substrate_async import async_substrate_query, async_substrate_rpc_request
 
 
-def get_substrate_runtime(node_client):
-    last_runtime_upgrade = node_client.query("System", "LastRuntimeUpgrade").value
-    wasm = get_chain_wasm(node_client)
-    code_hash = f'0x{blake2_256(bytearray.fromhex(wasm[2:])).hex()}'
-    head = get_parachain_head(node_client)
+def get_substrate_runtime(node_client, at=None):
+    last_runtime_upgrade = query_storage(node_client, "System", "LastRuntimeUpgrade", at=at)
+    code_hash = get_chain_code_hash(node_client, at)
+    head = get_parachain_head(node_client, at)
 
     return {
         'spec_version': last_runtime_upgrade['spec_version'],
@@ -23,70 +24,84 @@ def get_substrate_runtime(node_client):
     }
 
 
-def get_relay_runtime():
+def get_relay_runtime(at=None):
     node_client = get_relay_chain_client()
-    return get_substrate_runtime(node_client)
+    return get_substrate_runtime(node_client, at)
+
+
+# Read on the event loop (see substrate_async.py) for the dashboard, returns {} on error
+async def async_get_relay_active_configuration():
+    relay_client = await asyncio.to_thread(get_relay_chain_client)
+    return await async_substrate_query(relay_client, 'Configuration', 'ActiveConfig') or {}
 
 
-def get_relay_active_configuration():
+def get_relay_active_configuration(at=None):
     relay_client = get_relay_chain_client()
     try:
-        active_config = relay_client.query('Configuration', 'ActiveConfig')
-        return active_config.value
+        return query_storage(relay_client, 'Configuration', 'ActiveConfig', at=at)
     # Catch scale encoding exception happening on Versi
     except RemainingScaleBytesNotEmptyException as err:
         log.error(f'Scale decoding exception: {err}')
         return {}
 
 
-def update_relay_configuration(new_configuration_key, new_configuration_value):
+# pipelined: submit without waiting for the previous sudo extrinsics, returns a concurrent.futures.Future of the
+# result (see substrate_call)
+def update_relay_configuration(new_configuration_key, new_configuration_value, pipelined=False):
     relay_client = get_relay_chain_client()
     keypair = Keypair.create_from_seed(network_sudo_seed())
     # See https://polkascan.github.io/py-substrate-metadata-docs/polkadot/configuration/#set_X
     call = relay_client.compose_call('Configuration', f'set_{new_configuration_key}', {'new': new_configuration_value})
-    receipt = substrate_sudo_call(relay_client, keypair, call)
-    if receipt and receipt.is_success:
-        txt = f'Successfully sent Configuration.set_{new_configuration_key}={new_configuration_value} on Relaychain'
-        log.info(txt)
-        return True, txt
-    else:
-        err = f"Unable to apply Configuration.set_{new_configuration_key}={new_configuration_value} on Relaychain. " \
-              f"Error: {getattr(receipt, 'error_message', None)}"
-        log.error(err)
-        return False, err
-
-
-def get_relaychain_metadata():
-    relay_client = get_relay_chain_client()
-    return relay_client.rpc_request(method='state_getMetadata', params=[])['result']
-
 
-def get_parachain_runtime(para_id):
+    def check_configuration_update(receipt):
+        if receipt and receipt.is_success:
+            txt = f'Successfully sent Configuration.set_{new_configuration_key}={new_configuration_value} on Relaychain'
+            log.info(txt)
+            return True, txt
+        else:
+            err = f"Unable to apply Configuration.set_{new_configuration_key}={new_configuration_value} on Relaychain. " \
+                  f"Error: {getattr(receipt, 'error_message', None)}"
+            log.error(err)
+            return False, err
+    if pipelined:
+        return map_future(substrate_sudo_call(relay_client, keypair, call, pipelined=True), check_configuration_update)
+    return check_configuration_update(substrate_sudo_call(relay_client, keypair, call))
+
+
+async def get_relaychain_metadata():
+    relay_client = await asyncio.to_thread(get_relay_chain_client)
+    return await async_substrate_rpc_request(relay_client, 'state_getMetadata')
+
+
+# at: relay-chain block hash at which to read the parachain state stored on the relay-chain (parachain_head_in_relay and
+# parachain_code_hash_in_relay), the other fields are read from the parachain at its best block
+def get_parachain_runtime(para_id, at=None):
     para_client = get_parachain_node_client(para_id)
     relay_client = get_relay_chain_client()
     runtime_info = get_substrate_runtime(para_client)
     runtime_info['isParachain'] = True
-    runtime_info['parachain_head_in_relay'] = relay_client.query('Paras', 'Heads', params=[para_id]).value
-    runtime_info['parachain_code_hash_in_relay'] = relay_client.query('Paras', 'CurrentCodeHash', params=[para_id]).value
+    runtime_info['parachain_head_in_relay'] = query_storage(relay_client, 'Paras', 'Heads', [para_id], at)
+    runtime_info['parachain_code_hash_in_relay'] = query_storage(relay_client, 'Paras', 'CurrentCodeHash', [para_id],
+                                                                 at)
     return runtime_info
 
 
-def get_parachain_metadata(para_id):
-    para_client = get_parachain_node_client(para_id)
-    return para_client.rpc_request(method='state_getMetadata', params=[])['result']
+async def get_parachain_metadata(para_id):
+    para_client = await asyncio.to_thread(get_parachain_node_client, para_id)
+    return await async_substrate_rpc_request(para_client, 'state_getMetadata')
 
 
+# runtime_wasm: bytes, SCALE encoded as is (no hex copy of the runtime)
 def runtime_upgrade(runtime_name, runtime_wasm, schedule_blocks_wait=None):
     log.info(f'Upgrading relay-chain runtime to {runtime_name} \
             {" with " + schedule_blocks_wait + " blocks " if schedule_blocks_wait else ""}')
     relay_client = get_relay_chain_client()
-    code = '0x' + runtime_wasm.hex()
     keypair = Keypair.create_from_seed(network_sudo_seed())
     inner_call = relay_client.compose_call(
         call_module='System',
         call_function='set_code',
         call_params={
-            'code': code
+            'code': runtime_wasm
         }
     )
     wrapped_call = substrate_wrap_with_weight(relay_client, inner_call)
@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+
+from substrateinterface.storage import StorageKey
+
+from app.config import ws_pool
+from app.config.network_configuration import get_relay_chain_rpc_url
+from app.lib.substrate import query_storage
+
+log = logging.getLogger(__name__)
+
+# Seconds to wait before re-subscribing after the index subscription failed
+RESUBSCRIBE_DELAY = 10
+
+# Storage index of each scope: values of a scope are only updated when its index changes
+SCOPE_INDEXES = {
+    'session': ('Session', 'CurrentIndex'),
+    'era': ('Staking', 'ActiveEra'),
+}
+
+# {url: SessionIndexWatcher}
+session_index_watchers = {}
+session_index_watchers_lock = threading.Lock()
+
+
+# Follows Session.CurrentIndex and Staking.ActiveEra of a chain with a storage subscription (on its own connection,
+# a subscription blocks the websocket) and caches the session/era scoped values for the current index.
+class SessionIndexWatcher:
+
+    def __init__(self, url):
+        self.url = url
+        self.indexes = {}
+        # {(scope, index, module, function, params): value}
+        self.values = {}
+        self.scopes_by_key = {}
+        self.lock = threading.Lock()
+        self.subscribed = False
+        self._thread = threading.Thread(target=self._run, name=f'session-index-{url}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def get_index(self, substrate_client, scope):
+        if self.subscribed and scope in self.indexes:
+            return self.indexes[scope]
+        # Not subscribed (yet): a read of the index is still much cheaper than the scoped value itself
+        index = query_storage(substrate_client, *SCOPE_INDEXES[scope])
+        self.set_index(scope, index)
+        return index
+
+    def set_index(self, scope, index):
+        if isinstance(index, dict):
+            # Staking.ActiveEra: {'index': u32, 'start': Option<u64>}
+            index = index.get('index')
+        with self.lock:
+            if self.indexes.get(scope) == index:
+                return
+            log.debug('{} {} index: {}'.format(self.url, scope, index))
+            self.indexes[scope] = index
+            self.values = {key: value for key, value in self.values.items() if key[0] != scope}
+
+    def get(self, substrate_client, scope, module, function, params):
+        index = self.get_index(substrate_client, scope)
+        key = (scope, index, module, function, repr(params))
+        with self.lock:
+            if key in self.values:
+                return self.values[key]
+        value = query_storage(substrate_client, module, function, params)
+        with self.lock:
+            if self.indexes.get(scope) == index:
+                self.values[key] = value
+        return value
+
+    # params=None invalidates the values of all the keys of the storage function
+    def invalidate(self, module, function, params=None):
+        with self.lock:
+            self.values = {key: value for key, value in self.values.items()
+                           if key[2:4] != (module, function) or (params is not None and key[4] != repr(params))}
+
+    def subscription_handler(self, storage_key, obj, update_nr, subscription_id):
+        self.set_index(self.scopes_by_key[storage_key.to_hex()], obj.value)
+        self.subscribed = True
+
+    def _run(self):
+        while True:
+            substrate_client = None
+            try:
+                # Not taken from the pool: the connection is dedicated to the subscription
+                substrate_client = ws_pool.network_connection_pool.client_factory(url=self.url)
+                substrate_client.init_runtime()
+                storage_keys = []
+                self.scopes_by_key = {}
+                for scope, (module, function) in SCOPE_INDEXES.items():
+                    try:
+                        storage_key = StorageKey.create_from_storage_function(
+                            module, function, [], runtime_config=substrate_client.runtime_config,
+                            metadata=substrate_client.metadata)
+                    except Exception:
+                        # eg. no Staking pallet on PoA relay-chains
+                        continue
+                    storage_keys.append(storage_key)
+                    self.scopes_by_key[storage_key.to_hex()] = scope
+                substrate_client.subscribe_storage(storage_keys, self.subscription_handler)
+            except Exception as e:
+                log.warning('Session index subscription failed on {}, Error: {}'.format(self.url, e))
+            finally:
+                self.subscribed = False
+                if substrate_client:
+                    substrate_client.close()
+            time.sleep(RESUBSCRIBE_DELAY)
+
+
+def get_session_index_watcher(url):
+    with session_index_watchers_lock:
+        watcher = session_index_watchers.get(url)
+        if watcher is None:
+            watcher = session_index_watchers[url] = SessionIndexWatcher(url)
+            # Only the relay-chain index is subscribed to, for the other chains (eg. one url per collator) the
+            # index is read on each query
+            if url == get_relay_chain_rpc_url():
+                watcher.start()
+        return watcher
+
+
+# Query a storage value which only changes at session (scope='session') or era (scope='era') boundaries, the value
+# is read once per session/era. Returns None on error.
+def session_scoped_query(substrate_client, module, function, params=[], scope='session'):
+    try:
+        return get_session_index_watcher(substrate_client.url).get(substrate_client, scope, module, function, params)
+    except Exception as e:
+        log.error("Failed to query: {} {}.{}, Error: {}".format(getattr(substrate_client, 'url', 'NO_URL'),
+                                                                module, function, e))
+        return None
+
+
+# To call after changing a session scoped value within a session (eg. Session.NextKeys after set_keys)
+def invalidate_session_scoped_value(url, module, function, params=None):
+    with session_index_watchers_lock:
+        watcher = session_index_watchers.get(url)
+    if watcher:
+        watcher.invalidate(module, function, params)
@@ -1,6 +1,7 @@
 import logging
 import requests
 from substrateinterface import Keypair
+from app.lib.session_cache import session_scoped_query, invalidate_session_scoped_value
 from app.lib.substrate import get_substrate_client, substrate_call
 
 log = logging.getLogger('session_keys')
@@ -29,8 +30,9 @@ def decode_session_key(substrate_client, session_key):
 
 
 # stash keypair account must have some funds
-def set_node_session_key(ws_endpoint, stash_seed, session_key):
-    substrate_client = get_substrate_client(ws_endpoint)
+# substrate_client: to use instead of the pooled client of ws_endpoint (eg. see dedicated_substrate_client)
+def set_node_session_key(ws_endpoint, stash_seed, session_key, substrate_client=None):
+    substrate_client = substrate_client or get_substrate_client(ws_endpoint)
 
     if type(session_key) == str:
         session_key = decode_session_key(substrate_client, session_key)
@@ -46,19 +48,13 @@ def set_node_session_key(ws_endpoint, stash_seed, session_key):
     )
     result = substrate_call(substrate_client, keypair, call, wait=True)
     if result and result.is_success:
+        invalidate_session_scoped_value(substrate_client.url, 'Session', 'NextKeys')
         return True
     else:
         return False
 
 
+# Session.QueuedKeys is only updated on new sessions
 def get_queued_keys(substrate_client):
-    try:
-        queued_keys = substrate_client.query(
-            module='Session',
-            storage_function='QueuedKeys',
-            params=[]
-        )
-        return dict(queued_keys.value)
-    except Exception as err:
-        log.error(err)
-        return {}
+    queued_keys = session_scoped_query(substrate_client, 'Session', 'QueuedKeys')
+    return dict(queued_keys) if queued_keys else {}
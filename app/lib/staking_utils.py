@@ -1,40 +1,101 @@
 import logging
 
-from substrateinterface import Keypair
+from substrateinterface import KeypairType
 
 from app.config.network_configuration import derivation_root_seed
 from app.lib.balance_utils import transfer_funds
+from app.lib.derived_keys import get_derived_keypair, get_derived_address, prewarm_derived_keys
 from app.lib.kubernetes_client import get_pod
 from app.lib.network_utils import get_validator_account_from_pod
-from app.lib.substrate import get_chain_properties, substrate_batchall_call
+from app.lib.substrate import get_chain_properties, substrate_batchall_call, query_storage_multi
 
 log = logging.getLogger('staking_utils')
 
+# Nominator indexes of a validator checked at once by count_validator_nominators
+NOMINATOR_DISCOVERY_PAGE_SIZE = 8
+
 
 async def create_nominators_for_validator_node(substrate_client, funding_account_keypair, node_name, nominator_count, nominate_amount):
     log.info(f"Create {nominator_count} nominators for validator '{node_name}' with '{nominate_amount}' bounded funds for each")
     pod = get_pod(node_name)
     validator_account = get_validator_account_from_pod(pod)
     nominator_indexes = [*range(0, nominator_count)]
-    nominator_seeds = list(map(lambda index: get_validator_nominator_mnemonic(node_name, index), nominator_indexes))
-    nominator_accounts = list(map(lambda seed: Keypair.create_from_uri(seed).ss58_address, nominator_seeds))
+    root_seed = derivation_root_seed()
+    nominator_paths = list(map(lambda index: f'//{node_name}//{index}', nominator_indexes))
+    prewarm_derived_keys(root_seed, map(lambda path: (path, 42, KeypairType.SR25519), nominator_paths))
+    nominator_accounts = list(map(lambda path: get_derived_address(root_seed, path), nominator_paths))
+
+    # Only set up the nomination of the accounts which are not already nominators
+    nominators = get_nominators(substrate_client, nominator_accounts)
+    nominator_paths_to_setup = [path for path, account in zip(nominator_paths, nominator_accounts)
+                                if account not in nominators]
+    nominator_accounts_to_setup = [account for account in nominator_accounts if account not in nominators]
+    if not nominator_accounts_to_setup:
+        log.info(f"All the {nominator_count} nominators of '{node_name}' are already nominating")
+        return
 
     # Fund nominator accounts and execute bound + nominate
-    transfer_funds(substrate_client, funding_account_keypair, nominator_accounts, nominate_amount + 1)
-    for nominator_seed in nominator_seeds:
-        nominator_keypair = Keypair.create_from_uri(nominator_seed)
-        # If account is not already a nominator set up the nomination
-        if not check_is_nominator(substrate_client, nominator_keypair):
-            staking_create_nominator(substrate_client, nominator_keypair, [validator_account], nominate_amount)
+    transfer_funds(substrate_client, funding_account_keypair, nominator_accounts_to_setup, nominate_amount + 1)
+    for nominator_path in nominator_paths_to_setup:
+        nominator_keypair = get_derived_keypair(root_seed, nominator_path)
+        staking_create_nominator(substrate_client, nominator_keypair, [validator_account], nominate_amount)
 
 
 def get_validator_nominator_mnemonic(validator_name, nominator_index):
     return f'{derivation_root_seed()}//{validator_name}//{nominator_index}'
 
 
+def get_validator_nominator_address(validator_name, nominator_index):
+    return get_derived_address(derivation_root_seed(), f'//{validator_name}//{nominator_index}')
+
+
+# Number of nominators created for each validator (see create_nominators_for_validator_node): {validator_name: count}.
+# The nominators of a validator have consecutive indexes, the first account which doesn't exist on-chain ends the list.
+# known_counts: counts from a previous call, only the following indexes are checked.
+def count_validator_nominators(substrate_client, validator_names, known_counts=None):
+    root_seed = derivation_root_seed()
+    known_counts = known_counts or {}
+    counts = {name: known_counts.get(name, 0) for name in validator_names}
+    validators_to_check = list(validator_names)
+    while validators_to_check:
+        indexes = [(name, counts[name] + offset) for name in validators_to_check
+                   for offset in range(NOMINATOR_DISCOVERY_PAGE_SIZE)]
+        paths = list(map(lambda index: f'//{index[0]}//{index[1]}', indexes))
+        prewarm_derived_keys(root_seed, map(lambda path: (path, 42, KeypairType.SR25519), paths))
+        try:
+            accounts = query_storage_multi(substrate_client, 'System', 'Account',
+                                           list(map(lambda path: [get_derived_address(root_seed, path)], paths)))
+        except Exception as e:
+            log.error("Failed to query: {} System.Account, Error: {}".format(getattr(substrate_client, 'url', 'NO_URL'), e))
+            return counts
+        accounts_by_index = dict(zip(indexes, accounts))
+        next_validators_to_check = []
+        for name in validators_to_check:
+            for offset in range(NOMINATOR_DISCOVERY_PAGE_SIZE):
+                account = accounts_by_index[(name, counts[name])]
+                if not account or (account['providers'] == 0 and account['nonce'] == 0):
+                    break
+                counts[name] += 1
+            else:
+                next_validators_to_check.append(name)
+        validators_to_check = next_validators_to_check
+    return counts
+
+
 def check_is_nominator(substrate_client, nominator_keypair):
-    nominators_for_account = substrate_client.query('Staking', 'Nominators', params=[nominator_keypair.ss58_address])
-    return nominators_for_account and nominators_for_account.value and nominators_for_account.value["targets"] and len(nominators_for_account.value["targets"]) >= 1
+    return nominator_keypair.ss58_address in get_nominators(substrate_client, [nominator_keypair.ss58_address])
+
+
+# Addresses (of the given ones) nominating at least one validator, read with a single request
+def get_nominators(substrate_client, addresses):
+    try:
+        nominations = query_storage_multi(substrate_client, 'Staking', 'Nominators',
+                                          list(map(lambda address: [address], addresses)))
+    except Exception as e:
+        log.error("Failed to query: {} Staking.Nominators, Error: {}".format(getattr(substrate_client, 'url', 'NO_URL'), e))
+        return set()
+    return set(address for address, nomination in zip(addresses, nominations)
+               if nomination and nomination.get('targets'))
 
 
 def staking_create_nominator(substrate_client, nominator_keypair, target_validator_addresses, bound_amount=1):
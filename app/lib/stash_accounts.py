@@ -1,30 +1,39 @@
 import logging
 
-from substrateinterface import Keypair
-
-from app.lib.substrate import substrate_query_url
+from app.lib.derived_keys import get_derived_keypair, get_derived_address
+from app.lib.substrate import get_substrate_client, query_storage_multi
 
 log = logging.getLogger('stash_accounts')
 
 
+def get_node_stash_derivation_path(node_name):
+    return f'//{node_name}//stash'
+
+
 def get_node_stash_account_mnemonic(root_seed, node_name):
-    return f'{root_seed}//{node_name}//stash'
+    return root_seed + get_node_stash_derivation_path(node_name)
 
 
 def get_node_stash_keypair(root_seed, node_name):
-    node_stash_account_mnemonic = get_node_stash_account_mnemonic(root_seed, node_name)
-    return Keypair.create_from_uri(node_stash_account_mnemonic)
+    return get_derived_keypair(root_seed, get_node_stash_derivation_path(node_name))
 
 
 def get_derived_node_stash_account_address(root_seed, node_name):
-    node_stash_keypair = get_node_stash_keypair(root_seed, node_name)
-    return node_stash_keypair.ss58_address
+    return get_derived_address(root_seed, get_node_stash_derivation_path(node_name))
 
 
 def get_account_funds(ws_endpoint, account_address):
-    funds_data = substrate_query_url(ws_endpoint, 'System', 'Account', [account_address])['data']
+    return get_accounts_funds(ws_endpoint, [account_address]).get(account_address)
+
+
+# Free balance of each account read with a single request: {account_address: funds (None if unknown)}
+def get_accounts_funds(ws_endpoint, account_addresses):
+    try:
+        accounts = query_storage_multi(get_substrate_client(ws_endpoint), 'System', 'Account',
+                                       list(map(lambda address: [address], account_addresses)))
+    except Exception as e:
+        log.error("Failed to query: {} System.Account, Error: {}".format(ws_endpoint, e))
+        return {}
     # if account is not created the data is empty.
-    if 'free' in funds_data:
-        return funds_data['free']
-    else:
-        return None
+    return {address: account['data'].get('free') if account else None
+            for address, account in zip(account_addresses, accounts)}
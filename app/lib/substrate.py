@@ -1,40 +1,86 @@
+import asyncio
+import copy
 import hashlib
 import logging
-from substrateinterface import SubstrateInterface, Keypair
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from substrateinterface import Keypair, KeypairType
+from substrateinterface.storage import StorageKey
 from substrateinterface.utils.hasher import blake2_256
 
-from app.config.network_configuration import get_relay_chain_rpc_url, node_ws_endpoint, network_sudo_seed
+from app.config.network_configuration import get_relay_chain_rpc_url, node_ws_endpoint, network_sudo_seed, \
+    storage_cache_size
 from app.config import ws_pool
+from app.lib.nonce_manager import get_nonce_manager
+from app.lib.substrate_async import get_pipeline_loop, async_submit_pipelined_extrinsic
 
 log = logging.getLogger(__name__)
 
+# Seconds during which the same best block hash is returned by get_pinned_block_hash
+PINNED_BLOCK_MAX_AGE = 2
+# Maximum number of call weights kept by get_query_info
+QUERY_INFO_CACHE_SIZE = 1024
+# Storage keys read by each state_queryStorageAt request of query_storage_multi
+QUERY_MULTI_PAGE_SIZE = 1000
+# Seconds during which the sudo key and its proxies are reused by substrate_check_sudo_key_and_call
+SUDO_KEYS_CACHE_TTL = 60
+# Calls changing the sudo key or its proxies, they invalidate the cached sudo keys of the chain once included
+SUDO_KEYS_CHANGING_CALLS = {
+    'Sudo': ['set_key', 'remove_key'],
+    'Proxy': ['add_proxy', 'remove_proxy', 'remove_proxies', 'create_pure', 'kill_pure'],
+}
+# Errors of a sudo call made with outdated sudo keys
+SUDO_KEYS_ERRORS = ['RequireSudo', 'NotProxy', 'BadOrigin']
+
+# Storage read at a given block hash never changes: {(block_hash, module, function, params): value}
+storage_cache = OrderedDict()
+storage_cache_lock = threading.Lock()
+# {url: (block_hash, time)}
+pinned_block_hashes = {}
+# {url: (sudo_keys, time)}
+sudo_keys_cache = {}
+# Weight and fee of a call only depend on the runtime: {(genesis_hash, spec_version, call_hash): query_info}
+query_info_cache = OrderedDict()
+query_info_cache_lock = threading.Lock()
+# {url: genesis_hash} of the clients without metadata cache
+genesis_hashes = {}
+# Keypairs signing the extrinsics of get_query_info (never submitted): {crypto_type: Keypair}
+dry_run_keypairs = {}
+# Chain properties and pallet constants: {(genesis_hash, spec_version, key): value}
+runtime_cache = {}
+runtime_cache_lock = threading.Lock()
+
 
 def get_substrate_client(url):
     log.debug('get_substrate_client: url: {}, network_connection_pool: {}'.format(url,
                                                                                   ws_pool.network_connection_pool))
-    if url in ws_pool.network_connection_pool:
-        # if it is a websocket connection check it before sending.
-        if ws_pool.network_connection_pool[url].websocket:
-            try:
-                ws_pool.network_connection_pool[url].websocket.ping()
-            except Exception as e:
-                log.info("Fixing broken WebSocket connection {}, Msg: {}".format(url, e))
-                try:
-                    ws_pool.network_connection_pool[url].connect_websocket()
-                    return ws_pool.network_connection_pool[url]
-                except Exception as e:
-                    log.error("Failed to connect to websocket, url: {}, Error: {}".format(url, e))
-                    # remove connection from pool
-                    ws_pool.network_connection_pool.pop(url)
-                    return None
-        return ws_pool.network_connection_pool[url]
-    else:
-        try:
-            ws_pool.network_connection_pool[url] = SubstrateInterface(url=url)
-            return ws_pool.network_connection_pool[url]
-        except Exception as e:
-            log.error("Unable to connect to substrate. url: {}, Error: {}".format(url, e))
-            return None
+    try:
+        return ws_pool.network_connection_pool.get(url)
+    except Exception as e:
+        log.error("Unable to connect to substrate. url: {}, Error: {}".format(url, e))
+        return None
+
+
+# Client checked out of the pool for the exclusive use of the caller (None if the node can't be reached): the pooled
+# client of a url serialises the extrinsic inclusion subscriptions, threads which wait for inclusions concurrently
+# need their own connection. The client is checked in (or closed if enough are idle) on exit.
+@contextmanager
+def dedicated_substrate_client(url):
+    pool = ws_pool.network_connection_pool
+    try:
+        client = pool.checkout(url)
+    except Exception as e:
+        log.error("Unable to connect to substrate. url: {}, Error: {}".format(url, e))
+        yield None
+        return
+    try:
+        yield client
+    finally:
+        pool.checkin(url, client)
 
 
 def get_relay_chain_client():
@@ -42,9 +88,40 @@ def get_relay_chain_client():
     return get_substrate_client(url)
 
 
+# Values cached for the runtime loaded by the client: the runtime is reloaded by any query or compose_call of the
+# client, after a runtime upgrade the values are read again
+def runtime_cache_get(substrate_client, key, read_value):
+    if substrate_client.runtime_version is None:
+        substrate_client.init_runtime()
+    genesis_hash = get_genesis_hash(substrate_client)
+    cache_key = (genesis_hash, substrate_client.runtime_version, key)
+    with runtime_cache_lock:
+        if cache_key in runtime_cache:
+            return runtime_cache[cache_key]
+    value = read_value()
+    if value is not None:
+        with runtime_cache_lock:
+            # drop the values of the previous runtimes of the chain
+            for outdated_key in [k for k in runtime_cache if k[0] == genesis_hash and k[1] != cache_key[1]]:
+                del runtime_cache[outdated_key]
+            runtime_cache[cache_key] = value
+    return value
+
+
 # Returns {'ss58Format': int, 'tokenDecimals': int, 'tokenSymbol': str}
 def get_chain_properties(substrate_client):
-    return substrate_rpc_request(substrate_client, 'system_properties')
+    try:
+        return runtime_cache_get(substrate_client, 'properties',
+                                 lambda: substrate_rpc_request(substrate_client, 'system_properties'))
+    except Exception as err:
+        log.error(f'Failed to get the chain properties of {getattr(substrate_client, "url", "NO_URL")}; Error: {err}')
+        return substrate_rpc_request(substrate_client, 'system_properties')
+
+
+# Value of a pallet constant, cached per runtime. Raises on error.
+def get_constant(substrate_client, module, name):
+    return runtime_cache_get(substrate_client, ('constant', module, name),
+                             lambda: substrate_client.get_constant(module, name).value)
 
 
 def get_node_client(node_name):
@@ -55,14 +132,47 @@ def get_query_weight(substrate_client, call):
     return get_query_info(substrate_client, call)['weight']
 
 
+def get_genesis_hash(substrate_client):
+    # Pooled clients already know it, see metadata_cache.py
+    cache_region = getattr(substrate_client, 'cache_region', None)
+    if hasattr(cache_region, 'genesis_hash'):
+        return cache_region.genesis_hash
+    url = getattr(substrate_client, 'url', None)
+    if url not in genesis_hashes:
+        genesis_hashes[url] = substrate_client.rpc_request('chain_getBlockHash', [0])['result']
+    return genesis_hashes[url]
+
+
+def get_dry_run_keypair(crypto_type=KeypairType.SR25519):
+    if crypto_type not in dry_run_keypairs:
+        dry_run_keypairs[crypto_type] = Keypair.create_from_mnemonic(Keypair.generate_mnemonic(),
+                                                                     crypto_type=crypto_type)
+    return dry_run_keypairs[crypto_type]
+
+
 # Returns: {'weight': {'ref_time': 178260000, 'proof_size': 3593}, 'class': 'Normal', 'partialFee': 469298416}
-def get_query_info(substrate_client, call):
+# The result is cached per runtime (genesis hash, spec version) and encoded call.
+def get_query_info(substrate_client, call, crypto_type=KeypairType.SR25519):
     try:
-        keypair = Keypair.create_from_mnemonic(Keypair.generate_mnemonic())
-        extrinsic = substrate_client.create_signed_extrinsic(call=call, keypair=keypair)
+        # the call was composed with the runtime currently loaded by the client
+        cache_key = (get_genesis_hash(substrate_client), substrate_client.runtime_version,
+                     blake2_256(call.data.data).hex())
+        with query_info_cache_lock:
+            if cache_key in query_info_cache:
+                query_info_cache.move_to_end(cache_key)
+                return query_info_cache[cache_key]
+        # nonce=0: the dry-run account doesn't exist and the extrinsic is never submitted
+        extrinsic = substrate_client.create_signed_extrinsic(call=call, keypair=get_dry_run_keypair(crypto_type),
+                                                             nonce=0)
         extrinsic_len = substrate_client.create_scale_object('u32')
         extrinsic_len.encode(len(extrinsic.data))
-        return substrate_client.runtime_call("TransactionPaymentApi", "query_info", [extrinsic, extrinsic_len]).value
+        query_info = substrate_client.runtime_call("TransactionPaymentApi", "query_info",
+                                                   [extrinsic, extrinsic_len]).value
+        with query_info_cache_lock:
+            query_info_cache[cache_key] = query_info
+            while len(query_info_cache) > QUERY_INFO_CACHE_SIZE:
+                query_info_cache.popitem(last=False)
+        return query_info
     except Exception as err:
         log.error(f'Failed to get query_info on {getattr(substrate_client, "url", "NO_URL")}; Error: {err}')
         # TransactionPaymentApi may not be in all parachains, return value which will work in most cases.
@@ -77,27 +187,142 @@ def substrate_rpc_request(substrate_client, method, params=[]):
         return None
 
 
-def substrate_call(substrate_client, keypair, call, wait=True):
-    if keypair:
-        extrinsic = substrate_client.create_signed_extrinsic(
-            call=call,
-            keypair=keypair,
-        )
+# Batched form of substrate_rpc_request: all the requests are sent as one JSON-RPC batch (single frame).
+# requests: {key: method} or {key: (method, params)}, returns {key: result} (None for the failed requests)
+def substrate_rpc_batch_request(substrate_client, requests):
+    keys = list(requests.keys())
+    batch = []
+    for key in keys:
+        request = requests[key]
+        if isinstance(request, str):
+            batch.append({'method': request, 'params': []})
+        else:
+            batch.append({'method': request[0], 'params': request[1]})
+    results = dict.fromkeys(keys)
+    try:
+        if hasattr(substrate_client, 'rpc_batch_request'):
+            responses = substrate_client.rpc_batch_request(batch)
+        else:
+            responses = list(map(lambda request: substrate_client.rpc_request(request['method'], request['params']),
+                                 batch))
+    except Exception as err:
+        log.error(f'Failed to send rpc batch {list(map(lambda request: request["method"], batch))} on '
+                  f'{getattr(substrate_client, "url", "NO_URL")}; Error: {err}')
+        return results
+    for key, request, response in zip(keys, batch, responses):
+        if 'result' in response:
+            results[key] = response['result']
+        else:
+            log.error(f'Failed to call {request["method"]} on {getattr(substrate_client, "url", "NO_URL")}; '
+                      f'Error: {response.get("error")}')
+    return results
+
+
+# pipelined: sign with the next nonce of the signer tracked locally (see nonce_manager.py) and return right after the
+# submission, without waiting for the previous extrinsics of the signer. Returns a concurrent.futures.Future of the
+# receipt (False on error), the inclusions are watched concurrently with author_submitAndWatchExtrinsic.
+def substrate_call(substrate_client, keypair, call, wait=True, pipelined=False):
+    if pipelined:
+        if keypair:
+            result = substrate_pipelined_call(substrate_client, keypair, call, wait)
+        else:
+            result = completed_future(substrate_call(substrate_client, keypair, call, wait))
     else:
-        extrinsic = substrate_client.create_unsigned_extrinsic(
-            call=call
-        )
+        nonce_manager = nonce = None
+        if keypair:
+            # the nonce comes from the nonce manager too so that a pipelined extrinsic of the signer still in the
+            # transaction pool doesn't get its nonce reused
+            nonce_manager = get_nonce_manager(substrate_client.url, keypair.ss58_address)
+            try:
+                nonce = nonce_manager.next_nonce(substrate_client)
+                extrinsic = substrate_client.create_signed_extrinsic(
+                    call=call,
+                    keypair=keypair,
+                    nonce=nonce
+                )
+            except Exception as e:
+                log.error("Failed to sign call: {}, Error: {}".format(call, e))
+                if nonce is not None:
+                    nonce_manager.release(nonce)
+                return False
+        else:
+            extrinsic = substrate_client.create_unsigned_extrinsic(
+                call=call
+            )
 
+        try:
+            result = substrate_client.submit_extrinsic(extrinsic, wait_for_inclusion=wait)
+            log.info("Extrinsic '{}' sent".format(result.extrinsic_hash))
+        except Exception as e:
+            log.error("Failed to send call: {}, Error: {}".format(call, e))
+            if nonce_manager:
+                nonce_manager.release(nonce)
+            return False
+
+    if is_sudo_keys_changing_call(call.value):
+        url = getattr(substrate_client, 'url', None)
+        if pipelined:
+            return map_future(result, lambda receipt: invalidate_sudo_keys(url) or receipt)
+        invalidate_sudo_keys(url)
+    return result
+
+
+# Returns whether the call (or one of the calls it wraps, eg. sudo(proxy.add_proxy)) changes the sudo keys
+def is_sudo_keys_changing_call(call_value):
+    if isinstance(call_value, dict):
+        if call_value.get('call_function') in SUDO_KEYS_CHANGING_CALLS.get(call_value.get('call_module'), []):
+            return True
+        return any(map(is_sudo_keys_changing_call, call_value.values()))
+    if isinstance(call_value, (list, tuple)):
+        return any(map(is_sudo_keys_changing_call, call_value))
+    # GenericCall given as a call parameter (eg. Utility.batch calls)
+    if hasattr(call_value, 'value_serialized'):
+        return is_sudo_keys_changing_call(call_value.value)
+    return False
+
+
+def substrate_pipelined_call(substrate_client, keypair, call, wait=True):
+    nonce_manager = get_nonce_manager(substrate_client.url, keypair.ss58_address)
     try:
-        receipt = substrate_client.submit_extrinsic(extrinsic, wait_for_inclusion=wait)
-        log.info("Extrinsic '{}' sent".format(receipt.extrinsic_hash))
-        return receipt
+        nonce = nonce_manager.next_nonce(substrate_client)
     except Exception as e:
-        log.error("Failed to send call: {}, Error: {}".format(call, e))
-        return False
+        log.error("Failed to get the nonce of {}, Error: {}".format(keypair.ss58_address, e))
+        return completed_future(False)
+    try:
+        extrinsic = substrate_client.create_signed_extrinsic(call=call, keypair=keypair, nonce=nonce)
+    except Exception as e:
+        log.error("Failed to sign call: {}, Error: {}".format(call, e))
+        nonce_manager.release(nonce)
+        return completed_future(False)
+    return asyncio.run_coroutine_threadsafe(
+        async_submit_pipelined_extrinsic(substrate_client, extrinsic, nonce_manager, nonce, wait), get_pipeline_loop())
+
+
+def completed_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+# Future of function(result of future), function must not block (eg. only read the events of a pipelined receipt)
+def map_future(future, function):
+    mapped_future = Future()
+
+    def set_mapped_result(done_future):
+        try:
+            mapped_future.set_result(function(done_future.result()))
+        except Exception as e:
+            mapped_future.set_exception(e)
+    future.add_done_callback(set_mapped_result)
+    return mapped_future
+
+
+# Wait for the results of pipelined calls
+def wait_for_futures(futures):
+    return list(map(lambda future: future.result(), futures))
 
 
-def substrate_proxy_call(substrate_client, keypair, run_as, payload, wait=True):
+def substrate_proxy_call(substrate_client, keypair, run_as, payload, wait=True, pipelined=False):
     call = substrate_client.compose_call(
         call_module='Proxy',
         call_function='proxy',
@@ -107,7 +332,7 @@ def substrate_proxy_call(substrate_client, keypair, run_as, payload, wait=True):
             'force_proxy_type': None
         }
     )
-    return substrate_call(substrate_client, keypair, call, wait)
+    return substrate_call(substrate_client, keypair, call, wait, pipelined)
 
 
 def get_sudo_keys(substrate_client):
@@ -123,18 +348,56 @@ def get_sudo_keys(substrate_client):
     return {'sudo': sudo, 'proxies': proxies}
 
 
-def substrate_check_sudo_key_and_call(substrate_client, keypair, payload, wait=True):
+# Same as get_sudo_keys, read once per SUDO_KEYS_CACHE_TTL seconds unless invalidated (see invalidate_sudo_keys)
+def get_cached_sudo_keys(substrate_client):
+    url = getattr(substrate_client, 'url', None)
+    cached_sudo_keys = sudo_keys_cache.get(url)
+    if cached_sudo_keys and time.monotonic() - cached_sudo_keys[1] < SUDO_KEYS_CACHE_TTL:
+        return cached_sudo_keys[0]
     sudo_keys = get_sudo_keys(substrate_client)
+    sudo_keys_cache[url] = (sudo_keys, time.monotonic())
+    return sudo_keys
+
+
+# Called when the sudo keys of the chain may have changed: sudo.set_key/proxy calls sent by the testnet-manager,
+# sudo calls failing with an origin error (eg. changed from elsewhere)
+def invalidate_sudo_keys(url):
+    sudo_keys_cache.pop(url, None)
+
+
+def check_sudo_keys_error(substrate_client, receipt):
+    try:
+        if receipt and not receipt.is_success and (receipt.error_message or {}).get('name') in SUDO_KEYS_ERRORS:
+            log.warning(f"Sudo call failed with {receipt.error_message.get('name')} on "
+                        f"{getattr(substrate_client, 'url', 'NO_URL')}, reloading the sudo keys")
+            invalidate_sudo_keys(getattr(substrate_client, 'url', None))
+    except Exception as e:
+        log.debug(f'Failed to check the result of the sudo call, Error: {e}')
+    return receipt
+
+
+def substrate_check_sudo_key_and_call(substrate_client, keypair, payload, wait=True, pipelined=False):
     provided_key = keypair.ss58_address
+    sudo_keys = get_cached_sudo_keys(substrate_client)
+    if provided_key != sudo_keys['sudo'] and provided_key not in sudo_keys['proxies']:
+        # The cached keys may be outdated
+        invalidate_sudo_keys(getattr(substrate_client, 'url', None))
+        sudo_keys = get_cached_sudo_keys(substrate_client)
     if provided_key == sudo_keys['sudo']:
-        return substrate_call(substrate_client, keypair, payload, wait)
+        result = substrate_call(substrate_client, keypair, payload, wait, pipelined)
     elif provided_key in sudo_keys['proxies']:
-        return substrate_proxy_call(substrate_client, keypair, sudo_keys['sudo'], payload, wait)
+        result = substrate_proxy_call(substrate_client, keypair, sudo_keys['sudo'], payload, wait, pipelined)
     else:
         log.error(f"Failed to execute sudo call: {getattr(substrate_client, 'url', 'NO_URL')} {payload.value['call_module']}.{payload.value['call_function']}, Error: Provided wrong sudo key {provided_key}, expected {sudo_keys}")
-        return None
-
-def substrate_sudo_call(substrate_client, keypair, payload, wait=True):
+        return completed_future(None) if pipelined else None
+    if not wait:
+        return result
+    if pipelined:
+        return map_future(result, lambda receipt: check_sudo_keys_error(substrate_client, receipt))
+    return check_sudo_keys_error(substrate_client, result)
+
+# pipelined: see substrate_call
+def substrate_sudo_call(substrate_client, keypair, payload, wait=True, pipelined=False):
     call = substrate_client.compose_call(
         call_module='Sudo',
         call_function='sudo',
@@ -142,7 +405,7 @@ def substrate_sudo_call(substrate_client, keypair, payload, wait=True):
             'call': payload.value,
         }
     )
-    return substrate_check_sudo_key_and_call(substrate_client, keypair, call, wait)
+    return substrate_check_sudo_key_and_call(substrate_client, keypair, call, wait, pipelined)
 
 
 def substrate_sudo_unchecked_weight_call(substrate_client, keypair, payload, wait=True):
@@ -160,7 +423,159 @@ def substrate_sudo_unchecked_weight_call(substrate_client, keypair, payload, wai
     return substrate_check_sudo_key_and_call(substrate_client, keypair, call, wait)
 
 
-def substrate_batchall_call(substrate_client, keypair, batch_call, wait=True, sudo=False):
+# Share of the block limits (weight and length of the normal dispatch class) filled by a chunk of a batch
+BATCH_CHUNK_BLOCK_SHARE = 0.5
+
+
+# Aggregated receipt of a batch submitted in several chunks: receipts[i] is the receipt (False on error) of the calls
+# of the batch at indexes chunks[i]
+class BatchReceipt:
+
+    def __init__(self, chunks, receipts):
+        self.chunks = chunks
+        self.receipts = receipts
+
+    def __repr__(self):
+        return 'BatchReceipt(chunks={}, extrinsic_hash={})'.format(len(self.chunks), self.extrinsic_hash)
+
+    @property
+    def is_success(self):
+        return all(receipt and receipt.is_success for receipt in self.receipts)
+
+    @property
+    def error_message(self):
+        for receipt in self.receipts:
+            if not receipt:
+                return 'Failed to send call'
+            if not receipt.is_success:
+                return receipt.error_message
+        return None
+
+    @property
+    def extrinsic_hash(self):
+        return list(map(lambda receipt: getattr(receipt, 'extrinsic_hash', None), self.receipts))
+
+    @property
+    def block_hash(self):
+        return list(map(lambda receipt: getattr(receipt, 'block_hash', None), self.receipts))
+
+    @property
+    def triggered_events(self):
+        return [event for receipt in self.receipts if receipt for event in receipt.triggered_events]
+
+    # Index of the chunk in which the call at `index` of the batch was submitted
+    def chunk_of(self, index):
+        return next(chunk_index for chunk_index, chunk in enumerate(self.chunks) if index in chunk)
+
+    # Indexes of the calls of the batch which were in a failed chunk
+    def failed_indexes(self):
+        return [index for chunk, receipt in zip(self.chunks, self.receipts) if not (receipt and receipt.is_success)
+                for index in chunk]
+
+
+# Returns {'ref_time', 'proof_size', 'length'}: budget of a batch chunk, None if the limits can't be read
+def get_batch_chunk_limits(substrate_client):
+    try:
+        block_weights = get_constant(substrate_client, 'System', 'BlockWeights')
+        block_length = get_constant(substrate_client, 'System', 'BlockLength')
+        normal_class = block_weights['per_class']['normal']
+        max_weight = normal_class.get('max_extrinsic') or normal_class.get('max_total') or block_weights['max_block']
+        max_weight = weight_as_dict(max_weight)
+        return {'ref_time': int(max_weight['ref_time'] * BATCH_CHUNK_BLOCK_SHARE),
+                'proof_size': int(max_weight['proof_size'] * BATCH_CHUNK_BLOCK_SHARE),
+                'length': int(block_length['max']['normal'] * BATCH_CHUNK_BLOCK_SHARE)}
+    except Exception as e:
+        log.error(f'Failed to read the block limits on {getattr(substrate_client, "url", "NO_URL")}; Error: {e}')
+        return None
+
+
+# Weight V1 (u64) is only a ref_time
+def weight_as_dict(weight):
+    if isinstance(weight, dict):
+        return weight
+    return {'ref_time': weight, 'proof_size': 0}
+
+
+# Split the calls in chunks of consecutive calls fitting the limits (see get_batch_chunk_limits): [[index, ...], ...].
+# call_weights and call_lengths are the weight and encoded length of each call, a call over the limits is alone in
+# its chunk.
+def split_batch_call(call_weights, call_lengths, limits):
+    chunks = []
+    chunk = []
+    chunk_usage = {'ref_time': 0, 'proof_size': 0, 'length': 0}
+    for index, (weight, length) in enumerate(zip(call_weights, call_lengths)):
+        call_usage = {'ref_time': weight['ref_time'], 'proof_size': weight['proof_size'], 'length': length}
+        if chunk and any(chunk_usage[key] + call_usage[key] > limits[key] for key in chunk_usage):
+            chunks.append(chunk)
+            chunk = []
+            chunk_usage = {'ref_time': 0, 'proof_size': 0, 'length': 0}
+        chunk.append(index)
+        for key in chunk_usage:
+            chunk_usage[key] += call_usage[key]
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+# The weight is estimated once per call function (with TransactionPaymentApi.query_info), the length is exact
+def get_batch_chunks(substrate_client, batch_call):
+    limits = get_batch_chunk_limits(substrate_client)
+    if not limits:
+        return [list(range(len(batch_call)))]
+    function_weights = {}
+    call_weights = []
+    for call in batch_call:
+        function = (call.value['call_module'], call.value['call_function'])
+        if function not in function_weights:
+            function_weights[function] = weight_as_dict(get_query_weight(substrate_client, call))
+        call_weights.append(function_weights[function])
+    call_lengths = list(map(lambda call: len(call.data), batch_call))
+    return split_batch_call(call_weights, call_lengths, limits)
+
+
+# Future of function([results of futures]) once all the futures are done
+def combine_futures(futures, function):
+    combined_future = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        try:
+            combined_future.set_result(function(list(map(lambda future: future.result(), futures))))
+        except Exception as e:
+            combined_future.set_exception(e)
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined_future
+
+
+# Batches over the block limits are split in chunks (see get_batch_chunks), the result is then a BatchReceipt. Whatever
+# the number of calls, a few heavy calls (eg. runtime upgrades) can exceed the limits: the weights are estimated once
+# per call function and runtime. Pipelined calls submit the chunks back to back (see substrate_pipelined_call), the
+# others one after the other so that a chunk rejected at submission doesn't leave the next ones nonce-gapped.
+def substrate_batchall_call(substrate_client, keypair, batch_call, wait=True, sudo=False, pipelined=False):
+    if keypair and len(batch_call) > 1:
+        chunks = get_batch_chunks(substrate_client, batch_call)
+    else:
+        chunks = [list(range(len(batch_call)))]
+    if len(chunks) == 1:
+        return substrate_batch_chunk_call(substrate_client, keypair, batch_call, wait, sudo, pipelined)
+
+    log.info(f'Splitting a batch of {len(batch_call)} calls in {len(chunks)} chunks')
+    chunk_calls = list(map(lambda chunk: [batch_call[index] for index in chunk], chunks))
+    if not pipelined:
+        return BatchReceipt(chunks, list(map(lambda calls: substrate_batch_chunk_call(substrate_client, keypair, calls,
+                                                                                      wait, sudo), chunk_calls)))
+    futures = list(map(lambda calls: substrate_batch_chunk_call(substrate_client, keypair, calls, wait, sudo,
+                                                                pipelined=True), chunk_calls))
+    return combine_futures(futures, lambda receipts: BatchReceipt(chunks, receipts))
+
+
+def substrate_batch_chunk_call(substrate_client, keypair, batch_call, wait=True, sudo=False, pipelined=False):
     # If the batch contains only 1 element, don't use batch
     if len(batch_call) == 1:
         call = batch_call[0]
@@ -174,9 +589,9 @@ def substrate_batchall_call(substrate_client, keypair, batch_call, wait=True, su
         )
 
     if sudo:
-        return substrate_sudo_call(substrate_client, keypair, call, wait)
+        return substrate_sudo_call(substrate_client, keypair, call, wait, pipelined)
     else:
-        return substrate_call(substrate_client, keypair, call, wait)
+        return substrate_call(substrate_client, keypair, call, wait, pipelined)
 
 
 def substrate_wrap_with_weight(substrate_client, payload):
@@ -207,18 +622,109 @@ def substrate_wrap_with_scheduler(substrate_client, payload, schedule_name, sche
     )
 
 
-def substrate_query(substrate_client, module, function, params=[]):
-    try:
+# Best block hash, shared by the reads of a same page so they are consistent (and cached, see query_storage)
+def get_pinned_block_hash(substrate_client):
+    url = getattr(substrate_client, 'url', None)
+    pinned_block = pinned_block_hashes.get(url)
+    if pinned_block and time.monotonic() - pinned_block[1] < PINNED_BLOCK_MAX_AGE:
+        return pinned_block[0]
+    block_hash = substrate_client.get_chain_head()
+    pinned_block_hashes[url] = (block_hash, time.monotonic())
+    return block_hash
+
+
+# The decoded values are mutable (dicts and lists): the cache keeps its own copy and hands out copies so that a
+# caller modifying a value doesn't change what the next readers get
+def storage_cache_get(key):
+    with storage_cache_lock:
+        if key not in storage_cache:
+            return False, None
+        storage_cache.move_to_end(key)
+        value = storage_cache[key]
+    return True, copy.deepcopy(value)
+
+
+def storage_cache_set(key, value):
+    value = copy.deepcopy(value)
+    with storage_cache_lock:
+        storage_cache[key] = value
+        storage_cache.move_to_end(key)
+        while len(storage_cache) > storage_cache_size():
+            storage_cache.popitem(last=False)
+
+
+# Query a storage value, at the best block when `at` (block hash) is None; values read at a block hash are cached.
+# Raises on error, see substrate_query.
+def query_storage(substrate_client, module, function, params=[], at=None):
+    if at is None:
         return substrate_client.query(module, function, params=params).value
+    key = (at, module, function, repr(params))
+    found, value = storage_cache_get(key)
+    if not found:
+        value = substrate_client.query(module, function, params=params, block_hash=at).value
+        storage_cache_set(key, value)
+    return value
+
+
+# Same as query_storage for a storage map, returns the list of (key, value)
+def query_storage_map(substrate_client, module, function, params=[], at=None):
+    key = (at, module, function, repr(params), 'map')
+    if at is not None:
+        found, value = storage_cache_get(key)
+        if found:
+            return value
+    result = substrate_client.query_map(module, function, params=params, page_size=1000, block_hash=at)
+    value = list(map(lambda item: (getattr(item[0], 'value', None), getattr(item[1], 'value', None)), result))
+    if at is not None:
+        storage_cache_set(key, value)
+    return value
+
+
+# Query the values of a storage function for each params of params_list (eg. [[address], ...]) with one
+# state_queryStorageAt request per QUERY_MULTI_PAGE_SIZE keys, returns the values in the order of params_list.
+# Values read at a block hash are cached (see query_storage). Raises on error.
+def query_storage_multi(substrate_client, module, function, params_list, at=None):
+    values = {}
+    keys_to_query = {}
+    for params in params_list:
+        key = (at, module, function, repr(params))
+        found, value = storage_cache_get(key) if at is not None else (False, None)
+        if found:
+            values[key] = value
+        else:
+            keys_to_query[key] = params
+    if keys_to_query:
+        # Storage keys are created locally: create_storage_key would init the runtime (one request) for each key
+        substrate_client.init_runtime(block_hash=at)
+        storage_keys = {}
+        for key, params in keys_to_query.items():
+            storage_key = StorageKey.create_from_storage_function(module, function, params,
+                                                                  runtime_config=substrate_client.runtime_config,
+                                                                  metadata=substrate_client.metadata)
+            storage_keys[storage_key.to_hex()] = (key, storage_key)
+        storage_key_list = list(map(lambda item: item[1], storage_keys.values()))
+        for page in range(0, len(storage_key_list), QUERY_MULTI_PAGE_SIZE):
+            page_keys = storage_key_list[page:page + QUERY_MULTI_PAGE_SIZE]
+            for storage_key, value in substrate_client.query_multi(page_keys, block_hash=at):
+                key = storage_keys[storage_key.to_hex()][0]
+                values[key] = value.value
+                if at is not None:
+                    storage_cache_set(key, value.value)
+    return list(map(lambda params: values.get((at, module, function, repr(params))), params_list))
+
+
+def substrate_query(substrate_client, module, function, params=[], at=None):
+    try:
+        return query_storage(substrate_client, module, function, params, at)
     except Exception as e:
         log.error("Failed to query: {} {}.{}, Error: {}".format(getattr(substrate_client, 'url', 'NO_URL'),
                                                                 module, function, e))
         return None
 
 
-def substrate_query_url(url, module, function,params=[]):
+def substrate_query_url(url, module, function, params=[], at=None):
     substrate_client = get_substrate_client(url)
-    return substrate_query(substrate_client, module, function, params)
+    return substrate_query(substrate_client, module, function, params, at)
 
 
 def substrate_sudo_relay_xcm_call(para_id, encoded_message, weight):
@@ -228,7 +734,13 @@ def substrate_sudo_relay_xcm_call(para_id, encoded_message, weight):
 
 
 def substrate_xcm_sudo_transact_call(substrate_client, keypair, para_id, encoded_message, weight):
-    payload = substrate_client.compose_call(
+    payload = compose_xcm_transact_call(substrate_client, para_id, encoded_message, weight)
+    return substrate_sudo_call(substrate_client, keypair, payload)
+
+
+# XcmPallet.send of a Transact dispatched with the Superuser origin on the parachain (to be sent with sudo)
+def compose_xcm_transact_call(substrate_client, para_id, encoded_message, weight):
+    return substrate_client.compose_call(
         call_module='XcmPallet',
         call_function='send',
         call_params={
@@ -262,4 +774,3 @@ def substrate_xcm_sudo_transact_call(substrate_client, keypair, para_id, encoded
                 ]]
             }
         })
-    return substrate_sudo_call(substrate_client, keypair, payload)
@@ -0,0 +1,373 @@
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from scalecodec.base import ScaleBytes
+from substrateinterface import ExtrinsicReceipt
+from substrateinterface.exceptions import SubstrateRequestException
+from substrateinterface.storage import StorageKey
+from websocket import create_connection
+
+from app.config.network_configuration import ws_pool_capacity, ws_pool_idle_timeout, extrinsic_inclusion_timeout
+
+log = logging.getLogger(__name__)
+
+# Frames bigger than this (eg. runtime upgrades) are sent from a worker thread to keep the event loop responsive
+LARGE_FRAME_SIZE = 64 * 1024
+RPC_REQUEST_TIMEOUT = 60
+
+# LRU of AsyncRpcClient Objects, bounded like the synchronous connection pool (see ws_pool.py)
+# { (url, event_loop): AsyncRpcClient Object }
+async_rpc_clients = OrderedDict()
+# the clients of several event loops (uvicorn, the extrinsic pipeline, asyncio.run in worker threads) share the LRU
+async_rpc_clients_lock = threading.Lock()
+
+# Event loop (in a background thread) watching the pipelined submissions made from synchronous code
+pipeline_loop = None
+pipeline_loop_lock = threading.Lock()
+
+
+# JSON-RPC client multiplexing any number of in-flight requests and subscriptions over a single websocket.
+# A reader thread receives the frames and hands them over to the event loop which resolves the pending requests by id.
+class AsyncRpcClient:
+
+    def __init__(self, url, loop=None, connect=create_connection, ws_options=None):
+        self.url = url
+        self.loop = loop or asyncio.get_running_loop()
+        self.connect_websocket = connect
+        self.ws_options = ws_options or {'max_size': 2 ** 32}
+        self.websocket = None
+        self.closed = False
+        self.request_ids = itertools.count(1)
+        self.pending = {}
+        self.subscriptions = {}
+        # notifications received before their subscription id was returned to the subscriber
+        self.early_notifications = {}
+        self.send_lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self._connect_lock = asyncio.Lock()
+        self._reader = None
+
+    def __repr__(self):
+        return 'AsyncRpcClient(url={}, pending={}, subscriptions={})'.format(
+            self.url, len(self.pending), len(self.subscriptions))
+
+    def is_busy(self):
+        return bool(self.pending or self.subscriptions)
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self.websocket is not None:
+                return
+            self.websocket = await asyncio.to_thread(self.connect_websocket, self.url, **self.ws_options)
+            self._reader = threading.Thread(target=self._read_loop, name=f'async-rpc-{self.url}', daemon=True)
+            self._reader.start()
+
+    def _read_loop(self):
+        while not self.closed:
+            try:
+                message = json.loads(self.websocket.recv())
+            except Exception as e:
+                if not self.closed:
+                    log.info('Websocket connection lost, url: {}, Error: {}'.format(self.url, e))
+                self._call_in_loop(self._connection_lost, e)
+                return
+            self._call_in_loop(self._dispatch, message)
+
+    def _call_in_loop(self, callback, *args):
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # event loop closed
+            self.closed = True
+
+    def _dispatch(self, message):
+        # A batch response is a list of responses
+        if isinstance(message, list):
+            for item in message:
+                self._dispatch(item)
+            return
+        if 'id' in message and message['id'] in self.pending:
+            future = self.pending.pop(message['id'])
+            if not future.done():
+                future.set_result(message)
+        elif 'params' in message and 'subscription' in message['params']:
+            subscription_id = message['params']['subscription']
+            if subscription_id in self.subscriptions:
+                self.subscriptions[subscription_id].put_nowait(message['params']['result'])
+            else:
+                self.early_notifications.setdefault(subscription_id, []).append(message['params']['result'])
+
+    def _connection_lost(self, error):
+        self.closed = True
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f'Websocket connection lost: {error}'))
+        self.pending.clear()
+        for queue in self.subscriptions.values():
+            queue.put_nowait(ConnectionError(f'Websocket connection lost: {error}'))
+
+    def _send(self, data):
+        with self.send_lock:
+            self.websocket.send(data)
+
+    async def send(self, payload):
+        data = json.dumps(payload)
+        if len(data) > LARGE_FRAME_SIZE:
+            await asyncio.to_thread(self._send, data)
+        else:
+            self._send(data)
+
+    async def request_raw(self, method, params=None, timeout=RPC_REQUEST_TIMEOUT):
+        if self.websocket is None:
+            await self.connect()
+        if self.closed:
+            raise ConnectionError(f'Websocket connection to {self.url} is closed')
+        self.last_used = time.monotonic()
+        request_id = next(self.request_ids)
+        future = self.loop.create_future()
+        self.pending[request_id] = future
+        try:
+            await self.send({'jsonrpc': '2.0', 'method': method, 'params': params or [], 'id': request_id})
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def request(self, method, params=None, timeout=RPC_REQUEST_TIMEOUT):
+        message = await self.request_raw(method, params, timeout)
+        if 'error' in message:
+            raise SubstrateRequestException(message['error'])
+        return message['result']
+
+    # Returns the subscription id and a queue of the notification results
+    async def subscribe(self, method, params=None, timeout=RPC_REQUEST_TIMEOUT):
+        subscription_id = await self.request(method, params, timeout)
+        queue = asyncio.Queue()
+        for result in self.early_notifications.pop(subscription_id, []):
+            queue.put_nowait(result)
+        self.subscriptions[subscription_id] = queue
+        return subscription_id, queue
+
+    async def unsubscribe(self, method, subscription_id):
+        self.subscriptions.pop(subscription_id, None)
+        self.early_notifications.pop(subscription_id, None)
+        try:
+            await self.request(method, [subscription_id])
+        except Exception as e:
+            log.debug('Failed to unsubscribe {} on {}, Error: {}'.format(subscription_id, self.url, e))
+
+    def close(self):
+        self.closed = True
+        if self.websocket is not None:
+            try:
+                self.websocket.close()
+            except Exception:
+                pass
+
+
+async def get_async_rpc_client(url):
+    loop = asyncio.get_running_loop()
+    with async_rpc_clients_lock:
+        client = async_rpc_clients.get((url, loop))
+        if client is None or client.closed:
+            client = AsyncRpcClient(url, loop)
+            async_rpc_clients[(url, loop)] = client
+        async_rpc_clients.move_to_end((url, loop))
+        client.last_used = time.monotonic()
+    close_idle_async_rpc_clients(loop)
+    await client.connect()
+    return client
+
+
+# Forget the closed clients (or those of a closed event loop) and close the idle ones of the loop, then its least
+# recently used ones while there are too many clients. Clients with in-flight requests or subscriptions are never
+# closed, nor those of another running loop (they are closed from their own loop).
+def close_idle_async_rpc_clients(loop=None):
+    loop = loop or asyncio.get_running_loop()
+    now = time.monotonic()
+    idle_clients = []
+    with async_rpc_clients_lock:
+        for key, client in list(async_rpc_clients.items()):
+            client_loop = key[1]
+            if client.closed or client_loop.is_closed():
+                idle_clients.append(async_rpc_clients.pop(key))
+            elif client_loop is loop and now - client.last_used > ws_pool_idle_timeout() and not client.is_busy():
+                idle_clients.append(async_rpc_clients.pop(key))
+        for key, client in list(async_rpc_clients.items()):
+            if len(async_rpc_clients) <= ws_pool_capacity():
+                break
+            if key[1] is loop and not client.is_busy():
+                idle_clients.append(async_rpc_clients.pop(key))
+    for client in idle_clients:
+        client.close()
+
+
+async def async_substrate_rpc_request(substrate_client, method, params=[]):
+    try:
+        rpc_client = await get_async_rpc_client(substrate_client.url)
+        return await rpc_client.request(method, params)
+    except Exception as err:
+        log.error(f'Failed to call {method} on {getattr(substrate_client, "url", "NO_URL")}; Error: {err}')
+        return None
+
+
+async def async_substrate_query(substrate_client, module, function, params=[]):
+    try:
+        rpc_client = await get_async_rpc_client(substrate_client.url)
+        if substrate_client.metadata is None:
+            await asyncio.to_thread(substrate_client.init_runtime)
+        storage_key = StorageKey.create_from_storage_function(module, function, params,
+                                                              runtime_config=substrate_client.runtime_config,
+                                                              metadata=substrate_client.metadata)
+        # Check the runtime version in the same round trip, the metadata must be reloaded after a runtime upgrade
+        runtime_version, storage_data = await asyncio.gather(
+            rpc_client.request('state_getRuntimeVersion'),
+            rpc_client.request('state_getStorage', [storage_key.to_hex()]))
+        if runtime_version['specVersion'] != substrate_client.runtime_version:
+            await asyncio.to_thread(substrate_client.init_runtime)
+            storage_key = StorageKey.create_from_storage_function(module, function, params,
+                                                                  runtime_config=substrate_client.runtime_config,
+                                                                  metadata=substrate_client.metadata)
+            storage_data = await rpc_client.request('state_getStorage', [storage_key.to_hex()])
+        return storage_key.decode_scale_value(None if storage_data is None else ScaleBytes(storage_data)).value
+    except Exception as e:
+        log.error("Failed to query: {} {}.{}, Error: {}".format(getattr(substrate_client, 'url', 'NO_URL'),
+                                                                module, function, e))
+        return None
+
+
+# Wait for the free balance of the addresses to reach min_funds (e.g. teleported funds arriving on a parachain),
+# with a single System.Account storage subscription. Returns the addresses funded before the timeout.
+async def async_wait_for_funds(substrate_client, addresses, min_funds, timeout):
+    funded_addresses = set()
+    try:
+        rpc_client = await get_async_rpc_client(substrate_client.url)
+        if substrate_client.metadata is None:
+            await asyncio.to_thread(substrate_client.init_runtime)
+        storage_keys = {}
+        for address in addresses:
+            storage_key = StorageKey.create_from_storage_function('System', 'Account', [address],
+                                                                  runtime_config=substrate_client.runtime_config,
+                                                                  metadata=substrate_client.metadata)
+            storage_keys[storage_key.to_hex()] = (address, storage_key)
+        subscription_id, change_sets = await rpc_client.subscribe('state_subscribeStorage', [list(storage_keys)])
+    except Exception as e:
+        log.error("Failed to watch the funds of {} on {}, Error: {}".format(
+            addresses, getattr(substrate_client, 'url', 'NO_URL'), e))
+        return funded_addresses
+
+    async def wait_for_all_funds():
+        # the first notification holds the current values
+        while len(funded_addresses) < len(storage_keys):
+            change_set = await change_sets.get()
+            if isinstance(change_set, Exception):
+                raise change_set
+            for key, value in change_set['changes']:
+                if key not in storage_keys or value is None:
+                    continue
+                address, storage_key = storage_keys[key]
+                account = storage_key.decode_scale_value(ScaleBytes(value)).value
+                if account['data']['free'] >= min_funds:
+                    funded_addresses.add(address)
+    try:
+        await asyncio.wait_for(wait_for_all_funds(), timeout)
+    except asyncio.TimeoutError:
+        log.error("Timeout, accounts {} not funded on {}".format(set(addresses) - funded_addresses,
+                                                                  getattr(substrate_client, 'url', 'NO_URL')))
+    except Exception as e:
+        log.error("Failed to watch the funds of {} on {}, Error: {}".format(
+            addresses, getattr(substrate_client, 'url', 'NO_URL'), e))
+    finally:
+        await rpc_client.unsubscribe('state_unsubscribeStorage', subscription_id)
+    return funded_addresses
+
+
+# Returns the receipt once the extrinsic is in a block, raises SubstrateRequestException when it is not included
+# (dropped, invalid...) or not included within extrinsic_inclusion_timeout seconds
+async def async_submit_extrinsic(substrate_client, extrinsic, wait=True):
+    rpc_client = await get_async_rpc_client(substrate_client.url)
+    extrinsic_hash = '0x{}'.format(extrinsic.extrinsic_hash.hex())
+    if not wait:
+        await rpc_client.request('author_submitExtrinsic', [str(extrinsic.data)])
+        return ExtrinsicReceipt(substrate=substrate_client, extrinsic_hash=extrinsic_hash)
+
+    subscription_id, updates = await rpc_client.subscribe('author_submitAndWatchExtrinsic', [str(extrinsic.data)])
+
+    async def wait_for_inclusion():
+        while True:
+            update = await updates.get()
+            if isinstance(update, Exception):
+                raise update
+            # status is either a string ('ready', 'future', 'broadcast') or a dict ({'inBlock': hash}, ...)
+            if isinstance(update, dict):
+                status = {k.lower(): v for k, v in update.items()}
+                if 'inblock' in status:
+                    return ExtrinsicReceipt(substrate=substrate_client, extrinsic_hash=extrinsic_hash,
+                                            block_hash=status['inblock'], finalized=False)
+                if 'finalized' in status:
+                    return ExtrinsicReceipt(substrate=substrate_client, extrinsic_hash=extrinsic_hash,
+                                            block_hash=status['finalized'], finalized=True)
+                if 'dropped' in status or 'invalid' in status or 'usurped' in status:
+                    raise SubstrateRequestException(f'Extrinsic {extrinsic_hash} not included: {update}')
+            elif update.lower() in ['dropped', 'invalid']:
+                raise SubstrateRequestException(f'Extrinsic {extrinsic_hash} not included: {update}')
+            elif update.lower() == 'future':
+                # waiting for an earlier nonce of the signer, aborted by the timeout if it never comes
+                log.warning(f'Extrinsic {extrinsic_hash} is waiting for an earlier nonce of its signer')
+    try:
+        return await asyncio.wait_for(wait_for_inclusion(), extrinsic_inclusion_timeout())
+    except asyncio.TimeoutError:
+        raise SubstrateRequestException(f'Extrinsic {extrinsic_hash} not included after '
+                                        f'{extrinsic_inclusion_timeout()}s')
+    finally:
+        await rpc_client.unsubscribe('author_unwatchExtrinsic', subscription_id)
+
+
+def get_pipeline_loop():
+    global pipeline_loop
+    with pipeline_loop_lock:
+        if pipeline_loop is None:
+            pipeline_loop = asyncio.new_event_loop()
+            threading.Thread(target=pipeline_loop.run_forever, name='extrinsic-pipeline', daemon=True).start()
+        return pipeline_loop
+
+
+# Submit and watch an extrinsic signed with a nonce from nonce_manager, the nonce is released if the extrinsic is not
+# included. The submission is aborted when an earlier nonce of the signer is released (the extrinsic can't be included
+# anymore). The events of the included extrinsic are fetched (from a worker thread) before returning the receipt so that
+# is_success and error_message don't hit the network anymore. Returns False on error.
+async def async_submit_pipelined_extrinsic(substrate_client, extrinsic, nonce_manager, nonce, wait=True):
+    loop = asyncio.get_running_loop()
+    submission = asyncio.ensure_future(async_submit_extrinsic(substrate_client, extrinsic, wait))
+    aborted = threading.Event()
+
+    def abort():
+        aborted.set()
+        loop.call_soon_threadsafe(submission.cancel)
+    nonce_manager.track(nonce, abort)
+    try:
+        receipt = await submission
+    except asyncio.CancelledError:
+        if not aborted.is_set():
+            raise
+        log.error("Extrinsic (nonce={}) of {} aborted, an earlier nonce was not included".format(
+            nonce, nonce_manager.address))
+        nonce_manager.release(nonce)
+        return False
+    except Exception as e:
+        log.error("Failed to send extrinsic (nonce={}) of {}, Error: {}".format(nonce, nonce_manager.address, e))
+        nonce_manager.release(nonce)
+        return False
+    finally:
+        nonce_manager.untrack(nonce)
+    log.info("Extrinsic '{}' sent".format(receipt.extrinsic_hash))
+    if wait:
+        try:
+            await asyncio.to_thread(receipt.process_events)
+        except Exception as e:
+            log.error("Failed to get the events of extrinsic {}, Error: {}".format(receipt.extrinsic_hash, e))
+    return receipt
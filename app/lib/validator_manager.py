@@ -1,19 +1,21 @@
 import logging
 from substrateinterface import Keypair, KeypairType
-from app.lib.substrate import substrate_query_url, substrate_sudo_call, get_substrate_client, substrate_call, \
-    substrate_batchall_call
+from app.lib.substrate import substrate_sudo_call, get_substrate_client, substrate_call, \
+    substrate_batchall_call, get_pinned_block_hash, query_storage, query_storage_map
 from app.config.network_configuration import relay_chain_consensus, derivation_root_seed
+from app.lib.derived_keys import get_derived_public_key
+from app.lib.session_cache import session_scoped_query, invalidate_session_scoped_value
 from app.lib.session_keys import decode_session_key
 
 log = logging.getLogger('validator_manager')
 
 
 def get_validator_set(ws_endpoint):
-    return substrate_query_url(ws_endpoint, "Session", "Validators")
+    return session_scoped_query(get_substrate_client(ws_endpoint), "Session", "Validators")
 
 
 def get_account_session_keys(ws_endpoint, account):
-    return substrate_query_url(ws_endpoint, "Session", "NextKeys", [account])
+    return session_scoped_query(get_substrate_client(ws_endpoint), "Session", "NextKeys", [account])
 
 
 def register_validators(ws_endpoint, sudo_seed, stash_account_addresses):
@@ -26,7 +28,7 @@ def register_validators(ws_endpoint, sudo_seed, stash_account_addresses):
             'validators': stash_account_addresses
         }
     )
-    substrate_sudo_call(substrate_client, keypair, payload)
+    return substrate_sudo_call(substrate_client, keypair, payload)
 
 def deregister_validators(ws_endpoint, sudo_seed, stash_account_addresses):
     substrate_client = get_substrate_client(ws_endpoint)
@@ -41,27 +43,69 @@ def deregister_validators(ws_endpoint, sudo_seed, stash_account_addresses):
     substrate_sudo_call(substrate_client, keypair, payload)
 
 
+# Validator set state read once, at a single block: active (Session.Validators), to add and to retire
+# (ValidatorManager queues in PoA, difference between the Staking.Validators and the active set in PoS).
+class ValidatorSetSnapshot:
+
+    def __init__(self, block_hash=None, active=None, to_add=None, to_retire=None):
+        self.block_hash = block_hash
+        # keep the on-chain order of the active set for display
+        self.validators = list(active or [])
+        self.active = set(self.validators)
+        self.to_add = set(to_add or [])
+        self.to_retire = set(to_retire or [])
+
+    def __repr__(self):
+        return 'ValidatorSetSnapshot(block_hash={}, active={}, to_add={}, to_retire={})'.format(
+            self.block_hash, len(self.active), self.to_add, self.to_retire)
+
+    # Returns 'pending_addition', 'pending_deletion' or whether the address is in the active set
+    def status(self, address):
+        if address in self.to_add:
+            return 'pending_addition'
+        elif address in self.to_retire:
+            return 'pending_deletion'
+        else:
+            return address in self.active
+
+    def is_registered(self, address):
+        return address in self.active or address in self.to_add or address in self.to_retire
+
+
+# at: block hash at which to read the validator set (default: best block)
+# Returns None when the validator set can't be read, an empty snapshot would show every validator as unregistered
+def get_validator_set_snapshot(ws_endpoint, at=None):
+    substrate_client = get_substrate_client(ws_endpoint)
+    try:
+        block_hash = at or get_pinned_block_hash(substrate_client)
+        active_validators = query_storage(substrate_client, 'Session', 'Validators', at=block_hash)
+        if relay_chain_consensus() == "poa":
+            validators_to_add = query_storage(substrate_client, 'ValidatorManager', 'ValidatorsToAdd', at=block_hash)
+            validators_to_retire = query_storage(substrate_client, 'ValidatorManager', 'ValidatorsToRetire',
+                                                 at=block_hash)
+        else:
+            staking_validators = set(staking_validators_set(ws_endpoint, block_hash))
+            validators_to_add = staking_validators - set(active_validators)
+            validators_to_retire = set(active_validators) - staking_validators
+        return ValidatorSetSnapshot(block_hash, active_validators, validators_to_add, validators_to_retire)
+    except Exception as e:
+        log.error("Failed to read the validator set: {}, Error: {}".format(ws_endpoint, e))
+        return None
+
+
 def get_validators_pending_addition(ws_endpoint):
-    if relay_chain_consensus() == "poa":
-        return substrate_query_url(ws_endpoint, "ValidatorManager", "ValidatorsToAdd")
-    else:
-        active_validators = substrate_query_url(ws_endpoint, "Session", "Validators")
-        staking_validators = staking_validators_set(ws_endpoint)
-        return list(set(staking_validators) - set(active_validators))
+    validator_set_snapshot = get_validator_set_snapshot(ws_endpoint) or ValidatorSetSnapshot()
+    return list(validator_set_snapshot.to_add)
 
 
 def get_validators_pending_deletion(ws_endpoint):
-    if relay_chain_consensus() == "poa":
-        return substrate_query_url(ws_endpoint, "ValidatorManager", "ValidatorsToRetire")
-    else:
-        active_validators = substrate_query_url(ws_endpoint, "Session", "Validators")
-        staking_validators = staking_validators_set(ws_endpoint)
-        return list(set(active_validators) - set(staking_validators))
+    validator_set_snapshot = get_validator_set_snapshot(ws_endpoint) or ValidatorSetSnapshot()
+    return list(validator_set_snapshot.to_retire)
 
 
-def setup_pos_validator(ws_endpoint, stash_seed, session_key=None, controller_seed=None):
+def setup_pos_validator(ws_endpoint, stash_seed, session_key=None, controller_seed=None, substrate_client=None):
     batch_call = []
-    substrate_client = get_substrate_client(ws_endpoint)
+    substrate_client = substrate_client or get_substrate_client(ws_endpoint)
     stash_keypair = Keypair.create_from_uri(stash_seed)
 
     # 1. Bond
@@ -128,6 +172,8 @@ def setup_pos_validator(ws_endpoint, stash_seed, session_key=None, controller_se
                 stash_keypair.ss58_address, result.extrinsic_hash, result.block_hash))
             return False
         else:
+            if session_key:
+                invalidate_session_scoped_value(substrate_client.url, 'Session', 'NextKeys')
             return True
     else:
         return False
@@ -143,18 +189,15 @@ def staking_chill(ws_endpoint, stash_seed):
     substrate_call(substrate_client, keypair, payload)
 
 
-def staking_validators_set(ws_endpoint):
+def staking_validators_set(ws_endpoint, block_hash=None):
     substrate_client = get_substrate_client(ws_endpoint)
-    all_validators = substrate_client.query_map('Staking', 'Validators')
-    result = []
-    for validator in all_validators:
-        result.append(validator[0].value)
-    return result
+    all_validators = query_storage_map(substrate_client, 'Staking', 'Validators', at=block_hash)
+    return list(map(lambda validator: validator[0], all_validators))
 
 
 def get_derived_validator_session_keys(node_name):
     key_seed = derivation_root_seed()
-    sr_public_key = Keypair.create_from_uri(key_seed + "//validator//" + node_name, crypto_type=KeypairType.SR25519).public_key.hex()
+    sr_public_key = get_derived_public_key(key_seed, "//validator//" + node_name, crypto_type=KeypairType.SR25519)[0][2:]
     # FIXME after https://github.com/polkascan/py-substrate-interface/issues/284
     #ed_public_key = Keypair.create_from_uri(key_seed + "//validator//" + node_name, crypto_type=KeypairType.ED25519).public_key.hex()
     return {
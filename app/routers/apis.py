@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import re
 from typing import Any, Dict
 
 from fastapi import APIRouter, Path, Query, HTTPException, File, UploadFile
@@ -12,13 +13,15 @@ from app.lib.cron_tasks import list_cron_tasks, exec_cron_task
 from app.lib.kubernetes_client import list_validator_stateful_sets
 from app.lib.log_utils import get_node_pod_logs
 from app.lib.network_utils import list_substrate_nodes, list_validators, list_parachains, list_parachain_collators, \
-    register_statefulset_validators, deregister_statefulset_validators, deregister_validator_addresses, \
+    list_substrate_nodes_live, register_statefulset_validators, deregister_statefulset_validators, deregister_validator_addresses, \
     rotate_nodes_session_keys, register_statefulset_collators, onboard_parachain_by_id, \
     offboard_parachain_by_id, deregister_statefulset_collators, get_substrate_node, \
     register_validator_nodes, register_validator_addresses, deregister_validator_nodes, register_collator_nodes, \
     deregister_collator_nodes, add_invulnerable_collator, remove_invulnerable_collator, \
     set_collator_nodes_keys_on_chain, add_invulnerable_collators, remove_invulnerable_collators
-from app.lib.parachain_manager import parachain_runtime_upgrade
+from app.lib.parachain_upgrade import start_parachain_runtime_upgrade, get_parachain_upgrade_jobs, \
+    get_parachain_upgrade_job, start_parachain_runtime_rollout
+from app.lib.runtime_store import store_runtime, read_runtime
 from app.lib.runtime_utils import get_relay_runtime, get_relay_active_configuration, update_relay_configuration, \
     get_parachain_runtime, runtime_upgrade, get_relaychain_metadata, get_parachain_metadata
 from app.lib.staking_utils import get_validator_nominator_mnemonic, staking_create_nominator, \
@@ -29,11 +32,22 @@ log = logging.getLogger('router_apis')
 
 router = APIRouter(prefix="/api")
 
+BLOCK_HASH_PATTERN = re.compile('0x[0-9a-fA-F]{64}')
+
+
+# Reads at a block hash are cached: reject anything else than a block hash before it reaches the node and the cache
+def check_block_hash(at):
+    if at is not None and not BLOCK_HASH_PATTERN.fullmatch(at):
+        raise HTTPException(status_code=400, detail=f'Invalid block hash: {at}')
+
 
 @router.get("/nodes")
 async def get_nodes(
-    statefulset: str = Query(default="", description="To restrict the displayed nodes to a single StatefulSet")
+    statefulset: str = Query(default="", description="To restrict the displayed nodes to a single StatefulSet"),
+    live: bool = Query(default=False, description="Query each node for its readiness, sync state and version")
 ):
+    if live:
+        return JSONResponse(await list_substrate_nodes_live(statefulset))
     return JSONResponse(list_substrate_nodes(statefulset))
 
 
@@ -54,38 +68,54 @@ async def get_node_logs(
 
 @router.get("/validators")
 async def get_validators(
-    statefulset: str = Query(default="", description="To restrict the displayed nodes to a single StatefulSet")
+    statefulset: str = Query(default="", description="To restrict the displayed nodes to a single StatefulSet"),
+    at: str = Query(default=None, description="Relay-chain block hash at which to read the validator set (default: best block)")
 ):
-    return JSONResponse(list_validators(statefulset))
+    check_block_hash(at)
+    return JSONResponse(list_validators(statefulset, at))
 
 
 @router.get("/parachains")
-async def get_parachains():
-    return JSONResponse(list_parachains())
+async def get_parachains(
+    at: str = Query(default=None, description="Relay-chain block hash at which to read the parachains (default: best block)")
+):
+    check_block_hash(at)
+    return JSONResponse(list_parachains(at))
 
 
 @router.get("/collators/{para_id}")
 async def get_collators(
     para_id: str = Path(description="ID of the parachain for which to get collators"),
-    statefulset: str = Query(default="", description="To restrict the displayed nodes to a single StatefulSet")
+    statefulset: str = Query(default="", description="To restrict the displayed nodes to a single StatefulSet"),
+    at: str = Query(default=None, description="Parachain block hash at which to read the collator set (default: best block)")
 ):
-    return JSONResponse(list_parachain_collators(para_id, statefulset))
+    check_block_hash(at)
+    return JSONResponse(list_parachain_collators(para_id, statefulset, at))
 
 
 @router.get("/runtime")
-async def get_runtime():
-    return JSONResponse(get_relay_runtime())
+async def get_runtime(
+    at: str = Query(default=None, description="Relay-chain block hash at which to read the runtime (default: best block)")
+):
+    check_block_hash(at)
+    return JSONResponse(await asyncio.to_thread(get_relay_runtime, at))
 
 
 @router.get("/runtime/configuration")
-async def get_runtime_configuration():
-    return JSONResponse(get_relay_active_configuration())
+async def get_runtime_configuration(
+    at: str = Query(default=None, description="Relay-chain block hash at which to read the configuration (default: best block)")
+):
+    check_block_hash(at)
+    return JSONResponse(await asyncio.to_thread(get_relay_active_configuration, at))
 
 
 @router.post("/runtime/configuration")
 async def update_runtime_configuration(new_configuration_keys: Dict[str, Any]):
-    for key, value in new_configuration_keys.items():
-        status, message = update_relay_configuration(key, value)
+    # The configuration changes are submitted back to back and included together
+    updates = list(map(lambda item: update_relay_configuration(item[0], item[1], pipelined=True),
+                       new_configuration_keys.items()))
+    for update in updates:
+        status, message = await asyncio.wrap_future(update)
         if not status:
             raise HTTPException(status_code=500, detail=message)
     return PlainTextResponse("OK")
@@ -93,29 +123,41 @@ async def update_runtime_configuration(new_configuration_keys: Dict[str, Any]):
 
 @router.get("/runtime/metadata")
 async def get_relaychain_runtime_metadata():
-    return Response(content=get_relaychain_metadata(), media_type="application/octet-stream")
+    return Response(content=await get_relaychain_metadata(), media_type="application/octet-stream")
 
 
 @router.get("/parachains/{para_id}/runtime")
 async def get_runtime_parachain(
-    para_id: str = Path(description="ID of the parachain for which to get runtime info")
+    para_id: str = Path(description="ID of the parachain for which to get runtime info"),
+    at: str = Query(default=None, description="Relay-chain block hash at which to read the parachain head and code hash stored on the relay-chain (default: best block), the parachain runtime is read at the parachain best block")
 ):
-    return JSONResponse(get_parachain_runtime(para_id))
+    check_block_hash(at)
+    return JSONResponse(await asyncio.to_thread(get_parachain_runtime, para_id, at))
 
 
 @router.get("/parachains/{para_id}/runtime/metadata")
 async def get_parachain_runtime_metadata(
     para_id: str = Path(description="ID of the parachain for which to get runtime metadata")
 ):
-    return Response(content=get_parachain_metadata(para_id), media_type="application/octet-stream")
+    return Response(content=await get_parachain_metadata(para_id), media_type="application/octet-stream")
 
 
 @router.post("/validators/register")
 async def register_validators(
     statefulset: str = Query(default=None, description="Name of the StatefulSet containing the nodes to be registered"),
     address: list[str] = Query(default=[], description="Address(es) to be deregistered"),
-    node: list[str] = Query(default=[], description="Name of the node(s) to be registered")
+    node: list[str] = Query(default=[], description="Name of the node(s) to be registered"),
+    wait: bool = Query(default=False, description="Wait for the nodes registration and return the result of each node")
 ):
+    if wait:
+        results = {}
+        if statefulset:
+            results.update(await register_statefulset_validators(statefulset))
+        if node:
+            results.update(await register_validator_nodes(node))
+        if address:
+            register_validator_addresses(address)
+        return JSONResponse(results)
     if statefulset:
         asyncio.create_task(register_statefulset_validators(statefulset))
     if address:
@@ -311,7 +353,8 @@ async def transfer_funds_from_sudo(
 ):
     relay_chain_client = get_relay_chain_client()
     from_account_keypair = Keypair.create_from_seed(network_sudo_seed())
-    if transfer_funds(relay_chain_client, from_account_keypair, account, amount):
+    if await asyncio.wrap_future(transfer_funds(relay_chain_client, from_account_keypair, account, amount,
+                                                pipelined=True)):
         return PlainTextResponse('OK')
     else:
         raise HTTPException(status_code=500, detail="Failed to transfer funds")
@@ -325,34 +368,97 @@ async def teleport_funds_from_sudo(
 ):
     relay_chain_client = get_relay_chain_client()
     from_account_keypair = Keypair.create_from_seed(network_sudo_seed())
-    if teleport_funds(relay_chain_client, from_account_keypair, para_id, account, amount):
+    if await asyncio.wrap_future(teleport_funds(relay_chain_client, from_account_keypair, para_id, account, amount,
+                                                pipelined=True)):
         return PlainTextResponse('OK')
     else:
         raise HTTPException(status_code=500, detail="Failed to teleport funds")
 
 
+# Store the uploaded runtime or read a runtime uploaded previously, returns (runtime_name, code_hash, runtime_wasm)
+async def get_upgrade_runtime(runtime, code_hash):
+    if runtime:
+        code_hash = await store_runtime(runtime)
+        runtime_name = runtime.filename.split('.')[0]
+    elif code_hash:
+        runtime_name = code_hash
+    else:
+        raise HTTPException(status_code=400, detail='Either a runtime file or the code_hash of a runtime uploaded '
+                                                    'previously is required')
+    try:
+        runtime_wasm = read_runtime(code_hash)
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+    if runtime_wasm is None:
+        raise HTTPException(status_code=404, detail=f'No runtime uploaded with code hash {code_hash}')
+    return runtime_name, code_hash, runtime_wasm
+
+
 @router.post("/parachains/{para_id}/runtime/upgrade")
 async def parachain_upload_runtime_and_upgrade(
-    runtime: UploadFile = File(description="File with runtime: *.compact.compressed.wasm"),
+    runtime: UploadFile = File(default=None, description="File with runtime: *.compact.compressed.wasm"),
     para_id: str = Path(description="Parachain ID on which to upgrade runtime"),
     check_version: bool = Query(default=True, description="Check runtime version before upgrading"),
+    code_hash: str = Query(default=None, description="Code hash of a runtime uploaded previously (instead of a file)"),
 ):
-    runtime_name = runtime.filename.split('.')[0]
-    runtime_bytes = await runtime.read()
-    status, txt = parachain_runtime_upgrade(runtime_name, para_id, runtime_bytes, check_version)
-    if not status:
-        raise HTTPException(status_code=500, detail=txt)
-    else:
-        return PlainTextResponse(txt)
+    runtime_name, code_hash, runtime_bytes = await get_upgrade_runtime(runtime, code_hash)
+    # the upgrade runs in the background, see /parachains/runtime/upgrades/{job_id} for its status
+    job = start_parachain_runtime_upgrade(runtime_name, para_id, runtime_bytes, check_version, code_hash)
+    if not job:
+        raise HTTPException(status_code=409, detail=f'A runtime upgrade of parachain #{para_id} is already running')
+    return JSONResponse(job)
+
+
+@router.post("/parachains/runtime/rollout")
+async def parachains_upload_runtimes_and_upgrade(
+    para_id: list[str] = Query(description="Parachain IDs on which to upgrade runtime"),
+    runtime: list[UploadFile] = File(default=None, description="Files with runtime: *.compact.compressed.wasm, "
+                                                                "one per parachain ID (in the same order)"),
+    code_hash: list[str] = Query(default=None, description="Code hashes of runtimes uploaded previously, one per "
+                                                           "parachain ID (instead of files)"),
+    check_version: bool = Query(default=True, description="Check runtime version before upgrading"),
+):
+    runtimes = runtime or [None] * len(para_id)
+    code_hashes = code_hash or [None] * len(para_id)
+    if len(runtimes) != len(para_id) or len(code_hashes) != len(para_id):
+        raise HTTPException(status_code=400, detail='A runtime file or code hash is required for each parachain ID')
+    if len(set(map(int, para_id))) != len(para_id):
+        raise HTTPException(status_code=400, detail='Duplicated parachain IDs')
+    upgrades = []
+    for id, id_runtime, id_code_hash in zip(para_id, runtimes, code_hashes):
+        runtime_name, id_code_hash, runtime_bytes = await get_upgrade_runtime(id_runtime, id_code_hash)
+        upgrades.append((runtime_name, id, runtime_bytes, id_code_hash))
+    # the upgrades run in the background, see /parachains/runtime/upgrades for their status
+    jobs = start_parachain_runtime_rollout(upgrades, check_version)
+    if not jobs:
+        raise HTTPException(status_code=409, detail='A runtime upgrade of one of the parachains is already running')
+    return JSONResponse(jobs)
+
+
+@router.get("/parachains/runtime/upgrades")
+async def get_parachain_runtime_upgrades(
+    para_id: str = Query(default=None, description="Only list the runtime upgrades of this parachain"),
+):
+    return JSONResponse(get_parachain_upgrade_jobs(para_id))
+
+
+@router.get("/parachains/runtime/upgrades/{job_id}")
+async def get_parachain_runtime_upgrade(
+    job_id: str = Path(description="ID of the runtime upgrade job"),
+):
+    job = get_parachain_upgrade_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f'No runtime upgrade job {job_id}')
+    return JSONResponse(job)
 
 
 @router.post("/runtime/upgrade")
 async def upload_runtime_and_upgrade(
-    runtime: UploadFile = File(description="File with runtime: *.compact.compressed.wasm"),
-    schedule_blocks_wait: int = Query(description="Setup scheduler to delay execution of the runtime by a number of blocks", default=None)
+    runtime: UploadFile = File(default=None, description="File with runtime: *.compact.compressed.wasm"),
+    schedule_blocks_wait: int = Query(description="Setup scheduler to delay execution of the runtime by a number of blocks", default=None),
+    code_hash: str = Query(default=None, description="Code hash of a runtime uploaded previously (instead of a file)"),
 ):
-    runtime_name = runtime.filename.split('.')[0]
-    runtime_bytes = await runtime.read()
+    runtime_name, code_hash, runtime_bytes = await get_upgrade_runtime(runtime, code_hash)
     status, txt = runtime_upgrade(runtime_name, runtime_bytes, schedule_blocks_wait)
     if not status:
         raise HTTPException(status_code=500, detail=txt)
@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import APIRouter, Path, Query, Request
 from starlette.responses import HTMLResponse
 from starlette.templating import Jinja2Templates
@@ -6,8 +8,8 @@ from app import __version__
 from app.config.network_configuration import get_node_logs_link, get_network
 from app.lib.kubernetes_client import get_pod_details, list_validator_stateful_sets, list_parachain_collator_stateful_sets
 from app.lib.network_utils import list_substrate_nodes, list_validators, get_session_queued_keys, list_parachains, \
-    list_parachain_collators, get_substrate_node
-from app.lib.runtime_utils import get_relay_runtime, get_relay_active_configuration, get_parachain_runtime
+    list_parachain_collators, get_substrate_node, list_substrate_nodes_live
+from app.lib.runtime_utils import get_relay_runtime, async_get_relay_active_configuration, get_parachain_runtime
 from app.lib.parachain_manager import get_all_parachain_lifecycles
 from app.lib.substrate import get_relay_chain_client
 
@@ -25,13 +27,19 @@ async def homepage(request: Request):
 @router.get("/nodes", response_class=HTMLResponse, include_in_schema=False)
 async def nodes(
     request: Request,
-    statefulset: str = Query(default="", description="To restrict the displayed nodes to a single StatefulSet")
+    statefulset: str = Query(default="", description="To restrict the displayed nodes to a single StatefulSet"),
+    live: bool = Query(default=False, description="Query each node for its readiness, sync state and version")
 ):
-    nodes = list_substrate_nodes(statefulset)
+    if live:
+        nodes = await list_substrate_nodes_live(statefulset)
+    else:
+        nodes = list_substrate_nodes(statefulset)
     return templates.TemplateResponse('nodes.html', dict(request=request,
                                                     network_name=network,
                                                     node_logs_link=get_node_logs_link(),
                                                     nodes=nodes,
+                                                    live=live,
+                                                    ready_count=len(list(filter(lambda node: node.get('ready'), nodes))),
                                                     nodes_count=len(nodes),
                                                     validator_count=len(list(filter(lambda node: node['role'] == 'authority', nodes))),
                                                     collator_count=len(list(filter(lambda node: node['role'] == 'collator', nodes))),
@@ -140,11 +148,14 @@ async def collators(
 async def get_runtime(
     request: Request
 ):
+    # the runtime is read by the synchronous client, from a worker thread
+    runtime, configuration = await asyncio.gather(asyncio.to_thread(get_relay_runtime),
+                                                  async_get_relay_active_configuration())
     return templates.TemplateResponse('runtime_info.html',
                                       dict(request=request,
                                            network=network,
-                                           runtime=get_relay_runtime(),
-                                           configuration=get_relay_active_configuration()))
+                                           runtime=runtime,
+                                           configuration=configuration))
 
 
 @router.get("/parachains/{para_id}/runtime", response_class=HTMLResponse, include_in_schema=False)
@@ -156,5 +167,5 @@ async def get_runtime_parachain(
                                       dict(request=request,
                                            network=network,
                                            para_id=para_id,
-                                           runtime=get_parachain_runtime(para_id)
+                                           runtime=await asyncio.to_thread(get_parachain_runtime, para_id)
                                            ))
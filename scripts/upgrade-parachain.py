@@ -3,11 +3,13 @@
 # python ./upgrade-parachain.py  wss://westend-rpc.polkadot.io  wss://westend-bridge-hub-rpc.polkadot.io 0xrelay_sudo_seed.... /home/user/Downloads/...
 
 import sys
+import time
 
 import click
 from substrateinterface import SubstrateInterface, Keypair
 from substrateinterface.utils.hasher import blake2_256
-from app.lib.parachain_manager import parachain_runtime_upgrade
+from app.lib.parachain_manager import compose_authorize_upgrade_call, compose_apply_authorized_upgrade_call
+from app.lib.substrate import get_query_weight, substrate_xcm_sudo_transact_call, substrate_call
 
 if len(sys.argv) > 3:
     relay_ws = sys.argv[1]
@@ -37,8 +39,31 @@ if len(sys.argv) > 3:
 
 
     if click.confirm('Do you want to continue?', default=False):
-        parachain_runtime_upgrade("Runtime name", para_id, binarycontent, parachain, relay, relay_sudo_keypair,
-                                  check_version=True)
+        # Send System.authorizeUpgrade(hash) to the parachain with a XCM from the relay-chain
+        authorize_upgrade = compose_authorize_upgrade_call(parachain, code_hash, check_version=True)
+        weight = get_query_weight(parachain, authorize_upgrade)
+        receipt = substrate_xcm_sudo_transact_call(relay, relay_sudo_keypair, para_id, authorize_upgrade.encode(),
+                                                   weight)
+        if not (receipt and receipt.is_success):
+            print("Unable to send System.authorizeUpgrade(hash) on Relaychain:", getattr(receipt, 'error_message', None))
+            exit(1)
+        print("Sent System.authorizeUpgrade(hash) on Relaychain, block:", receipt.block_hash)
+
+        print('Waiting 60s for parachain to receive AuthorizedUpgrade XCM')
+        for i in range(30):
+            time.sleep(2)
+            if parachain.query('System', 'AuthorizedUpgrade').value:
+                break
+        else:
+            print("Timeout, parachain did not receive the AuthorizedUpgrade message")
+            exit(1)
+
+        # Anyone can submit the unsigned system.applyAuthorizedUpgrade
+        receipt = substrate_call(parachain, None, compose_apply_authorized_upgrade_call(parachain, binarycontent))
+        if not (receipt and receipt.is_success):
+            print("Unable to send system.applyAuthorizedUpgrade:", getattr(receipt, 'error_message', None))
+            exit(1)
+        print("Runtime upgrade applied, block:", receipt.block_hash)
 
     else:
         print('Do nothing')
@@ -0,0 +1,148 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+from kubernetes.client import V1ObjectMeta, V1Pod
+from substrateinterface import Keypair
+
+from app.lib import collator_mint, network_utils
+from app.lib.collator_account import get_derived_collator_keypair
+from app.lib.collator_mint import register_mint_collators, collators_set_keys
+from app.lib.substrate import completed_future
+from tests.test_utils import FakeSubstrateClient, FakeReceipt
+
+ROOT_SEED = Keypair.generate_mnemonic()
+TOKEN = 10 ** 12
+
+
+def fake_client(candidates, desired_candidates):
+    return FakeSubstrateClient('ws://collator-0', storage={
+        ('CollatorSelection', 'Candidates'): candidates, ('CollatorSelection', 'DesiredCandidates'): desired_candidates,
+        ('CollatorSelection', 'CandidacyBond'): 10 * TOKEN, ('ParachainInfo', 'ParachainId'): 1000})
+
+
+def collator_address(node_name):
+    return get_derived_collator_keypair(node_name, 42).ss58_address
+
+
+class CollatorMintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = mock.patch.dict(os.environ, {'DERIVATION_ROOT_SEED': ROOT_SEED})
+        self.env.start()
+        self.node_names = list(map(lambda index: f'collator-{index}', range(5)))
+        self.substrate_client = fake_client([{'who': collator_address('collator-0')}], 3)
+        self.transfer_funds = mock.Mock(return_value=True)
+        self.xcm_calls = []
+        self.registered_addresses = []
+        self.session_keys_set = []
+
+    def tearDown(self):
+        self.env.stop()
+
+    def substrate_sudo_relay_xcm_call(self, para_id, encoded_call, weight):
+        self.xcm_calls.append(encoded_call)
+        return FakeReceipt(True)
+
+    def set_mint_collator_session_keys(self, node_name):
+        self.session_keys_set.append(node_name)
+        return node_name != 'collator-3'
+
+    def substrate_call(self, substrate_client, keypair, call, wait=True, pipelined=False):
+        self.assertTrue(pipelined)
+        self.registered_addresses.append(keypair.ss58_address)
+        if keypair.ss58_address == collator_address('collator-4'):
+            return completed_future(FakeReceipt(False, {'name': 'TooManyCandidates'}))
+        return completed_future(FakeReceipt(True))
+
+    def register_mint_collators(self, node_names=None, rotate_key=False):
+        funds = {collator_address('collator-1'): 20 * TOKEN}
+        with mock.patch.multiple(collator_mint,
+                                 get_node_client=mock.Mock(return_value=self.substrate_client),
+                                 get_chain_properties=mock.Mock(return_value={'tokenDecimals': 12}),
+                                 get_funds_multi=lambda client, addresses: {
+                                     address: funds.get(address, 0) for address in addresses},
+                                 transfer_funds=self.transfer_funds,
+                                 set_mint_collator_session_keys=self.set_mint_collator_session_keys,
+                                 get_query_weight=mock.Mock(),
+                                 substrate_sudo_relay_xcm_call=self.substrate_sudo_relay_xcm_call,
+                                 substrate_call=self.substrate_call):
+            return register_mint_collators(node_names or self.node_names, 42, rotate_key)
+
+    def test_register_mint_collators(self):
+        addresses = self.register_mint_collators()
+        self.assertEqual(addresses, [collator_address('collator-0'), collator_address('collator-1'),
+                                     collator_address('collator-2'), None, None])
+        # a single funding batch, without the accounts having enough funds
+        self.transfer_funds.assert_called_once()
+        self.assertEqual(self.transfer_funds.call_args.args[2],
+                         [collator_address('collator-2'), collator_address('collator-3'),
+                          collator_address('collator-4')])
+        # a single XCM: 1 candidate + 3 collators with session keys set
+        self.assertEqual(self.xcm_calls, [{'max': 4}])
+        self.assertEqual(self.registered_addresses, list(map(collator_address, ['collator-1', 'collator-2',
+                                                                                'collator-4'])))
+
+    def test_rotate_candidate_keys(self):
+        self.assertEqual(self.register_mint_collators(['collator-0'], rotate_key=True),
+                         [collator_address('collator-0')])
+        # already a candidate: only its session keys are rotated
+        self.assertEqual(self.session_keys_set, ['collator-0'])
+        self.assertEqual(self.registered_addresses, [])
+        self.assertEqual(self.register_mint_collators(['collator-0']), [collator_address('collator-0')])
+        self.assertEqual(self.session_keys_set, ['collator-0'])
+
+    def test_desired_candidates_not_decreased(self):
+        self.substrate_client.storage[('CollatorSelection', 'DesiredCandidates')] = 10
+        self.register_mint_collators()
+        self.assertEqual(self.xcm_calls, [])
+
+    def test_collators_set_keys(self):
+        funds = {collator_address('collator-0'): TOKEN}
+        teleport_funds = mock.Mock(return_value=True)
+        waited_addresses = []
+
+        async def async_wait_for_funds(substrate_client, addresses, min_funds, timeout):
+            waited_addresses.extend(addresses)
+            # collator-4 funds don't arrive
+            return set(addresses) - {collator_address('collator-4')}
+
+        with mock.patch.multiple(collator_mint,
+                                 get_node_client=mock.Mock(return_value=self.substrate_client),
+                                 get_relay_chain_client=mock.Mock(),
+                                 get_relay_chain_ss58_format=mock.Mock(return_value=42),
+                                 network_sudo_seed=mock.Mock(return_value='0x' + '01' * 32),
+                                 get_chain_properties=mock.Mock(return_value={'tokenDecimals': 12}),
+                                 get_funds_multi=lambda client, addresses: {
+                                     address: funds.get(address, 0) for address in addresses},
+                                 teleport_funds=teleport_funds,
+                                 async_wait_for_funds=async_wait_for_funds,
+                                 collator_set_aura_key=lambda node_name: node_name != 'collator-3'):
+            node_names = asyncio.run(collators_set_keys(1000, list(map(lambda node_name: (node_name, 42),
+                                                                       self.node_names))))
+        self.assertEqual(node_names, ['collator-0', 'collator-1', 'collator-2'])
+        # a single teleport batch for the accounts without enough funds
+        teleport_funds.assert_called_once()
+        self.assertEqual(teleport_funds.call_args.args[3], waited_addresses)
+        self.assertEqual(waited_addresses, list(map(collator_address, self.node_names[1:])))
+
+
+    def test_set_collator_nodes_keys_on_chain(self):
+        def collator_pod(name, ss58_format):
+            return V1Pod(metadata=V1ObjectMeta(name=name, labels={'role': 'collator', 'ss58Format': ss58_format}))
+        collators_set_keys = mock.AsyncMock(return_value=['collator-0', 'collator-1', 'collator-2'])
+        with mock.patch.multiple(network_utils,
+                                 get_pod=lambda name: collator_pod(name, '2'),
+                                 list_collator_pods=mock.Mock(return_value=[collator_pod('collator-1', '2'),
+                                                                            collator_pod('collator-2', '2')]),
+                                 collators_set_keys=collators_set_keys):
+            node_names = asyncio.run(network_utils.set_collator_nodes_keys_on_chain(1000, ['collator-0'],
+                                                                                    'collator'))
+        self.assertEqual(node_names, ['collator-0', 'collator-1', 'collator-2'])
+        collators_set_keys.assert_awaited_once_with(1000, [('collator-0', '2'), ('collator-1', '2'),
+                                                           ('collator-2', '2')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import json
+import threading
+import time
+import unittest
+
+from app.lib.connection_pool import SubstrateConnectionPool, PooledSubstrateInterface
+
+
+class FakeWebsocket:
+
+    def __init__(self, broken=False):
+        self.broken = broken
+
+    def ping(self):
+        if self.broken:
+            raise ConnectionError('broken pipe')
+
+
+class FakeSubstrateClient:
+
+    def __init__(self, url):
+        self.url = url
+        self.lock = threading.RLock()
+        self.last_used = time.monotonic()
+        self.websocket = FakeWebsocket()
+        self.closed = False
+
+    def connect_websocket(self):
+        self.websocket = FakeWebsocket()
+
+    def ping(self):
+        with self.lock:
+            self.websocket.ping()
+
+    def close(self):
+        self.closed = True
+
+
+# Node answering a JSON-RPC batch with the given message
+class FakeBatchWebsocket:
+
+    def __init__(self, batch_response):
+        self.batch_response = batch_response
+        self.sent = []
+        self.timeouts = []
+
+    def send(self, message):
+        self.sent.append(json.loads(message))
+
+    def recv(self):
+        return json.dumps(self.batch_response)
+
+    def settimeout(self, timeout):
+        self.timeouts.append(timeout)
+
+
+def pooled_client(websocket):
+    client = PooledSubstrateInterface.__new__(PooledSubstrateInterface)
+    client.lock = threading.RLock()
+    client.url = 'ws://node-0'
+    client.request_id = 1
+    client.websocket = websocket
+    client.rpc_request = lambda method, params: {'jsonrpc': '2.0', 'result': method, 'id': 0}
+    return client
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SubstrateConnectionPool(capacity=2, idle_timeout=60, keepalive_interval=0,
+                                            client_factory=FakeSubstrateClient)
+
+    def test_get_reuses_client(self):
+        client = self.pool.get('ws://node-0')
+        self.assertIs(client, self.pool.get('ws://node-0'))
+        self.assertEqual(self.pool.stats['misses'], 1)
+        self.assertEqual(self.pool.stats['hits'], 1)
+
+    def test_lru_eviction(self):
+        client_0 = self.pool.get('ws://node-0')
+        self.pool.get('ws://node-1')
+        self.pool.get('ws://node-0')
+        self.pool.get('ws://node-2')
+        self.assertNotIn('ws://node-1', self.pool)
+        self.assertIn('ws://node-0', self.pool)
+        self.assertFalse(client_0.closed)
+        self.assertEqual(self.pool.stats['evictions'], 1)
+
+    def test_busy_client_is_not_evicted(self):
+        client_0 = self.pool.get('ws://node-0')
+        self.pool.get('ws://node-1')
+        # hold the client lock from another thread, as if a call was in flight
+        locked, release = threading.Event(), threading.Event()
+
+        def in_flight_call():
+            with client_0.lock:
+                locked.set()
+                release.wait()
+        thread = threading.Thread(target=in_flight_call)
+        thread.start()
+        locked.wait()
+        try:
+            self.pool.get('ws://node-2')
+        finally:
+            release.set()
+            thread.join()
+        self.assertIn('ws://node-0', self.pool)
+        self.assertNotIn('ws://node-1', self.pool)
+
+    def test_evicted_busy_client_is_closed_after_its_call(self):
+        client = self.pool.get('ws://node-0')
+        locked, release = threading.Event(), threading.Event()
+
+        def in_flight_call():
+            with client.lock:
+                locked.set()
+                release.wait()
+        thread = threading.Thread(target=in_flight_call)
+        thread.start()
+        locked.wait()
+        self.pool.evict('ws://node-0')
+        self.assertNotIn('ws://node-0', self.pool)
+        self.assertFalse(client.closed)
+        release.set()
+        thread.join()
+        for _ in range(100):
+            if client.closed:
+                break
+            time.sleep(0.01)
+        self.assertTrue(client.closed)
+
+    def test_url_lock_is_kept_after_eviction(self):
+        self.pool.get('ws://node-0')
+        url_lock = self.pool._url_lock('ws://node-0')
+        self.pool.evict('ws://node-0')
+        # a thread which got the lock before the eviction and the next callers connect one at a time
+        self.assertIs(self.pool._url_lock('ws://node-0'), url_lock)
+
+    def test_keepalive_evicts_idle_client(self):
+        client = self.pool.get('ws://node-0')
+        client.last_used -= 120
+        self.pool.keepalive()
+        self.assertNotIn('ws://node-0', self.pool)
+        self.assertTrue(client.closed)
+
+    def test_keepalive_reconnects_broken_client(self):
+        client = self.pool.get('ws://node-0')
+        client.websocket = FakeWebsocket(broken=True)
+        self.pool.keepalive()
+        self.assertIs(client, self.pool.get('ws://node-0'))
+        self.assertFalse(client.websocket.broken)
+        self.assertEqual(self.pool.stats['reconnects'], 1)
+
+    def test_checked_out_clients_are_bounded(self):
+        self.pool.max_dedicated_clients = 1
+        client_0 = self.pool.checkout('ws://node-0')
+        client_1 = self.pool.checkout('ws://node-0')
+        # exclusive clients, not the pooled one
+        self.assertIsNot(client_0, client_1)
+        self.assertNotIn('ws://node-0', self.pool)
+        self.pool.checkin('ws://node-0', client_0)
+        self.pool.checkin('ws://node-0', client_1)
+        self.assertFalse(client_0.closed)
+        self.assertTrue(client_1.closed)
+        self.assertIs(self.pool.checkout('ws://node-0'), client_0)
+
+    def test_keepalive_closes_idle_checked_in_client(self):
+        client = self.pool.checkout('ws://node-0')
+        self.pool.checkin('ws://node-0', client)
+        client.last_used -= 120
+        self.pool.keepalive()
+        self.assertTrue(client.closed)
+        self.assertEqual(self.pool.dedicated_clients, {})
+
+
+    def test_rpc_batch_request(self):
+        websocket = FakeBatchWebsocket([{'jsonrpc': '2.0', 'result': 'node-0', 'id': 2},
+                                        {'jsonrpc': '2.0', 'result': 'polkadot', 'id': 1}])
+        client = pooled_client(websocket)
+        self.assertEqual(list(map(lambda response: response['result'], client.rpc_batch_request(
+            [{'method': 'system_chain'}, {'method': 'system_name'}]))), ['polkadot', 'node-0'])
+        self.assertEqual(len(websocket.sent), 1)
+        self.assertEqual(websocket.timeouts[-1], None)
+
+    def test_rejected_rpc_batch_is_sent_request_by_request(self):
+        # eg. batches disabled on the node
+        websocket = FakeBatchWebsocket({'jsonrpc': '2.0', 'error': {'code': -32600, 'message': 'Invalid request'},
+                                        'id': None})
+        client = pooled_client(websocket)
+        self.assertEqual(client.rpc_batch_request([{'method': 'system_chain'}, {'method': 'system_name'}]),
+                         [{'jsonrpc': '2.0', 'result': 'system_chain', 'id': 0},
+                          {'jsonrpc': '2.0', 'result': 'system_name', 'id': 0}])
+        self.assertEqual(websocket.timeouts[-1], None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from substrateinterface import Keypair, KeypairType
+
+from app.lib import derived_keys
+from app.lib.derived_keys import get_derived_keypair, get_derived_address, get_derived_public_key, \
+    prewarm_derived_keys
+
+root_seed = 'bottom drive obey lake curtain smoke basket hold race lonely fit walk'
+
+
+class DerivedKeysTest(unittest.TestCase):
+
+    def setUp(self):
+        derived_keys.derived_keypairs.clear()
+        derived_keys.derived_public_keys.clear()
+        derived_keys.snapshot_state.update({'loaded': False, 'dirty': False})
+        self.snapshot_path = os.path.join(tempfile.mkdtemp(), 'derived-keys')
+
+    def test_derived_keys_match_uri_derivation(self):
+        expected = Keypair.create_from_uri(root_seed + '//validator-0//stash', ss58_format=0)
+        keypair = get_derived_keypair(root_seed, '//validator-0//stash', 0)
+        self.assertEqual(keypair.ss58_address, expected.ss58_address)
+        self.assertIs(get_derived_keypair(root_seed, '//validator-0//stash', '0'), keypair)
+        self.assertEqual(get_derived_address(root_seed, '//validator-0//stash', 0), expected.ss58_address)
+
+        moon_path = "/m/44'/60'/0'/0/0"
+        moon_keypair = Keypair.create_from_uri(root_seed + moon_path, crypto_type=KeypairType.ECDSA)
+        self.assertEqual(get_derived_address(root_seed, moon_path, crypto_type=KeypairType.ECDSA),
+                         moon_keypair.ss58_address)
+
+    def test_cache_is_bounded(self):
+        with mock.patch.object(derived_keys, 'derived_keys_cache_size', return_value=2):
+            for index in range(3):
+                get_derived_address(root_seed, f'//{index}')
+        self.assertEqual(len(derived_keys.derived_keypairs), 2)
+        self.assertEqual(list(map(lambda key: key[1], derived_keys.derived_public_keys)), ['//1', '//2'])
+
+    def test_snapshot_restores_public_keys(self):
+        with mock.patch.object(derived_keys, 'derived_keys_snapshot_path', return_value=self.snapshot_path):
+            self.assertEqual(prewarm_derived_keys(root_seed, [('//collator//node-0', 42, KeypairType.SR25519),
+                                                              ('//collator//node-1', 42, KeypairType.SR25519)]), 2)
+            self.assertEqual(prewarm_derived_keys(root_seed, [('//collator//node-0', 42, KeypairType.SR25519)]), 0)
+            with open(self.snapshot_path, 'rb') as f:
+                self.assertNotIn(b'node-0', f.read())
+
+            # Simulate a restart: public keys are read from the snapshot, nothing is derived
+            self.setUp()
+            with mock.patch.object(derived_keys.Keypair, 'create_from_uri') as create_from_uri:
+                public_key, address = get_derived_public_key(root_seed, '//collator//node-1')
+                create_from_uri.assert_not_called()
+            self.assertEqual(address, Keypair.create_from_uri(root_seed + '//collator//node-1').ss58_address)
+
+            # Snapshot written with another root seed is ignored
+            self.setUp()
+            self.assertEqual(prewarm_derived_keys(Keypair.generate_mnemonic(), [('//0', 42, KeypairType.SR25519)]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+from kubernetes.client import V1ObjectMeta, V1OwnerReference, V1Pod, V1PodList, V1ListMeta
+
+from app.lib.kubernetes_client import pod_owner
+from app.lib.kubernetes_informer import Informer, object_label
+
+
+def pod(name, role, owner, resource_version='1'):
+    return V1Pod(metadata=V1ObjectMeta(name=name, labels={'role': role}, resource_version=resource_version,
+                                       owner_references=[V1OwnerReference(api_version='apps/v1', kind='StatefulSet',
+                                                                          name=owner, uid=owner)]))
+
+
+def event(event_type, obj):
+    return {'type': event_type, 'object': obj,
+            'raw_object': {'metadata': {'name': obj.metadata.name, 'resourceVersion': obj.metadata.resource_version}}}
+
+
+class KubernetesInformerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.list_calls = []
+        self.pods = [pod('validator-b-0', 'authority', 'validator-b'), pod('validator-a-0', 'authority', 'validator-a'),
+                     pod('collator-0', 'collator', 'collator')]
+        self.informer = Informer('pods', self.list_pods, indexers={'role': object_label('role'), 'owner': pod_owner},
+                                 namespace='testnet')
+
+    def list_pods(self, **kwargs):
+        self.list_calls.append(kwargs)
+        return V1PodList(metadata=V1ListMeta(resource_version='10'), items=self.pods)
+
+    def test_relist_builds_indexes(self):
+        self.informer.relist()
+        self.assertTrue(self.informer.synced.is_set())
+        self.assertEqual(self.list_calls, [{'namespace': 'testnet'}])
+        self.assertEqual(self.informer.resource_version, '10')
+        self.assertEqual(list(map(lambda p: p.metadata.name, self.informer.list('role', 'authority'))),
+                         ['validator-a-0', 'validator-b-0'])
+        self.assertEqual(self.informer.list('owner', 'collator'), [self.pods[2]])
+        self.assertEqual(self.informer.list('role', 'full'), [])
+
+    def test_events_update_indexes(self):
+        self.informer.relist()
+        self.informer.handle_event(event('ADDED', pod('validator-a-1', 'authority', 'validator-a', '11')))
+        self.informer.handle_event(event('MODIFIED', pod('validator-b-0', 'full', 'validator-b', '12')))
+        self.informer.handle_event(event('DELETED', pod('collator-0', 'collator', 'collator', '13')))
+        self.informer.handle_event({'type': 'BOOKMARK', 'object': None,
+                                    'raw_object': {'metadata': {'resourceVersion': '20'}}})
+
+        self.assertEqual(self.informer.resource_version, '20')
+        self.assertEqual(list(map(lambda p: p.metadata.name, self.informer.list('role', 'authority'))),
+                         ['validator-a-0', 'validator-a-1'])
+        self.assertEqual(self.informer.list('role', 'full')[0].metadata.resource_version, '12')
+        self.assertEqual(self.informer.list('role', 'collator'), [])
+        self.assertNotIn('collator', self.informer.indexes['owner'])
+        self.assertIsNone(self.informer.get('collator-0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
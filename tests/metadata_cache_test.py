@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from scalecodec.base import ScaleBytes
+
+from app.lib import metadata_cache
+from app.lib.metadata_cache import MetadataFileCache
+
+
+class FakeMetadata:
+
+    def __init__(self, data):
+        self.data = data
+        self.decoded = False
+
+    def decode(self):
+        self.decoded = True
+
+
+class FakeRuntimeConfig:
+
+    def create_scale_object(self, type_string, data):
+        return FakeMetadata(data)
+
+
+class FakeSubstrateClient:
+
+    def __init__(self):
+        self.rpc_calls = 0
+        self.runtime_config = FakeRuntimeConfig()
+
+    def rpc_request(self, method, params):
+        self.rpc_calls += 1
+        return {'result': '0x' + '11' * 32}
+
+
+class MetadataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        metadata_cache.loaded_metadata.clear()
+        self.directory = tempfile.mkdtemp()
+
+    def test_metadata_is_shared_through_disk(self):
+        writer = MetadataFileCache(self.directory, FakeSubstrateClient())
+        writer.set('METADATA_1000', FakeMetadata(ScaleBytes(b'\x6d\x65\x74\x61\x0e')))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, '0x' + '11' * 32 + '-METADATA_1000.scale')))
+
+        # Simulate a new worker process
+        metadata_cache.loaded_metadata.clear()
+        reader = MetadataFileCache(self.directory, FakeSubstrateClient())
+        metadata = reader.get('METADATA_1000')
+        self.assertTrue(metadata.decoded)
+        self.assertEqual(bytes(metadata.data.data), b'\x6d\x65\x74\x61\x0e')
+        self.assertIsNone(reader.get('METADATA_1001'))
+
+    def test_decoded_metadata_is_shared_in_process(self):
+        metadata = FakeMetadata(ScaleBytes(b'\x00'))
+        MetadataFileCache(self.directory, FakeSubstrateClient()).set('METADATA_1000', metadata)
+        other_client = FakeSubstrateClient()
+        self.assertIs(MetadataFileCache(self.directory, other_client).get('METADATA_1000'), metadata)
+        self.assertEqual(other_client.rpc_calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,8 +5,8 @@ from testcontainers.core.container import DockerContainer
 from os import environ
 
 from app.lib.node_utils import is_node_ready, get_node_health, is_node_ready_ws, get_node_version, \
-    get_node_sync_state
-from app.lib.substrate import get_substrate_client, substrate_rpc_request
+    get_node_sync_state, get_node_live_status
+from app.lib.substrate import get_substrate_client, substrate_rpc_request, substrate_rpc_batch_request
 from tests.test_constants import RPC_DEV_FLAGS
 from tests.test_utils import wait_for_http_ready
 
@@ -57,6 +57,24 @@ class NodeUtilsTest(unittest.TestCase):
         self.assertEqual(node_sync_state['startingBlock'], 0, "Successfully retrieved node sync starting block")
         self.assertTrue(node_sync_state['currentBlock'] >= 0, "Successfully retrieved node sync current block")
 
+    def test_get_node_live_status(self):
+        live_status = get_node_live_status(self.polkadot_rpc_http_url)
+        self.assertTrue(live_status['ready'], "Successfully retrieved node readiness")
+        self.assertNotEqual(live_status['version'], '?', "Successfully retrieved node version")
+        self.assertTrue(live_status['best_block'] >= 0, "Successfully retrieved node best block")
+
+    def test_substrate_rpc_batch_request(self):
+        node_info = substrate_rpc_batch_request(self.polkadot_node_client, {
+            'peerId': 'system_localPeerId',
+            'health': 'system_health',
+            'hasKey': ('author_hasKey', ['0x00', 'aura']),
+            'unknown': 'system_unknownMethod'
+        })
+        self.assertEqual(node_info['peerId'], '12D3KooWMddYZctYE6RePcxvEWvU1Xyq5X4x7WW6FK4GjVF8QvFt', "Successfully retrieved peer ID")
+        self.assertTrue('isSyncing' in node_info['health'], "Successfully retrieved node health")
+        self.assertEqual(node_info['hasKey'], False, "Successfully checked keystore")
+        self.assertEqual(node_info['unknown'], None, "Failed request doesn't fail the batch")
+
 
 if __name__ == '__main__':
     unittest.main()
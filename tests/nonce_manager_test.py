@@ -0,0 +1,62 @@
+import unittest
+
+from substrateinterface import Keypair
+
+from app.lib.nonce_manager import NonceManager, get_nonce_manager
+from app.lib.substrate import substrate_call
+from tests.test_utils import FakeSubstrateClient, FakeCall
+
+
+def fake_client(next_index, url='ws://relay'):
+    return FakeSubstrateClient(url, rpc_results={'system_accountNextIndex': next_index})
+
+
+class NonceManagerTest(unittest.TestCase):
+
+    def test_next_nonce_is_tracked_locally(self):
+        substrate_client = fake_client(5)
+        nonce_manager = NonceManager('5Alice')
+        # the extrinsics are not in the pool yet when the next ones are signed
+        self.assertEqual([nonce_manager.next_nonce(substrate_client) for _ in range(3)], [5, 6, 7])
+        self.assertEqual(substrate_client.requests[0], ('system_accountNextIndex', ['5Alice']))
+
+    def test_next_nonce_follows_the_chain(self):
+        substrate_client = fake_client(5)
+        nonce_manager = NonceManager('5Alice')
+        nonce_manager.next_nonce(substrate_client)
+        # extrinsics submitted by other means
+        substrate_client.rpc_results['system_accountNextIndex'] = 9
+        self.assertEqual(nonce_manager.next_nonce(substrate_client), 9)
+
+    def test_release(self):
+        substrate_client = fake_client(5)
+        nonce_manager = NonceManager('5Alice')
+        nonce = nonce_manager.next_nonce(substrate_client)
+        nonce_manager.release(nonce)
+        self.assertEqual(nonce_manager.next_nonce(substrate_client), 5)
+
+        nonce_manager.next_nonce(substrate_client)
+        # an earlier nonce is rejected: resync with the chain
+        nonce_manager.release(5)
+        self.assertIsNone(nonce_manager.nonce)
+        self.assertEqual(nonce_manager.next_nonce(substrate_client), 5)
+
+    def test_get_nonce_manager(self):
+        self.assertIs(get_nonce_manager('ws://relay', '5Alice'), get_nonce_manager('ws://relay', '5Alice'))
+        self.assertIsNot(get_nonce_manager('ws://relay', '5Alice'), get_nonce_manager('ws://para', '5Alice'))
+
+    def test_substrate_call_uses_the_nonce_manager(self):
+        substrate_client = fake_client(5, url='ws://substrate-call')
+        keypair = Keypair.create_from_uri('//Alice')
+        call = FakeCall()
+        substrate_call(substrate_client, keypair, call)
+        # a rejected extrinsic gives its nonce back
+        substrate_client.rejected = True
+        self.assertFalse(substrate_call(substrate_client, keypair, call))
+        substrate_client.rejected = False
+        substrate_call(substrate_client, keypair, call)
+        self.assertEqual(list(map(lambda signed: signed[1], substrate_client.signed)), [5, 6, 6])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,9 +3,11 @@ import time
 import unittest
 
 from substrateinterface import SubstrateInterface
+from substrateinterface.utils.hasher import blake2_256
 from testcontainers.compose import DockerCompose
 from tests.test_utils import wait_for_http_ready
-from app.lib.parachain_manager import get_parachain_head, get_chain_wasm, initialize_parachain, cleanup_parachain, \
+from app.lib.parachain_manager import get_parachain_head, get_chain_wasm, get_chain_code_hash, \
+    initialize_parachain, cleanup_parachain, \
     get_parachains_ids, \
     get_parathreads_ids, get_parachain_lifecycles, get_parachain_leases_count
 
@@ -52,6 +54,12 @@ class ParachainManagerTest(unittest.TestCase):
         print(result)
         self.assertTrue(result.startswith('0x'), 'Get parachain wasm')
 
+    def test_get_chain_code_hash(self):
+        wasm = get_chain_wasm(self.parachain_substrate)
+        result = get_chain_code_hash(self.parachain_substrate)
+        print(result)
+        self.assertEqual(result, f'0x{blake2_256(bytearray.fromhex(wasm[2:])).hex()}', 'Get parachain code hash')
+
     def test_get_parachain_head(self):
         result = get_parachain_head(self.parachain_substrate)
         print(result)
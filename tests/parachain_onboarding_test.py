@@ -0,0 +1,56 @@
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+from substrateinterface.utils.hasher import blake2_256
+
+from app.lib import network_utils, parachain_manager
+from app.lib.parachain_manager import get_cached_chain_wasm
+from tests.test_utils import FakeSubstrateClient
+
+WASM = '0x' + bytes(range(256)).hex()
+CODE_HASH = f'0x{blake2_256(bytes(range(256))).hex()}'
+
+
+class ParachainOnboardingTest(unittest.TestCase):
+
+    def setUp(self):
+        parachain_manager.chain_wasm_store.clear()
+
+    def test_wasm_is_downloaded_once_per_code_hash(self):
+        substrate_client = FakeSubstrateClient(storage={'0x3a636f6465': WASM},
+                                               rpc_results={'state_getStorageHash': CODE_HASH})
+        self.assertEqual(get_cached_chain_wasm(substrate_client), WASM)
+        self.assertEqual(get_cached_chain_wasm(substrate_client), WASM)
+        self.assertEqual(substrate_client.requested_methods().count('get_storage_by_key'), 1)
+        self.assertEqual(list(parachain_manager.chain_wasm_store), [CODE_HASH])
+
+    def test_onboarding_in_progress_is_skipped(self):
+        onboarding_started = threading.Event()
+        onboarding_included = threading.Event()
+        onboarded = []
+
+        def onboard_parachain(para_id, force_queue_action, parathread):
+            onboarded.append(para_id)
+            onboarding_started.set()
+            onboarding_included.wait(timeout=5)
+
+        async def onboard_twice():
+            first_onboarding = asyncio.create_task(network_utils.onboard_parachain_by_id(1000, True, False))
+            await asyncio.to_thread(onboarding_started.wait, 5)
+            # API call while the cron run is waiting for the inclusion
+            await network_utils.onboard_parachain_by_id('1000', True, False)
+            onboarding_included.set()
+            await first_onboarding
+            # next cron run
+            await network_utils.onboard_parachain_by_id(1000, True, False)
+
+        with mock.patch.object(network_utils, 'onboard_parachain', side_effect=onboard_parachain):
+            asyncio.run(onboard_twice())
+        self.assertEqual(onboarded, [1000, 1000])
+        self.assertEqual(network_utils.onboarding_para_ids, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from app.lib import parachain_upgrade, parachain_manager
+from app.lib.parachain_manager import send_authorize_upgrades
+from app.lib.parachain_upgrade import start_parachain_runtime_upgrade, get_parachain_upgrade_job, \
+    start_parachain_runtime_rollout
+from app.lib.substrate import BatchReceipt
+from tests.test_utils import FakeSubstrateClient, FakeReceipt, FakeEvent
+
+RUNTIME_WASM = b'\x00asm'
+CODE_HASH = '0x' + '12' * 32
+
+
+def parachain_node_client(para_id):
+    return FakeSubstrateClient(f'ws://collator-{para_id}')
+
+
+# Parachain node: authorizes the upgrade when the XCM is received and enacts the runtime 2 blocks after it is applied
+class FakeRpcClient:
+
+    def __init__(self, receives_xcm=True):
+        self.receives_xcm = receives_xcm
+        self.spec_version = 1000
+        self.code_hash = '0xold'
+        self.subscriptions = {}
+
+    async def request(self, method, params=None):
+        if method == 'state_getRuntimeVersion':
+            return {'specVersion': self.spec_version}
+        if method == 'state_getStorageHash':
+            return self.code_hash
+
+    async def subscribe(self, method, params=None):
+        queue = asyncio.Queue()
+        self.subscriptions[method] = queue
+        if method == 'state_subscribeStorage':
+            queue.put_nowait({'block': '0x01', 'changes': [[params[0][0], None]]})
+            if self.receives_xcm:
+                queue.put_nowait({'block': '0x02', 'changes': [[params[0][0], CODE_HASH + '01']]})
+        return method, queue
+
+    async def unsubscribe(self, method, subscription_id):
+        self.subscriptions.pop(subscription_id)
+
+    def apply(self):
+        async def produce_blocks():
+            while 'chain_subscribeNewHeads' not in self.subscriptions:
+                await asyncio.sleep(0.01)
+            for block_number in range(3):
+                if block_number == 2:
+                    self.code_hash = CODE_HASH
+                    self.spec_version = 1001
+                self.subscriptions['chain_subscribeNewHeads'].put_nowait({'number': hex(block_number)})
+                await asyncio.sleep(0.01)
+        asyncio.create_task(produce_blocks())
+        return FakeReceipt(True)
+
+
+class ParachainUpgradeTest(unittest.TestCase):
+
+    def setUp(self):
+        parachain_upgrade.parachain_upgrade_jobs.clear()
+        self.rpc_clients = {'ws://collator-1000': FakeRpcClient(), 'ws://collator-2000': FakeRpcClient(False)}
+
+    async def get_async_rpc_client(self, url):
+        return self.rpc_clients[url]
+
+    async def async_submit_extrinsic(self, para_client, extrinsic):
+        return self.rpc_clients[para_client.url].apply()
+
+    async def wait_for_jobs(self, jobs):
+        while any(map(lambda job: job['state'] not in ['done', 'failed'], jobs)):
+            await asyncio.sleep(0.01)
+
+    def test_parachain_upgrades(self):
+        async def upgrade_parachains():
+            jobs = [start_parachain_runtime_upgrade('runtime', '1000', RUNTIME_WASM, code_hash=CODE_HASH),
+                    start_parachain_runtime_upgrade('runtime', 2000, RUNTIME_WASM, code_hash=CODE_HASH)]
+            # returns before the upgrades are done
+            self.assertEqual(list(map(lambda job: job['state'], jobs)), ['authorizing', 'authorizing'])
+            self.assertIsNone(start_parachain_runtime_upgrade('runtime', 1000, RUNTIME_WASM))
+            await asyncio.wait_for(self.wait_for_jobs(jobs), 5)
+            return jobs
+
+        with mock.patch.multiple(parachain_upgrade,
+                                 get_parachain_node_client=parachain_node_client,
+                                 send_authorize_upgrade=mock.Mock(return_value=FakeReceipt(True)),
+                                 compose_apply_authorized_upgrade_call=mock.Mock(),
+                                 get_async_rpc_client=self.get_async_rpc_client,
+                                 async_submit_extrinsic=self.async_submit_extrinsic,
+                                 parachain_upgrade_authorization_timeout=mock.Mock(return_value=0.2)):
+            upgraded_job, failed_job = asyncio.run(upgrade_parachains())
+
+        self.assertEqual(upgraded_job['state'], 'done')
+        self.assertEqual(upgraded_job['previous_spec_version'], 1000)
+        self.assertEqual(upgraded_job['spec_version'], 1001)
+        self.assertEqual(get_parachain_upgrade_job(upgraded_job['id']), upgraded_job)
+
+        self.assertEqual(failed_job['state'], 'failed')
+        self.assertIn('AuthorizedUpgrade', failed_job['error'])
+        # subscriptions are closed
+        self.assertEqual(list(map(lambda rpc_client: rpc_client.subscriptions, self.rpc_clients.values())), [{}, {}])
+
+    def test_parachain_rollout(self):
+        self.rpc_clients['ws://collator-3000'] = FakeRpcClient()
+        send_authorize_upgrades = mock.Mock(return_value=[None, 'BadOrigin', None])
+
+        async def rollout_parachains():
+            jobs = start_parachain_runtime_rollout(
+                list(map(lambda para_id: ('runtime', para_id, RUNTIME_WASM, CODE_HASH), [1000, 2000, 3000])))
+            await asyncio.wait_for(self.wait_for_jobs(jobs), 5)
+            return jobs
+
+        with mock.patch.multiple(parachain_upgrade,
+                                 get_parachain_node_client=parachain_node_client,
+                                 send_authorize_upgrades=send_authorize_upgrades,
+                                 compose_apply_authorized_upgrade_call=mock.Mock(),
+                                 get_async_rpc_client=self.get_async_rpc_client,
+                                 async_submit_extrinsic=self.async_submit_extrinsic):
+            jobs = asyncio.run(rollout_parachains())
+
+        # a single relay-chain batch
+        send_authorize_upgrades.assert_called_once()
+        self.assertEqual(list(map(lambda upgrade: upgrade[0], send_authorize_upgrades.call_args.args[0])),
+                         [1000, 2000, 3000])
+        self.assertEqual(list(map(lambda job: job['state'], jobs)), ['done', 'failed', 'done'])
+        self.assertIn('BadOrigin', jobs[1]['error'])
+
+    def test_send_authorize_upgrades(self):
+        # 2nd chunk interrupted at its 2nd call
+        batch_receipt = BatchReceipt([[0, 1], [2, 3, 4]], [
+            FakeReceipt(True, triggered_events=[FakeEvent('BatchCompleted')]),
+            FakeReceipt(True, triggered_events=[FakeEvent('BatchInterrupted', {'index': 1, 'error': 'Unroutable'})])])
+        with mock.patch.multiple(parachain_manager,
+                                 get_relay_chain_client=mock.Mock(),
+                                 network_sudo_seed=mock.Mock(return_value='0x' + '01' * 32),
+                                 compose_authorize_upgrade_call=mock.Mock(),
+                                 get_query_weight=mock.Mock(),
+                                 compose_xcm_transact_call=mock.Mock(),
+                                 substrate_batchall_call=mock.Mock(return_value=batch_receipt)):
+            errors = send_authorize_upgrades(list(map(lambda para_id: (para_id, None, CODE_HASH), range(5))))
+        self.assertEqual(errors, [None, None, None, 'Unroutable', 'Unroutable'])
+
+
+if __name__ == '__main__':
+    unittest.main()
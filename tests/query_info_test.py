@@ -0,0 +1,59 @@
+import unittest
+
+from scalecodec.base import ScaleBytes
+
+from app.lib import substrate
+from app.lib.substrate import get_query_info, get_dry_run_keypair
+from tests.test_utils import FakeSubstrateClient, FakeCall
+
+QUERY_INFO = {'weight': {'ref_time': 178260000, 'proof_size': 3593}, 'class': 'Normal', 'partialFee': 469298416}
+
+
+def fake_client(url, runtime_version):
+    return FakeSubstrateClient(url, rpc_results={'chain_getBlockHash': '0xgenesis' + url},
+                               runtime_call_results={('TransactionPaymentApi', 'query_info'): QUERY_INFO},
+                               runtime_version=runtime_version)
+
+
+def call(data):
+    return FakeCall(data=ScaleBytes(data))
+
+
+def runtime_calls(substrate_client):
+    return substrate_client.requested_methods().count('TransactionPaymentApi_query_info')
+
+
+class QueryInfoTest(unittest.TestCase):
+
+    def setUp(self):
+        substrate.query_info_cache.clear()
+        substrate.genesis_hashes.clear()
+
+    def test_query_info_is_cached_per_runtime_and_call(self):
+        client = fake_client('ws://relay', 1000)
+        self.assertEqual(get_query_info(client, call('0x0400')), QUERY_INFO)
+        self.assertEqual(get_query_info(client, call('0x0400')), QUERY_INFO)
+        self.assertEqual(runtime_calls(client), 1)
+
+        get_query_info(client, call('0x0401'))
+        self.assertEqual(runtime_calls(client), 2)
+
+        # runtime upgrade
+        client.runtime_version = 1001
+        get_query_info(client, call('0x0400'))
+        self.assertEqual(runtime_calls(client), 3)
+
+        # other chain with the same spec version
+        other_client = fake_client('ws://para', 1001)
+        get_query_info(other_client, call('0x0400'))
+        self.assertEqual(runtime_calls(other_client), 1)
+
+    def test_dry_run_keypair_is_reused(self):
+        client = fake_client('ws://relay', 1000)
+        get_query_info(client, call('0x0400'))
+        get_query_info(client, call('0x0401'))
+        self.assertEqual(client.signed, [(get_dry_run_keypair(), 0), (get_dry_run_keypair(), 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from app.lib import substrate
+from app.lib.substrate import get_chain_properties, get_constant
+from tests.test_utils import FakeSubstrateClient
+
+PROPERTIES = {'ss58Format': 42, 'tokenDecimals': 12, 'tokenSymbol': 'ROC'}
+
+
+def fake_client(url):
+    return FakeSubstrateClient(url,
+                               rpc_results={'chain_getBlockHash': '0xgenesis' + url, 'system_properties': PROPERTIES},
+                               constants={('Slots', 'LeasePeriod'): lambda client: client.runtime_version * 10})
+
+
+class RuntimeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        substrate.runtime_cache.clear()
+        substrate.genesis_hashes.clear()
+
+    def test_chain_properties_are_cached(self):
+        client = fake_client('ws://relay')
+        self.assertEqual(get_chain_properties(client), PROPERTIES)
+        self.assertEqual(get_chain_properties(client), PROPERTIES)
+        self.assertEqual(client.requested_methods(), ['chain_getBlockHash', 'system_properties'])
+
+    def test_constants_are_read_again_after_runtime_upgrade(self):
+        client = fake_client('ws://relay')
+        self.assertEqual(get_constant(client, 'Slots', 'LeasePeriod'), 10000)
+        self.assertEqual(get_constant(client, 'Slots', 'LeasePeriod'), 10000)
+        self.assertEqual(client.requested_methods().count('Slots.LeasePeriod'), 1)
+
+        client.runtime_version = 1001
+        self.assertEqual(get_constant(client, 'Slots', 'LeasePeriod'), 10010)
+        self.assertEqual(client.requested_methods().count('Slots.LeasePeriod'), 2)
+        # values of the previous runtime are dropped
+        self.assertEqual(list(map(lambda key: key[1], substrate.runtime_cache)), [1001])
+
+        # other chain
+        self.assertEqual(get_constant(fake_client('ws://para'), 'Slots', 'LeasePeriod'), 10000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import asyncio
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from substrateinterface.utils.hasher import blake2_256
+
+from app.lib import runtime_store
+from app.lib.runtime_store import store_runtime, read_runtime
+
+
+class FakeUploadFile:
+
+    def __init__(self, filename, content):
+        self.filename = filename
+        self.file = io.BytesIO(content)
+        self.read_sizes = []
+
+    async def read(self, size=-1):
+        self.read_sizes.append(size)
+        return self.file.read(size)
+
+
+class RuntimeStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {'RUNTIME_STORE_DIR': self.directory.name})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.directory.cleanup()
+
+    def test_store_runtime(self):
+        runtime_wasm = os.urandom(runtime_store.RUNTIME_UPLOAD_CHUNK_SIZE * 2 + 10)
+        upload_file = FakeUploadFile('rococo_runtime.compact.compressed.wasm', runtime_wasm)
+        code_hash = asyncio.run(store_runtime(upload_file))
+        self.assertEqual(code_hash, f'0x{blake2_256(runtime_wasm).hex()}')
+        # streamed by chunks
+        self.assertNotIn(-1, upload_file.read_sizes)
+        self.assertEqual(read_runtime(code_hash), runtime_wasm)
+        self.assertEqual(os.listdir(self.directory.name), [f'{code_hash}.wasm'])
+
+    def test_read_unknown_runtime(self):
+        self.assertIsNone(read_runtime('0x' + '00' * 32))
+        with self.assertRaises(ValueError):
+            read_runtime('../metadata')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from app.lib.session_cache import SessionIndexWatcher
+from tests.test_utils import FakeSubstrateClient
+
+
+class SessionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeSubstrateClient(storage={('Session', 'CurrentIndex'): 10,
+                                                   ('Session', 'QueuedKeys'): [('alice', {'babe': '0x01'})]})
+        self.watcher = SessionIndexWatcher(self.client.url)
+
+    def test_value_is_read_once_per_session(self):
+        self.assertEqual(self.watcher.get(self.client, 'session', 'Session', 'QueuedKeys', []),
+                         [('alice', {'babe': '0x01'})])
+        # Subscribed: the index comes from the subscription, no query at all
+        self.watcher.subscribed = True
+        self.watcher.get(self.client, 'session', 'Session', 'QueuedKeys', [])
+        self.assertEqual(self.client.queries, [('Session', 'CurrentIndex'), ('Session', 'QueuedKeys')])
+
+        # New session
+        self.client.storage[('Session', 'QueuedKeys')] = [('bob', {'babe': '0x02'})]
+        self.watcher.set_index('session', 11)
+        self.assertEqual(self.watcher.get(self.client, 'session', 'Session', 'QueuedKeys', []),
+                         [('bob', {'babe': '0x02'})])
+        self.assertEqual(self.client.queries[-1], ('Session', 'QueuedKeys'))
+
+    def test_era_index_and_invalidation(self):
+        self.watcher.subscribed = True
+        self.watcher.set_index('session', 10)
+        self.watcher.set_index('era', {'index': 3, 'start': None})
+        self.assertEqual(self.watcher.indexes['era'], 3)
+
+        self.client.storage[('Session', 'NextKeys')] = {'aura': '0x01'}
+        self.watcher.get(self.client, 'session', 'Session', 'NextKeys', ['alice'])
+        self.watcher.invalidate('Session', 'NextKeys')
+        self.client.storage[('Session', 'NextKeys')] = {'aura': '0x02'}
+        self.assertEqual(self.watcher.get(self.client, 'session', 'Session', 'NextKeys', ['alice']), {'aura': '0x02'})
+
+
+if __name__ == '__main__':
+    unittest.main()
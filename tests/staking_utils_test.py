@@ -0,0 +1,51 @@
+import os
+import unittest
+from unittest import mock
+
+from substrateinterface import Keypair
+
+from app.lib import staking_utils
+from app.lib.staking_utils import count_validator_nominators, get_validator_nominator_address
+
+ROOT_SEED = Keypair.generate_mnemonic()
+
+
+def account(nonce):
+    return {'nonce': nonce, 'providers': 1, 'data': {'free': 10 ** 12}}
+
+
+@mock.patch.dict(os.environ, {'DERIVATION_ROOT_SEED': ROOT_SEED})
+class StakingUtilsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.existing_accounts = {}
+        self.queried_addresses = []
+
+    def query_storage_multi(self, substrate_client, module, function, params_list, at=None):
+        self.queried_addresses.extend(map(lambda params: params[0], params_list))
+        return list(map(lambda params: self.existing_accounts.get(params[0], {'nonce': 0, 'providers': 0}),
+                        params_list))
+
+    def create_nominators(self, validator_name, count):
+        for index in range(count):
+            self.existing_accounts[get_validator_nominator_address(validator_name, index)] = account(index)
+
+    def test_count_validator_nominators(self):
+        self.create_nominators('validator-a', 3)
+        self.create_nominators('validator-b', 10)
+        with mock.patch.object(staking_utils, 'query_storage_multi', side_effect=self.query_storage_multi):
+            counts = count_validator_nominators(None, ['validator-a', 'validator-b', 'validator-c'])
+            self.assertEqual(counts, {'validator-a': 3, 'validator-b': 10, 'validator-c': 0})
+            # validator-b has more nominators than a page
+            self.assertEqual(len(self.queried_addresses), 4 * staking_utils.NOMINATOR_DISCOVERY_PAGE_SIZE)
+
+            # only the following indexes are checked on the next call
+            self.queried_addresses = []
+            self.create_nominators('validator-a', 4)
+            counts = count_validator_nominators(None, ['validator-a', 'validator-b'], counts)
+            self.assertEqual(counts, {'validator-a': 4, 'validator-b': 10})
+            self.assertNotIn(get_validator_nominator_address('validator-a', 0), self.queried_addresses)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import os
+import queue
+import unittest
+from unittest import mock
+
+from substrateinterface.exceptions import SubstrateRequestException
+
+from app.lib import substrate_async
+from app.lib.nonce_manager import NonceManager
+from app.lib.substrate_async import AsyncRpcClient, async_wait_for_funds, close_idle_async_rpc_clients, \
+    async_submit_pipelined_extrinsic
+
+
+# Websocket answering requests in reverse order, as a node handling them concurrently could do
+class FakeNodeWebsocket:
+
+    def __init__(self, batch_size=1):
+        self.batch_size = batch_size
+        self.received = []
+        self.frames = queue.Queue()
+
+    def send(self, data):
+        request = json.loads(data)
+        self.received.append(request)
+        if request['method'] == 'author_submitAndWatchExtrinsic':
+            # notification sent before the subscription id
+            self.frames.put({'jsonrpc': '2.0', 'method': 'author_extrinsicUpdate',
+                             'params': {'subscription': 'sub-1', 'result': 'ready'}})
+            self.frames.put({'jsonrpc': '2.0', 'id': request['id'], 'result': 'sub-1'})
+            self.frames.put({'jsonrpc': '2.0', 'method': 'author_extrinsicUpdate',
+                             'params': {'subscription': 'sub-1', 'result': {'inBlock': '0x01'}}})
+        elif len(self.received) % self.batch_size == 0:
+            for request in reversed(self.received[-self.batch_size:]):
+                if request['method'] == 'fail':
+                    self.frames.put({'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -1, 'message': 'fail'}})
+                else:
+                    self.frames.put({'jsonrpc': '2.0', 'id': request['id'], 'result': request['params']})
+
+    def recv(self):
+        frame = self.frames.get()
+        if isinstance(frame, Exception):
+            raise frame
+        return json.dumps(frame)
+
+    def close(self):
+        self.frames.put(ConnectionError('closed'))
+
+
+class AsyncRpcClientTest(unittest.TestCase):
+
+    def run_with_client(self, websocket, coroutine):
+        async def run():
+            client = AsyncRpcClient('ws://node', connect=lambda url, **kwargs: websocket)
+            try:
+                return await coroutine(client)
+            finally:
+                client.close()
+        return asyncio.run(run())
+
+    def test_requests_are_multiplexed(self):
+        websocket = FakeNodeWebsocket(batch_size=3)
+
+        async def requests(client):
+            return await asyncio.gather(*[client.request('echo', [i]) for i in range(3)])
+        self.assertEqual(self.run_with_client(websocket, requests), [[0], [1], [2]])
+
+    def test_request_error(self):
+        async def failing_request(client):
+            return await client.request('fail')
+        with self.assertRaises(SubstrateRequestException):
+            self.run_with_client(FakeNodeWebsocket(), failing_request)
+
+    def test_subscription_keeps_early_notifications(self):
+        async def subscription(client):
+            subscription_id, updates = await client.subscribe('author_submitAndWatchExtrinsic', ['0x00'])
+            return subscription_id, [await updates.get(), await updates.get()]
+        subscription_id, updates = self.run_with_client(FakeNodeWebsocket(), subscription)
+        self.assertEqual(subscription_id, 'sub-1')
+        self.assertEqual(updates, ['ready', {'inBlock': '0x01'}])
+
+    def test_connection_lost_fails_pending_requests(self):
+        websocket = FakeNodeWebsocket(batch_size=2)
+
+        async def lost_connection(client):
+            request = asyncio.ensure_future(client.request('echo'))
+            await asyncio.sleep(0.1)
+            websocket.frames.put(ConnectionError('reset'))
+            return await request
+        with self.assertRaises(ConnectionError):
+            self.run_with_client(websocket, lost_connection)
+
+    @mock.patch.dict(os.environ, {'WS_POOL_CAPACITY': '1', 'WS_POOL_IDLE_TIMEOUT': '60'})
+    def test_idle_clients_are_closed(self):
+        async def close_idle_clients():
+            loop = asyncio.get_running_loop()
+            clients = {url: AsyncRpcClient(url) for url in ['ws://idle', 'ws://busy', 'ws://recent']}
+            clients['ws://idle'].last_used -= 120
+            clients['ws://busy'].last_used -= 120
+            clients['ws://busy'].pending[1] = loop.create_future()
+            substrate_async.async_rpc_clients.clear()
+            for url, client in clients.items():
+                substrate_async.async_rpc_clients[(url, loop)] = client
+            try:
+                close_idle_async_rpc_clients()
+                return clients, [url for url, _ in substrate_async.async_rpc_clients]
+            finally:
+                substrate_async.async_rpc_clients.clear()
+        clients, urls = asyncio.run(close_idle_clients())
+        # over capacity, but the client with an in-flight request is kept
+        self.assertEqual(urls, ['ws://busy'])
+        self.assertTrue(clients['ws://idle'].closed)
+        self.assertTrue(clients['ws://recent'].closed)
+        self.assertFalse(clients['ws://busy'].closed)
+
+    @mock.patch.dict(os.environ, {'WS_POOL_CAPACITY': '1', 'WS_POOL_IDLE_TIMEOUT': '60'})
+    def test_clients_of_other_loops_are_not_closed(self):
+        other_loop, closed_loop = asyncio.new_event_loop(), asyncio.new_event_loop()
+        closed_loop.close()
+        clients = {url: AsyncRpcClient(url, loop=other_loop) for url in ['ws://other-loop', 'ws://closed-loop']}
+        clients['ws://other-loop'].last_used -= 120
+
+        async def close_idle_clients():
+            substrate_async.async_rpc_clients.clear()
+            substrate_async.async_rpc_clients[('ws://other-loop', other_loop)] = clients['ws://other-loop']
+            substrate_async.async_rpc_clients[('ws://closed-loop', closed_loop)] = clients['ws://closed-loop']
+            try:
+                close_idle_async_rpc_clients()
+                return [url for url, _ in substrate_async.async_rpc_clients]
+            finally:
+                substrate_async.async_rpc_clients.clear()
+        try:
+            urls = asyncio.run(close_idle_clients())
+        finally:
+            other_loop.close()
+        # idle, but it may be handed out by its own loop meanwhile
+        self.assertEqual(urls, ['ws://other-loop'])
+        self.assertFalse(clients['ws://other-loop'].closed)
+        self.assertTrue(clients['ws://closed-loop'].closed)
+
+
+class FakeAccountStorageKey:
+
+    def __init__(self, address):
+        self.address = address
+
+    @classmethod
+    def create_from_storage_function(cls, pallet, storage_function, params, runtime_config=None, metadata=None):
+        return cls(params[0])
+
+    def to_hex(self):
+        return '0x' + self.address.encode().hex()
+
+    def decode_scale_value(self, data):
+        return mock.Mock(value={'data': {'free': int(data.to_hex(), 16)}})
+
+
+# Node notifying the changes of the watched accounts
+class FakeRpcClient:
+
+    def __init__(self, change_sets):
+        self.change_sets = change_sets
+        self.subscriptions = []
+
+    async def subscribe(self, method, params=None):
+        change_sets = asyncio.Queue()
+        self.subscriptions.append(method)
+
+        async def notify():
+            for changes in self.change_sets:
+                await asyncio.sleep(0.01)
+                change_sets.put_nowait({'block': '0x01', 'changes': [
+                    ['0x' + address.encode().hex(), None if free is None else f'0x{free:08x}']
+                    for address, free in changes]})
+        asyncio.ensure_future(notify())
+        return 'sub-1', change_sets
+
+    async def unsubscribe(self, method, subscription_id):
+        self.subscriptions.remove('state_subscribeStorage')
+
+
+class AsyncWaitForFundsTest(unittest.TestCase):
+
+    def wait_for_funds(self, rpc_client, timeout=1):
+        async def get_async_rpc_client(url):
+            return rpc_client
+        with mock.patch.multiple(substrate_async, get_async_rpc_client=get_async_rpc_client,
+                                 StorageKey=FakeAccountStorageKey):
+            return asyncio.run(async_wait_for_funds(mock.Mock(url='ws://collator'), ['alice', 'bob'], 100, timeout))
+
+    def test_funds_arrive(self):
+        rpc_client = FakeRpcClient([[('alice', None), ('bob', 10)], [('alice', 100)], [('bob', 200)]])
+        self.assertEqual(self.wait_for_funds(rpc_client), {'alice', 'bob'})
+        self.assertEqual(rpc_client.subscriptions, [])
+
+    def test_funds_timeout(self):
+        rpc_client = FakeRpcClient([[('alice', 150), ('bob', 10)]])
+        self.assertEqual(self.wait_for_funds(rpc_client, 0.1), {'alice'})
+        self.assertEqual(rpc_client.subscriptions, [])
+
+
+
+# Node watching the submitted extrinsics: the extrinsic with nonce 0 is dropped, the next ones wait for it
+class FakeExtrinsicRpcClient:
+
+    def __init__(self):
+        self.watched = []
+
+    async def subscribe(self, method, params=None):
+        updates = asyncio.Queue()
+        self.watched.append(params[0])
+        updates.put_nowait('ready' if params[0] == '0' else 'future')
+        if params[0] == '0':
+            async def drop():
+                await asyncio.sleep(0.05)
+                updates.put_nowait('dropped')
+            asyncio.ensure_future(drop())
+        return params[0], updates
+
+    async def unsubscribe(self, method, subscription_id):
+        self.watched.remove(subscription_id)
+
+
+class AsyncSubmitExtrinsicTest(unittest.TestCase):
+
+    def submit(self, rpc_client, nonces):
+        async def get_async_rpc_client(url):
+            return rpc_client
+
+        async def submit_extrinsics():
+            nonce_manager = NonceManager('5Alice')
+            nonce_manager.nonce = max(nonces) + 1
+            return await asyncio.gather(*map(lambda nonce: async_submit_pipelined_extrinsic(
+                mock.Mock(url='ws://relay'), mock.Mock(extrinsic_hash=bytes([nonce]), data=str(nonce)), nonce_manager,
+                nonce), nonces)), nonce_manager
+        with mock.patch.object(substrate_async, 'get_async_rpc_client', get_async_rpc_client):
+            return asyncio.run(submit_extrinsics())
+
+    def test_later_nonces_are_aborted(self):
+        rpc_client = FakeExtrinsicRpcClient()
+        receipts, nonce_manager = self.submit(rpc_client, [0, 1, 2])
+        self.assertEqual(receipts, [False, False, False])
+        self.assertEqual(rpc_client.watched, [])
+        self.assertEqual(nonce_manager.in_flight, {})
+        # resync with the chain
+        self.assertIsNone(nonce_manager.nonce)
+
+    @mock.patch.dict(os.environ, {"EXTRINSIC_INCLUSION_TIMEOUT": "0.1"})
+    def test_future_extrinsic_timeout(self):
+        rpc_client = FakeExtrinsicRpcClient()
+        receipts, nonce_manager = self.submit(rpc_client, [1])
+        self.assertEqual(receipts, [False])
+        self.assertEqual(rpc_client.watched, [])
+        # the nonce is given back
+        self.assertEqual(nonce_manager.nonce, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+from app.lib import substrate
+from app.lib.substrate import split_batch_call, BatchReceipt, combine_futures, weight_as_dict, \
+    substrate_batchall_call, completed_future
+from tests.test_utils import FakeReceipt, FakeCall
+
+
+def receipt(is_success, error_message=None):
+    return FakeReceipt(is_success, error_message,
+                       triggered_events=['ExtrinsicSuccess'] if is_success else ['ExtrinsicFailed'])
+
+
+def call(call_function, length=10):
+    return FakeCall('System', call_function, data=b'\x00' * length)
+
+
+def weight(ref_time, proof_size=0):
+    return {'ref_time': ref_time, 'proof_size': proof_size}
+
+
+class SubstrateBatchTest(unittest.TestCase):
+
+    def test_split_batch_call(self):
+        limits = {'ref_time': 100, 'proof_size': 1000, 'length': 100}
+        # by weight
+        self.assertEqual(split_batch_call([weight(40)] * 5, [10] * 5, limits), [[0, 1], [2, 3], [4]])
+        # by proof size
+        self.assertEqual(split_batch_call([weight(1, 600)] * 3, [10] * 3, limits), [[0], [1], [2]])
+        # by length
+        self.assertEqual(split_batch_call([weight(1)] * 4, [30] * 4, limits), [[0, 1, 2], [3]])
+        # a call over the limits gets its own chunk
+        self.assertEqual(split_batch_call([weight(10), weight(500), weight(10)], [10] * 3, limits), [[0], [1], [2]])
+        self.assertEqual(split_batch_call([weight(10)] * 3, [10] * 3, limits), [[0, 1, 2]])
+
+    def batchall_call(self, batch_call, rejected_chunks=(), pipelined=False):
+        chunk_calls = []
+
+        def substrate_batch_chunk_call(substrate_client, keypair, batch_call, wait, sudo, pipelined=False):
+            chunk_calls.append(list(map(lambda call: call.value['call_function'], batch_call)))
+            chunk_receipt = False if len(chunk_calls) - 1 in rejected_chunks else receipt(True)
+            return completed_future(chunk_receipt) if pipelined else chunk_receipt
+        weights = {'set_code': weight(80), 'remark': weight(1)}
+        with mock.patch.multiple(substrate,
+                                 get_batch_chunk_limits=mock.Mock(
+                                     return_value={'ref_time': 100, 'proof_size': 1000, 'length': 100}),
+                                 get_query_weight=lambda client, call: weights[call.value['call_function']],
+                                 substrate_batch_chunk_call=substrate_batch_chunk_call):
+            batch_receipt = substrate_batchall_call(None, mock.Mock(), batch_call, pipelined=pipelined)
+        return chunk_calls, batch_receipt.result() if pipelined else batch_receipt
+
+    def test_small_heavy_batch_is_split(self):
+        for pipelined in [False, True]:
+            chunk_calls, batch_receipt = self.batchall_call([call('set_code'), call('set_code'), call('remark')],
+                                                            pipelined=pipelined)
+            self.assertEqual(chunk_calls, [['set_code'], ['set_code', 'remark']])
+            self.assertEqual(batch_receipt.chunks, [[0], [1, 2]])
+            self.assertTrue(batch_receipt.is_success)
+
+    def test_rejected_chunk(self):
+        # the chunks of a synchronous call are submitted one after the other
+        chunk_calls, batch_receipt = self.batchall_call([call('set_code'), call('set_code'), call('set_code')],
+                                                        rejected_chunks=[0])
+        # the next chunks are still submitted
+        self.assertEqual(len(chunk_calls), 3)
+        self.assertFalse(batch_receipt.is_success)
+        self.assertEqual(batch_receipt.failed_indexes(), [0])
+
+    def test_weight_v1(self):
+        self.assertEqual(weight_as_dict(100), {'ref_time': 100, 'proof_size': 0})
+
+    def test_batch_receipt(self):
+        batch_receipt = BatchReceipt([[0, 1], [2, 3], [4]],
+                                     [receipt(True), receipt(False, {'name': 'InsufficientBalance'}), False])
+        self.assertFalse(batch_receipt.is_success)
+        self.assertEqual(batch_receipt.error_message, {'name': 'InsufficientBalance'})
+        self.assertEqual(batch_receipt.chunk_of(3), 1)
+        self.assertEqual(batch_receipt.failed_indexes(), [2, 3, 4])
+        self.assertEqual(batch_receipt.triggered_events, ['ExtrinsicSuccess', 'ExtrinsicFailed'])
+
+        self.assertTrue(BatchReceipt([[0], [1]], [receipt(True), receipt(True)]).is_success)
+
+    def test_combine_futures(self):
+        futures = [Future(), Future()]
+        combined_future = combine_futures(futures, sum)
+        futures[1].set_result(2)
+        self.assertFalse(combined_future.done())
+        futures[0].set_result(1)
+        self.assertEqual(combined_future.result(timeout=1), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
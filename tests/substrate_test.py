@@ -5,8 +5,9 @@ from testcontainers.core.container import DockerContainer
 from substrateinterface import Keypair
 
 
-from app.lib.substrate import get_substrate_client, get_sudo_keys, substrate_call, substrate_proxy_call, substrate_check_sudo_key_and_call
-from app.lib.balance_utils import get_funds
+from app.lib.substrate import get_substrate_client, get_sudo_keys, substrate_call, substrate_proxy_call, substrate_check_sudo_key_and_call, \
+    substrate_query, get_pinned_block_hash, storage_cache, query_storage_multi
+from app.lib.balance_utils import get_funds, get_funds_multi
 from tests.test_constants import RPC_DEV_FLAGS
 from tests.test_utils import wait_for_http_ready
 
@@ -113,6 +114,22 @@ class SubstrateTest(unittest.TestCase):
         result = substrate_check_sudo_key_and_call(self.polkadot_node_client, keypair, payload, True)
         self.assertEqual(result, None, "Successfully run proxy call")
 
+    def test_substrate_query_at(self):
+        block_hash = get_pinned_block_hash(self.polkadot_node_client)
+        sudo = substrate_query(self.polkadot_node_client, 'Sudo', 'Key', at=block_hash)
+        self.assertEqual(sudo, self.alice_key_address)
+        self.assertEqual(storage_cache[(block_hash, 'Sudo', 'Key', '[]')], sudo, "Value read at a block hash is cached")
+        self.assertEqual(substrate_query(self.polkadot_node_client, 'Sudo', 'Key', at=block_hash), sudo)
+
+    def test_query_storage_multi(self):
+        unknown_address = Keypair.create_from_mnemonic(Keypair.generate_mnemonic()).ss58_address
+        accounts = query_storage_multi(self.polkadot_node_client, 'System', 'Account',
+                                       [[self.alice_key_address], [unknown_address]])
+        self.assertEqual(accounts[0]['data']['free'], get_funds(self.polkadot_node_client, self.alice_key_address))
+        self.assertEqual(accounts[1]['data']['free'], 0, "Account which doesn't exist has the default value")
+        self.assertEqual(get_funds_multi(self.polkadot_node_client, [self.alice_key_address, unknown_address]),
+                         {self.alice_key_address: accounts[0]['data']['free'], unknown_address: 0})
+
 
 if __name__ == '__main__':
     unittest.main()
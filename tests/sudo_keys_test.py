@@ -0,0 +1,57 @@
+import unittest
+from unittest import mock
+
+from app.lib import substrate
+from app.lib.substrate import get_cached_sudo_keys, invalidate_sudo_keys, is_sudo_keys_changing_call, \
+    check_sudo_keys_error
+from tests.test_utils import FakeSubstrateClient, FakeReceipt
+
+
+def proxies(delegates):
+    return [list(map(lambda delegate: {'delegate': delegate}, delegates)), 0]
+
+
+def call(module, function, **args):
+    return {'call_module': module, 'call_function': function, 'call_args': args}
+
+
+class SudoKeysTest(unittest.TestCase):
+
+    def setUp(self):
+        substrate.sudo_keys_cache.clear()
+        self.substrate_client = FakeSubstrateClient(storage={('Sudo', 'Key'): '5Alice',
+                                                             ('Proxy', 'Proxies'): proxies(['5Dave'])})
+
+    def test_sudo_keys_are_cached(self):
+        self.assertEqual(get_cached_sudo_keys(self.substrate_client), {'sudo': '5Alice', 'proxies': ['5Dave']})
+        self.assertEqual(get_cached_sudo_keys(self.substrate_client), {'sudo': '5Alice', 'proxies': ['5Dave']})
+        self.assertEqual(len(self.substrate_client.queries), 2)
+
+        self.substrate_client.storage[('Sudo', 'Key')] = '5Bob'
+        invalidate_sudo_keys('ws://relay')
+        self.assertEqual(get_cached_sudo_keys(self.substrate_client)['sudo'], '5Bob')
+
+    def test_sudo_keys_expire(self):
+        get_cached_sudo_keys(self.substrate_client)
+        with mock.patch.object(substrate.time, 'monotonic',
+                               return_value=substrate.time.monotonic() + substrate.SUDO_KEYS_CACHE_TTL):
+            get_cached_sudo_keys(self.substrate_client)
+        self.assertEqual(len(self.substrate_client.queries), 4)
+
+    def test_sudo_keys_error_invalidates(self):
+        get_cached_sudo_keys(self.substrate_client)
+        check_sudo_keys_error(self.substrate_client, FakeReceipt(False, {'name': 'InsufficientBalance'}))
+        self.assertIn('ws://relay', substrate.sudo_keys_cache)
+        check_sudo_keys_error(self.substrate_client, FakeReceipt(False, {'name': 'RequireSudo'}))
+        self.assertNotIn('ws://relay', substrate.sudo_keys_cache)
+
+    def test_is_sudo_keys_changing_call(self):
+        self.assertTrue(is_sudo_keys_changing_call(call('Sudo', 'set_key', new='5Bob')))
+        self.assertTrue(is_sudo_keys_changing_call(call('Sudo', 'sudo', call=call('Proxy', 'add_proxy'))))
+        self.assertTrue(is_sudo_keys_changing_call(
+            call('Utility', 'batch', calls=[call('Balances', 'transfer_keep_alive'), call('Proxy', 'remove_proxy')])))
+        self.assertFalse(is_sudo_keys_changing_call(call('Sudo', 'sudo', call=call('Balances', 'force_set_balance'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,4 +18,147 @@ def wait_for_http_ready(url):
                 break
         except Exception:
             pass
-        sleep(1)
\ No newline at end of file
+        sleep(1)
+
+
+# Fakes of the substrate-interface objects for the unit tests (no node needed)
+class FakeQueryResult:
+
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeReceipt:
+
+    def __init__(self, is_success=True, error_message=None, triggered_events=None, block_hash='0xblock'):
+        self.is_success = is_success
+        self.error_message = error_message
+        self.triggered_events = triggered_events or []
+        self.extrinsic_hash = '0x01'
+        self.block_hash = block_hash
+
+
+class FakeEvent:
+
+    def __init__(self, event_id, attributes=None):
+        self.value = {'event_id': event_id, 'attributes': attributes}
+
+
+# Composed call: encode() returns the call params so that the tests can check what was sent in a XCM
+class FakeCall:
+
+    def __init__(self, call_module='System', call_function='remark', call_params=None, data=b''):
+        self.value = {'call_module': call_module, 'call_function': call_function, 'call_args': call_params}
+        self.call_params = call_params
+        self.data = data
+
+    def encode(self):
+        return self.call_params
+
+
+class FakeScaleObject:
+
+    def __init__(self, value=None, data=b'\x00' * 100):
+        self.value = value
+        self.data = data
+
+    def encode(self, value):
+        self.value = value
+
+
+class FakeStorageKey:
+
+    def __init__(self, pallet, storage_function):
+        self.pallet = pallet
+        self.storage_function = storage_function
+
+    def to_hex(self):
+        return f'0x{self.pallet}_{self.storage_function}'
+
+
+# SubstrateInterface answering from dicts, the requests it receives are recorded:
+# - storage: {(module, function): value}, the value of a storage map is a dict {key: value}
+# - rpc_results: {method: result}
+# - constants: {(module, name): value}
+# - runtime_call_results: {(api, method): value}
+# A callable value is called with the client (eg. for values depending on the runtime version).
+class FakeSubstrateClient:
+
+    def __init__(self, url='ws://relay', storage=None, rpc_results=None, constants=None, runtime_call_results=None,
+                 runtime_version=None, chain_head='0x01'):
+        self.url = url
+        self.storage = storage or {}
+        self.rpc_results = rpc_results or {}
+        self.constants = constants or {}
+        self.runtime_call_results = runtime_call_results or {}
+        self.runtime_version = runtime_version
+        self.chain_head = chain_head
+        # extrinsics are rejected by the node
+        self.rejected = False
+        self.queries = []
+        self.block_hashes = []
+        self.requests = []
+        self.signed = []
+        self.submitted = []
+
+    def value(self, value):
+        return value(self) if callable(value) else value
+
+    def init_runtime(self):
+        if self.runtime_version is None:
+            self.runtime_version = 1000
+
+    def get_chain_head(self):
+        return self.chain_head
+
+    def query(self, module, function, params=None, block_hash=None):
+        self.queries.append((module, function))
+        self.block_hashes.append(block_hash)
+        return FakeQueryResult(self.value(self.storage[(module, function)]))
+
+    def query_map(self, module, function, params=None, page_size=100, block_hash=None):
+        self.queries.append((module, function))
+        self.block_hashes.append(block_hash)
+        return list(map(lambda item: (FakeQueryResult(item[0]), FakeQueryResult(item[1])),
+                        self.value(self.storage[(module, function)]).items()))
+
+    def get_storage_by_key(self, block_hash, storage_key):
+        self.requests.append(('get_storage_by_key', [block_hash, storage_key]))
+        return self.value(self.storage[storage_key])
+
+    def create_storage_key(self, pallet, storage_function, params=None):
+        return FakeStorageKey(pallet, storage_function)
+
+    def rpc_request(self, method, params, result_handler=None):
+        self.requests.append((method, params))
+        return {'result': self.value(self.rpc_results.get(method))}
+
+    def get_constant(self, module, name):
+        self.requests.append((f'{module}.{name}', []))
+        return FakeQueryResult(self.value(self.constants[(module, name)]))
+
+    def runtime_call(self, api, method, params):
+        self.requests.append((f'{api}_{method}', params))
+        return FakeScaleObject(self.value(self.runtime_call_results[(api, method)]))
+
+    def compose_call(self, call_module, call_function, call_params=None):
+        return FakeCall(call_module, call_function, call_params)
+
+    def create_scale_object(self, type_string):
+        return FakeScaleObject()
+
+    def create_signed_extrinsic(self, call, keypair, nonce=None):
+        self.signed.append((keypair, nonce))
+        return FakeScaleObject(call)
+
+    def create_unsigned_extrinsic(self, call):
+        return FakeScaleObject(call)
+
+    def submit_extrinsic(self, extrinsic, wait_for_inclusion=False):
+        if self.rejected:
+            raise Exception('1014: Priority is too low')
+        self.submitted.append(extrinsic.value)
+        return FakeReceipt(True)
+
+    def requested_methods(self):
+        return list(map(lambda request: request[0], self.requests))
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+from kubernetes.client import V1ObjectMeta, V1Pod
+
+from app.lib import network_utils
+from app.lib.validator_manager import ValidatorSetSnapshot
+from tests.test_utils import FakeReceipt
+
+
+def pod(name):
+    return V1Pod(metadata=V1ObjectMeta(name=name, labels={}))
+
+
+class ValidatorRegistrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.set_keys_threads = set()
+        self.registered = []
+        self.set_keys_registering = set()
+
+    def rotate_validator_session_keys(self, node_name):
+        if node_name == 'validator-down':
+            raise Exception('{} is not ready'.format(node_name))
+        return '0x' + node_name.encode().hex()
+
+    def set_validator_session_keys(self, node_name, node_session_key, register=False):
+        self.set_keys_threads.add(threading.current_thread().name)
+        self.set_keys_registering.add(register)
+        # waiting for the inclusion
+        time.sleep(0.2)
+        if node_name == 'validator-stuck':
+            time.sleep(1)
+
+    def register_validator_addresses(self, addresses):
+        self.registered.extend(addresses)
+        return FakeReceipt(True)
+
+    def register(self, pods, validator_set_snapshot):
+        with mock.patch.object(network_utils, 'get_validator_set_snapshot', return_value=validator_set_snapshot), \
+                mock.patch.object(network_utils, 'get_validator_account_from_pod',
+                                  side_effect=lambda pod: pod.metadata.name + '-stash'), \
+                mock.patch.object(network_utils, 'get_derived_node_stash_account_address',
+                                  side_effect=lambda seed, node_name: node_name + '-stash'), \
+                mock.patch.object(network_utils, 'prewarm_validator_accounts'), \
+                mock.patch.object(network_utils, 'get_relay_chain_client'), \
+                mock.patch.object(network_utils, 'fund_accounts'), \
+                mock.patch.object(network_utils, 'rotate_validator_session_keys',
+                                  side_effect=self.rotate_validator_session_keys), \
+                mock.patch.object(network_utils, 'set_validator_session_keys',
+                                  side_effect=self.set_validator_session_keys), \
+                mock.patch.object(network_utils, 'register_validator_addresses',
+                                  side_effect=self.register_validator_addresses):
+            return asyncio.run(network_utils.register_validator_pods(pods))
+
+    @mock.patch.dict(os.environ, {"RELAY_CHAIN_CONSENSUS": "poa", "REGISTRATION_NODE_TIMEOUT": "0.8"})
+    def test_register_validator_pods_reports_each_node(self):
+        start = time.monotonic()
+        results = self.register([pod('validator-0'), pod('validator-1'), pod('validator-2'), pod('validator-down'),
+                                 pod('validator-stuck'), pod('validator-active')],
+                                ValidatorSetSnapshot('0x01', ['validator-active-stash']))
+
+        self.assertEqual({node: result['status'] for node, result in results.items()}, {
+            'validator-0': 'registered', 'validator-1': 'registered', 'validator-2': 'registered',
+            'validator-down': 'failed', 'validator-stuck': 'unknown', 'validator-active': 'already_registered'})
+        self.assertEqual(results['validator-down']['stage'], 'rotate_keys')
+        self.assertEqual(results['validator-down']['error'], 'validator-down is not ready')
+        self.assertEqual(results['validator-stuck']['stage'], 'set_keys')
+        self.assertEqual(results['validator-stuck']['error'], 'timed out after 0.8s')
+        self.assertEqual(results['validator-0']['stage'], 'register')
+        # registered in a single call, once all the nodes went through the set keys stage
+        self.assertEqual(sorted(self.registered), ['validator-0-stash', 'validator-1-stash', 'validator-2-stash'])
+        # the session keys are set concurrently
+        self.assertGreater(len(self.set_keys_threads), 1)
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    @mock.patch.dict(os.environ, {"RELAY_CHAIN_CONSENSUS": "pos"})
+    def test_register_pos_validator_pods(self):
+        results = self.register([pod('validator-0'), pod('validator-down')], ValidatorSetSnapshot('0x01'))
+
+        self.assertEqual(results['validator-0']['status'], 'registered')
+        self.assertEqual(results['validator-0']['stage'], 'set_keys')
+        self.assertEqual(results['validator-down']['status'], 'failed')
+        # PoS validators are bonded and validate instead of being added with a sudo call
+        self.assertEqual(self.set_keys_registering, {True})
+        self.assertEqual(self.registered, [])
+
+    @mock.patch.dict(os.environ, {"RELAY_CHAIN_CONSENSUS": "pos"})
+    def test_register_aborts_without_validator_set(self):
+        # the validator set can't be read
+        results = self.register([pod('validator-0')], None)
+        self.assertEqual(results['validator-0']['status'], 'failed')
+        self.assertEqual(results['validator-0']['stage'], 'validator_set')
+        self.assertEqual(self.set_keys_registering, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
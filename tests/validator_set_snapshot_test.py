@@ -0,0 +1,66 @@
+import os
+import unittest
+from unittest import mock
+
+from app.lib import substrate, validator_manager
+from app.lib.substrate import query_storage
+from app.lib.validator_manager import get_validator_set_snapshot
+from tests.test_utils import FakeSubstrateClient
+
+
+def fake_client(storage, staking_validators):
+    storage[('Staking', 'Validators')] = dict.fromkeys(staking_validators, {})
+    return FakeSubstrateClient(storage=storage)
+
+
+class ValidatorSetSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        substrate.storage_cache.clear()
+        substrate.pinned_block_hashes.clear()
+
+    @mock.patch.dict(os.environ, {"RELAY_CHAIN_CONSENSUS": "pos"})
+    def test_pos_snapshot_is_read_at_one_block(self):
+        client = fake_client({('Session', 'Validators'): ['alice', 'bob']}, ['alice', 'charlie'])
+        with mock.patch.object(validator_manager, 'get_substrate_client', return_value=client):
+            snapshot = get_validator_set_snapshot('ws://relay')
+        self.assertEqual(client.block_hashes, ['0x01', '0x01'])
+        self.assertEqual(snapshot.validators, ['alice', 'bob'])
+        self.assertEqual(snapshot.status('alice'), True)
+        self.assertEqual(snapshot.status('bob'), 'pending_deletion')
+        self.assertEqual(snapshot.status('charlie'), 'pending_addition')
+        self.assertEqual(snapshot.status('dave'), False)
+        self.assertTrue(snapshot.is_registered('charlie'))
+        self.assertFalse(snapshot.is_registered('dave'))
+
+        # Storage read at the same block is served from the cache
+        with mock.patch.object(validator_manager, 'get_substrate_client', return_value=client):
+            get_validator_set_snapshot('ws://relay', at='0x01')
+        self.assertEqual(len(client.block_hashes), 2)
+
+    @mock.patch.dict(os.environ, {"RELAY_CHAIN_CONSENSUS": "poa"})
+    def test_poa_snapshot(self):
+        client = fake_client({('Session', 'Validators'): ['alice'],
+                                      ('ValidatorManager', 'ValidatorsToAdd'): ['bob'],
+                                      ('ValidatorManager', 'ValidatorsToRetire'): []}, [])
+        with mock.patch.object(validator_manager, 'get_substrate_client', return_value=client):
+            snapshot = get_validator_set_snapshot('ws://relay')
+        self.assertEqual(client.block_hashes, ['0x01', '0x01', '0x01'])
+        self.assertEqual(snapshot.status('bob'), 'pending_addition')
+        self.assertEqual(snapshot.to_retire, set())
+
+    def test_cached_values_are_copies(self):
+        client = fake_client({('Session', 'Validators'): ['alice']}, [])
+        query_storage(client, 'Session', 'Validators', at='0x01').append('mallory')
+        self.assertEqual(query_storage(client, 'Session', 'Validators', at='0x01'), ['alice'])
+        self.assertEqual(len(client.block_hashes), 1)
+
+    @mock.patch.dict(os.environ, {"RELAY_CHAIN_CONSENSUS": "poa"})
+    def test_snapshot_read_error(self):
+        client = fake_client({('Session', 'Validators'): ['alice']}, [])
+        with mock.patch.object(validator_manager, 'get_substrate_client', return_value=client):
+            self.assertIsNone(get_validator_set_snapshot('ws://relay'))
+
+
+if __name__ == '__main__':
+    unittest.main()